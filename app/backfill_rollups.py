@@ -0,0 +1,47 @@
+import argparse
+import datetime
+import logging
+
+from db.db import get_db
+from db.utils import check_daily_rollups, refresh_daily_rollups
+from sqlalchemy.orm import Session
+
+logging.basicConfig(level=logging.INFO)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Backfill the daily rollups of a location or check them against the raw data.")
+    parser.add_argument("--client", type=int, required=True)
+    parser.add_argument("--location", type=int, required=True)
+    parser.add_argument("--from", dest="start_date", type=datetime.date.fromisoformat, required=True)
+    parser.add_argument("--to", dest="end_date", type=datetime.date.fromisoformat, required=True)
+    parser.add_argument("--days-per-batch", type=int, default=31, help="Days refreshed per transaction")
+    parser.add_argument("--check", action="store_true", help="Only compare the stored rollups against the raw data")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    db_gen = get_db()
+    db: Session = next(db_gen)
+    try:
+        batch_start = datetime.datetime.combine(args.start_date, datetime.time())
+        end_date = datetime.datetime.combine(args.end_date, datetime.time())
+        while batch_start <= end_date:
+            batch_end = min(batch_start + datetime.timedelta(days=args.days_per_batch - 1), end_date)
+            if args.check:
+                mismatches = check_daily_rollups(db, args.client, args.location, batch_start, batch_end)
+                if mismatches.empty:
+                    logging.info("Rollups from %s to %s match the raw data.", batch_start.date(), batch_end.date())
+                else:
+                    logging.warning("Rollups from %s to %s differ from the raw data:\n%s", batch_start.date(), batch_end.date(), mismatches.to_string())
+            else:
+                row_count = refresh_daily_rollups(db, args.client, args.location, batch_start, batch_end)
+                logging.info("Refreshed %s rollup rows from %s to %s.", row_count, batch_start.date(), batch_end.date())
+            batch_start = batch_end + datetime.timedelta(days=1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
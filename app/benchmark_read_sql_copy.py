@@ -0,0 +1,100 @@
+import argparse
+import datetime
+import io
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+from db.utils import get_gen_datas_grouped
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+logging.basicConfig(level=logging.INFO)
+
+GEN_DATA_DDL = """
+CREATE TABLE IF NOT EXISTS gen_data (
+    cli_id integer NOT NULL,
+    gen_id integer NOT NULL,
+    data_date timestamp NOT NULL,
+    data_type_id integer NOT NULL,
+    data_pro_id integer,
+    data_value double precision,
+    data_date_added timestamptz,
+    PRIMARY KEY (cli_id, gen_id, data_date, data_type_id)
+)
+"""
+DATA_TYPE_NAMES = {501: 'power', 502: 'ac_production', 508: 'ac_production_prediction'}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare read_sql and read_sql_copy reading synthetic gen_data. "
+                                                 "Run it against a scratch database, the gen_data table is created if missing.")
+    parser.add_argument("--url", required=True, help="URL of a scratch database, database.ini is never used")
+    parser.add_argument("--client", type=int, default=-1, help="cli_id of the synthetic rows, deleted at the end. It must have no gen_data rows")
+    parser.add_argument("--generators", type=int, default=20)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=3)
+    return parser.parse_args()
+
+
+def insert_synthetic_gen_data(db: Session, cli_id: int, gen_ids: list, datetime_start: datetime.datetime, datetime_end: datetime.datetime) -> int:
+    dates = pd.date_range(datetime_start, datetime_end, freq='15T', inclusive='left')
+    index = pd.MultiIndex.from_product([gen_ids, dates, list(DATA_TYPE_NAMES)], names=['gen_id', 'data_date', 'data_type_id'])
+    df = index.to_frame(index=False)
+    df.insert(0, 'cli_id', cli_id)
+    df['data_value'] = np.random.default_rng(0).random(len(df)) * 100
+
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    connection = db.bind.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.copy_expert("COPY gen_data (cli_id, gen_id, data_date, data_type_id, data_value) FROM STDIN WITH (FORMAT csv)", buffer)
+        connection.commit()
+    finally:
+        connection.close()
+    return len(df)
+
+
+def has_gen_data(db: Session, cli_id: int) -> bool:
+    return db.execute(text("SELECT EXISTS (SELECT 1 FROM gen_data WHERE cli_id = :cli_id)"), {"cli_id": cli_id}).scalar()
+
+
+def benchmark(db: Session, cli_id: int, gen_ids: list, datetime_start, datetime_end, use_copy: bool, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.time()
+        df = get_gen_datas_grouped(db, cli_id, gen_ids, datetime_start, datetime_end, '15T', DATA_TYPE_NAMES, use_copy=use_copy)
+        times.append(time.time() - t0)
+    logging.info("use_copy=%s: %s rows, best of %s: %.3f s", use_copy, len(df), repeat, min(times))
+    return min(times)
+
+
+def main():
+    args = parse_args()
+    engine = create_engine(args.url)
+    gen_ids = list(range(1, args.generators + 1))
+    datetime_start = datetime.datetime(2021, 1, 1)
+    datetime_end = datetime_start + datetime.timedelta(days=args.days)
+
+    with Session(engine) as db:
+        db.execute(text(GEN_DATA_DDL))
+        db.commit()
+        # The synthetic rows are deleted by cli_id at the end, so a client that already has data would lose it
+        if has_gen_data(db, args.client):
+            raise SystemExit(f"gen_data already has rows for client {args.client}, use a scratch database or another --client")
+        try:
+            count = insert_synthetic_gen_data(db, args.client, gen_ids, datetime_start, datetime_end)
+            logging.info("Inserted %s synthetic gen_data rows", count)
+            read_sql_time = benchmark(db, args.client, gen_ids, datetime_start, datetime_end, False, args.repeat)
+            copy_time = benchmark(db, args.client, gen_ids, datetime_start, datetime_end, True, args.repeat)
+            logging.info("read_sql_copy speedup: %.2fx", read_sql_time / copy_time)
+        finally:
+            db.execute(text("DELETE FROM gen_data WHERE cli_id = :cli_id"), {"cli_id": args.client})
+            db.commit()
+
+
+if __name__ == "__main__":
+    main()
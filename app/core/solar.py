@@ -3,16 +3,26 @@ from typing import List, Optional
 
 import numpy as np
 import pandas as pd
-from db.utils import (get_gen_codes_and_names, get_gen_datas_grouped,
-                      get_gen_ids_by_loc_id, get_loc_output_capacity,
-                      get_period_end, get_sta_datas_grouped,
-                      get_sta_id_by_loc_id, insert_cli_gen_alerts)
+from core.solar_cache import solar_data_cache, solar_fetches
+from db.utils import (PERIOD_FREQUENCIES, ROLLUP_DATA_FREQS,
+                      ROLLUP_FREQUENCIES, get_bind_key,
+                      get_gen_codes_and_names, get_gen_datas_by_period,
+                      get_gen_datas_grouped, get_gen_ids_by_loc_id,
+                      get_gen_rollups_by_period, get_loc_output_capacity,
+                      get_period_ends, get_sta_datas_by_period,
+                      get_sta_datas_grouped, get_sta_id_by_loc_id,
+                      get_sta_rollups_by_period, has_daily_rollups, insert_cli_gen_alerts,
+                      pandas_frequency_to_timedelta)
 from fastapi import HTTPException
+from pandas.tseries.frequencies import to_offset
+from pandas.tseries.offsets import Tick
 from sqlalchemy.orm import Session
 
 
 class Solar():
-    def __init__(self, db: Session, cli_id: int, loc_id: int, gen_ids: List[int], sta_id: int,  datetime_start: datetime, datetime_end: datetime, freq: str, data_freq: Optional[str] = '15T'):
+    def __init__(self, db: Session, cli_id: int, loc_id: int, gen_ids: List[int], sta_id: int,  datetime_start: datetime, datetime_end: datetime, freq: str, data_freq: Optional[str] = '15T', aggregate_in_db: bool = False, use_cache: bool = False,
+                 chunksize: Optional[int] = None, use_copy: bool = False, use_rollups: bool = False, loc_total_capacity: Optional[float] = None,
+                 gen_codes_and_names: Optional[pd.DataFrame] = None):
         self.loc_id = loc_id
         self.gen_ids = gen_ids if gen_ids else [
             int(x) for x in get_gen_ids_by_loc_id(db, loc_id)['gen_id_auto'].values]
@@ -29,10 +39,16 @@ class Solar():
         self.cli_id = cli_id
         self.freq = freq
         self.data_freq = data_freq
-
-        loc_total_capacity = get_loc_output_capacity(db, self.loc_id)
+        self.aggregate_in_db = aggregate_in_db
+        self.use_cache = use_cache
+        self.chunksize = chunksize
+        self.use_copy = use_copy
+        self.use_rollups = use_rollups
+
+        if loc_total_capacity is None:
+            loc_total_capacity = get_loc_output_capacity(db, self.loc_id)
         self.loc_total_capacity = loc_total_capacity if loc_total_capacity else 1
-        self.gen_codes_and_names = get_gen_codes_and_names(
+        self.gen_codes_and_names = gen_codes_and_names if gen_codes_and_names is not None else get_gen_codes_and_names(
             db, self.gen_ids)
         self.gen_codes = list(self.gen_codes_and_names['gen_code'].values)
         self.gen_names = list(self.gen_codes_and_names['gen_name'].values)
@@ -52,7 +68,7 @@ class Solar():
         all_time = pd.DataFrame({'data_date': date_range})
         if all_time.empty:
             return
-        all_gens = pd.DataFrame({'gen_id': self.gen_ids})
+        all_gens = pd.DataFrame({'gen_id': sorted(self.gen_ids)})
         if all_gens.empty:
             return
         all_time = pd.merge(all_time, all_gens, how='cross')
@@ -87,15 +103,9 @@ class Solar():
         self.sta_data.drop(['data_date', 'sta_id'], axis=1, inplace=True)
 
     def _merge_gen_and_sta_data(self):
-
-        all_data = pd.DataFrame()
-        for gen_id in self.gen_data.index.unique(level='gen_id'):
-            aux_df = self.sta_data.copy()
-            aux_df['gen_id'] = gen_id
-            all_data = pd.concat([all_data, aux_df])
-
-        self.data = self.gen_data.merge(all_data, left_on=['gen_id', 'data_date'], right_on=[
-                                        'gen_id', 'data_date'], how='outer').reset_index().set_index(['gen_id', 'data_date'])
+        # Station data is the same for every generator, so it is joined by date only instead of being copied per generator
+        sta_data = self.sta_data.droplevel('sta_id')
+        self.data = self.gen_data.join(sta_data, on='data_date', how='left').reorder_levels(['gen_id', 'data_date'])
 
     def _get_specific_yield(self, rows):
         gen_id = rows.name[0]
@@ -103,14 +113,12 @@ class Solar():
         return rows['ac_production'] / gen_rate_power
 
     def _adjust_gen_units(self):
-        self.gen_data['power'] = self.gen_data[['power']].apply(self._adjust_row_gen_units, axis=1)
-        self.gen_data['ac_production'] = self.gen_data[['ac_production']].apply(self._adjust_row_gen_units, axis=1)
-        self.gen_data['ac_production_prediction'] = self.gen_data[['ac_production_prediction']].apply(self._adjust_row_gen_units, axis=1)
+        for column in ['power', 'ac_production', 'ac_production_prediction']:
+            self.gen_data[column] = pd.to_numeric(self.gen_data[column], errors='coerce') / 1000
 
-    def _adjust_row_gen_units(self, row):
-        row_value = row[0]
-        if row_value is not None:
-            return row_value / 1000
+    def _get_hours_in_period(self, data_dates: pd.DatetimeIndex) -> np.ndarray:
+        period_ends = get_period_ends(data_dates, self.data_freq, self.datetime_end)
+        return ((period_ends - data_dates).total_seconds() / 3600).values
 
     def _compute_calculated_columns(self):
         self.data['from'] = self.data.index.get_level_values(1)
@@ -118,17 +126,16 @@ class Solar():
             self.data['power'] == 0) & (self.data['irradiation'] > 0)
         self.data['count'] = 1
         self.data['is_missing'] = self.data['power'].isna()
-        self.data['capacity_factor'] = self.data.apply(
-            self._get_capacity_factor, axis=1)
-
-    def _get_capacity_factor(self, row):
-        row_start_date = row.name[1]
-        row_end_date = get_period_end(row_start_date, self.data_freq, self.datetime_end)
-        hours_in_period = (row_end_date - row_start_date).total_seconds() / 3600
-        production = row['ac_production']
-        if production is None or hours_in_period == 0 or self.loc_total_capacity == 0:
-            return 0
-        return production / (self.loc_total_capacity * hours_in_period / 1000)
+        self.data['capacity_factor'] = self._get_capacity_factor()
+
+    def _get_capacity_factor(self) -> np.ndarray:
+        hours_in_period = self._get_hours_in_period(pd.DatetimeIndex(self.data['from']))
+        production = self.data['ac_production'].values.astype(float)
+        if self.loc_total_capacity == 0:
+            return np.zeros(len(production))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            capacity_factor = production / (self.loc_total_capacity * hours_in_period / 1000)
+        return np.where(hours_in_period == 0, 0, capacity_factor)
 
     def _compute_agg_by_loc_and_period_calculated_columns(self):
         self.data_aggregated_by_loc_and_period['loc_specific_yield'] = self.data_aggregated_by_loc_and_period['ac_production'] / (
@@ -137,8 +144,8 @@ class Solar():
             lambda x: x['loc_specific_yield']/x['irradiation'] * 100 if x['irradiation'] != 0 else np.nan, axis=1)
 
         self.data_aggregated_by_loc_and_period.fillna(0, inplace=True)
-        self.data_aggregated_by_loc_and_period['to'] = self.data_aggregated_by_loc_and_period.apply(
-            self._get_group_period_end_date, axis=1)
+        self.data_aggregated_by_loc_and_period['to'] = get_period_ends(
+            self.data_aggregated_by_loc_and_period['from'], self.freq, self.datetime_end)
 
     def _compute_agg_by_period_calculated_columns(self):
         self.data_aggregated_by_period['specific_yield'] = self.data_aggregated_by_period.apply(
@@ -148,15 +155,39 @@ class Solar():
 
         self.data_aggregated_by_period['performance_ratio'].fillna(
             0, inplace=True)
-        self.data_aggregated_by_period['to'] = self.data_aggregated_by_period.apply(
-            self._get_group_period_end_date, axis=1)
+        self.data_aggregated_by_period['to'] = get_period_ends(
+            self.data_aggregated_by_period['from'], self.freq, self.datetime_end)
+
+    def _get_cache_key(self, db: Session) -> tuple:
+        # The capacity is part of the key because capacity_factor depends on it. The generators are sorted so
+        # the same generators requested in another order, or resolved from the location, share the entry
+        return (get_bind_key(db), self.cli_id, self.loc_id, tuple(sorted(self.gen_ids)), self.sta_id, pd.Timestamp(self.datetime_start),
+                pd.Timestamp(self.datetime_end), self.data_freq, self.loc_total_capacity)
 
     def fetch_data(self, db: Session):
+        cache_key = self._get_cache_key(db)
+        if self.use_cache:
+            self.data = solar_data_cache.get(cache_key)
+            if self.data is not None:
+                return
+
+        # Identical concurrent fetches share the data of the first one instead of querying it again
+        data = solar_fetches.do(('data', ) + cache_key, lambda: self._fetch_and_cache_data(db, cache_key))
+        if data is not self.data:
+            self.data = data.copy() if data is not None else None
+
+    def _fetch_and_cache_data(self, db: Session, cache_key: tuple) -> Optional[pd.DataFrame]:
+        self._fetch_data(db)
+        if self.use_cache and self.data is not None:
+            solar_data_cache.put(cache_key, self.data, self.datetime_end)
+        return self.data
+
+    def _fetch_data(self, db: Session):
         self.gen_data = get_gen_datas_grouped(db, self.cli_id, self.gen_ids, self.datetime_start, self.datetime_end, self.data_freq, {
-                                              501: 'power', 502: 'ac_production', 508: 'ac_production_prediction'})
+                                              501: 'power', 502: 'ac_production', 508: 'ac_production_prediction'}, use_copy=self.use_copy)
 
         self.sta_data = get_sta_datas_grouped(db, self.cli_id, self.sta_id, self.datetime_start, self.datetime_end, self.data_freq, {
-                                              503: 'avg_ambient_temp', 504: 'avg_module_temp', 505: 'irradiation'})
+                                              503: 'avg_ambient_temp', 504: 'avg_module_temp', 505: 'irradiation'}, use_copy=self.use_copy)
 
         self._adjust_gen_units()
         self._fill_missing_gen_data()
@@ -168,16 +199,201 @@ class Solar():
         self._merge_gen_and_sta_data()
         self._compute_calculated_columns()
 
-    def _get_group_period_end_date(self, rows):
-        if self.freq:
-            return get_period_end(rows['from'], self.freq, self.datetime_end)
-        return self.datetime_end
-
     def _get_agg_unavailable(self, rows):
         periods = len(rows)
         return (periods - rows.sum()) / (periods)
 
+    def _can_aggregate_in_db(self) -> bool:
+        if not self.aggregate_in_db or not isinstance(to_offset(self.data_freq), Tick):
+            return False
+        if self.freq is None:
+            return True
+        return self.freq in PERIOD_FREQUENCIES and pandas_frequency_to_timedelta(self.freq) > pandas_frequency_to_timedelta(self.data_freq)
+
+    def _can_use_rollups(self, db: Session) -> bool:
+        # The daily rollups hold whole days, so the range must start at midnight and include the last slot of a day before today
+        if not self.use_rollups or self.data_freq not in ROLLUP_DATA_FREQS or (self.freq is not None and self.freq not in ROLLUP_FREQUENCIES):
+            return False
+        datetime_start = pd.Timestamp(self.datetime_start)
+        datetime_end = pd.Timestamp(self.datetime_end)
+        return (datetime_start == datetime_start.normalize()
+                and datetime_end - datetime_end.normalize() >= pd.Timedelta(days=1) - pd.to_timedelta(self.data_freq)
+                and datetime_end < pd.Timestamp.now().normalize()
+                and has_daily_rollups(db))
+
+    def _fetch_aggregated_by_period_from_rollups(self, db: Session) -> Optional[pd.DataFrame]:
+        """
+        Same result as aggregating self.data, from the daily rollups. None when a day was not refreshed yet.
+        """
+        date_range = pd.date_range(start=self.datetime_start, end=self.datetime_end, freq=self.data_freq)
+        if date_range.empty or not self.gen_ids:
+            return None
+        gen_data = get_gen_rollups_by_period(db, self.cli_id, self.gen_ids, self.sta_id, self.datetime_start, self.datetime_end, self.freq, self.data_freq)
+        sta_data = get_sta_rollups_by_period(db, self.cli_id, self.sta_id, self.datetime_start, self.datetime_end, self.freq, self.data_freq)
+        # Days that were not refreshed yet have no rows, in that case the raw data is aggregated instead
+        days = len(pd.date_range(pd.Timestamp(self.datetime_start), pd.Timestamp(self.datetime_end).normalize(), freq='D'))
+        if gen_data['day_count'].sum() != days * len(self.gen_ids) or sta_data['day_count'].sum() != days:
+            return None
+        return self._aggregate_by_period(gen_data.drop(columns='day_count'), sta_data.drop(columns='day_count'), date_range)
+
+    def _get_periods(self, date_range: pd.DatetimeIndex) -> pd.DataFrame:
+        slots = pd.Series(date_range, index=date_range)
+        if self.freq:
+            periods = slots.groupby(pd.Grouper(freq=self.freq)).agg(['first', 'size'])
+        else:
+            periods = pd.DataFrame({'first': [date_range[0]], 'size': [len(date_range)]}, index=[date_range[0]])
+        periods.columns = ['from', 'count']
+        periods.index.name = 'data_date'
+        return periods
+
+    def _fetch_aggregated_by_period_in_db(self, db: Session):
+        """
+        Same result as aggregating self.data, but the sums, means and counts of each generator and period
+        are computed by the database so the raw data at data_freq never leaves it.
+        """
+        date_range = pd.date_range(start=self.datetime_start, end=self.datetime_end, freq=self.data_freq)
+        if date_range.empty or not self.gen_ids:
+            return
+
+        data = self._fetch_aggregated_by_period_from_rollups(db) if self._can_use_rollups(db) else None
+        if data is not None:
+            return data
+        gen_data = get_gen_datas_by_period(db, self.cli_id, self.gen_ids, self.sta_id, self.datetime_start, self.datetime_end, self.freq, self.data_freq,
+                                           use_copy=self.use_copy)
+        sta_data = get_sta_datas_by_period(db, self.cli_id, self.sta_id, self.datetime_start, self.datetime_end, self.freq, self.data_freq,
+                                           use_copy=self.use_copy)
+        return self._aggregate_by_period(gen_data, sta_data, date_range)
+
+    def _should_fetch_in_chunks(self) -> bool:
+        # Only ranges with more generator slots than a chunk are streamed
+        if not self.chunksize or not isinstance(to_offset(self.data_freq), Tick):
+            return False
+        return len(pd.date_range(start=self.datetime_start, end=self.datetime_end, freq=self.data_freq)) * len(self.gen_ids) > self.chunksize
+
+    def _get_period_grouper(self, date_range: pd.DatetimeIndex, key: Optional[str] = None) -> pd.Grouper:
+        # The origin is fixed so every chunk labels its periods like the grouping of the whole range
+        return pd.Grouper(key=key, freq=self.freq, origin=date_range[0].normalize())
+
+    def _aggregate_gen_chunk(self, chunk: pd.DataFrame, irradiation: pd.Series, date_range: pd.DatetimeIndex) -> pd.DataFrame:
+        chunk = chunk.reset_index()
+        chunk = chunk[chunk['data_date'].isin(date_range)].copy()
+        for column in ['power', 'ac_production', 'ac_production_prediction']:
+            chunk[column] = pd.to_numeric(chunk[column], errors='coerce')
+        chunk['power'] = chunk['power'].fillna(chunk['ac_production'])
+        chunk['ac_production'] = chunk['ac_production'].fillna(chunk['power'])
+        chunk['data_count'] = chunk['power'].notna().astype('int64')
+        chunk['unavailable_count'] = ((chunk['power'] == 0) & (irradiation.reindex(chunk['data_date']).values > 0)).astype('int64')
+        chunk['last_ac_production'] = chunk['ac_production'].where(chunk['data_date'] == date_range[-1])
+
+        keys = ['gen_id', self._get_period_grouper(date_range, 'data_date')] if self.freq else ['gen_id']
+        return chunk.groupby(keys)[['power', 'ac_production', 'ac_production_prediction', 'data_count', 'unavailable_count', 'last_ac_production']].sum()
+
+    def _fetch_aggregated_by_period_in_chunks(self, db: Session):
+        """
+        Same result as aggregating self.data, but the generator data is streamed in chunks of chunksize rows
+        that are reduced to sums per generator and period, so memory is bounded by the chunk size instead of the range.
+        """
+        date_range = pd.date_range(start=self.datetime_start, end=self.datetime_end, freq=self.data_freq)
+        if date_range.empty or not self.gen_ids:
+            return
+
+        # The station has a single row per slot, small next to the data of all the generators
+        sta_data = get_sta_datas_grouped(db, self.cli_id, self.sta_id, self.datetime_start, self.datetime_end, self.data_freq, {
+                                         503: 'avg_ambient_temp', 504: 'avg_module_temp', 505: 'irradiation'}, use_copy=self.use_copy)
+        sta_data = sta_data.droplevel('sta_id').apply(pd.to_numeric, errors='coerce').reindex(date_range).rename_axis('data_date')
+
+        gen_chunks = get_gen_datas_grouped(db, self.cli_id, self.gen_ids, self.datetime_start, self.datetime_end, self.data_freq, {
+                                           501: 'power', 502: 'ac_production', 508: 'ac_production_prediction'}, chunksize=self.chunksize)
+        gen_data = [self._aggregate_gen_chunk(chunk, sta_data['irradiation'], date_range) for chunk in gen_chunks]
+        if gen_data:
+            gen_data = pd.concat(gen_data).groupby(level=list(range(gen_data[0].index.nlevels))).sum().reset_index()
+        else:
+            gen_data = pd.DataFrame({'gen_id': pd.Series(dtype='int64'), 'data_date': pd.Series(dtype='datetime64[ns]'),
+                                     **{x: pd.Series(dtype=float) for x in ['power', 'ac_production', 'ac_production_prediction',
+                                                                            'data_count', 'unavailable_count', 'last_ac_production']}})
+
+        agg = {'avg_ambient_temp': 'mean', 'avg_module_temp': 'mean', 'irradiation': 'sum'}
+        if self.freq:
+            sta_data = sta_data.groupby(self._get_period_grouper(date_range)).agg(agg).reset_index()
+        else:
+            sta_data = sta_data.agg(agg).to_frame().T
+        return self._aggregate_by_period(gen_data, sta_data, date_range)
+
+    def _fetch_and_cache_aggregated_by_period_in_chunks(self, db: Session, cache_key: tuple) -> Optional[pd.DataFrame]:
+        data = self._fetch_aggregated_by_period_in_chunks(db)
+        if self.use_cache and data is not None:
+            solar_data_cache.put(cache_key, data, self.datetime_end)
+        return data
+
+    def aggregate_by_period(self, gen_data: pd.DataFrame, sta_data: pd.DataFrame) -> Optional[pd.DataFrame]:
+        """
+        Build data_aggregated_by_period from generator and station data already aggregated by the database
+        per period, with the columns of get_gen_datas_by_period and get_sta_datas_by_period.
+        """
+        date_range = pd.date_range(start=self.datetime_start, end=self.datetime_end, freq=self.data_freq)
+        if date_range.empty or not self.gen_ids:
+            return None
+        return self._aggregate_by_period(gen_data, sta_data, date_range)
+
+    def _aggregate_by_period(self, gen_data: pd.DataFrame, sta_data: pd.DataFrame, date_range: pd.DatetimeIndex) -> pd.DataFrame:
+        """
+        Build data_aggregated_by_period from the sums and counts of each generator and period and the
+        station aggregates of each period.
+        """
+        periods = self._get_periods(date_range)
+        if self.freq is None:
+            gen_data['data_date'] = date_range[0]
+            sta_data['data_date'] = date_range[0]
+
+        data = pd.DataFrame(index=pd.MultiIndex.from_product([sorted(self.gen_ids), periods.index], names=['gen_id', 'data_date'])).reset_index()
+        data = data.merge(periods.reset_index(), on='data_date', how='left')
+        data = data.merge(sta_data, on='data_date', how='left')
+        data = data.merge(gen_data, on=['gen_id', 'data_date'], how='left')
+        data.set_index(['gen_id', 'data_date'], inplace=True)
+
+        for column in ['power', 'ac_production', 'ac_production_prediction']:
+            data[column] = data[column].fillna(0) / 1000
+        data['irradiation'] = data['irradiation'].fillna(0)
+        data_count = data['data_count'].fillna(0)
+        data['time_based_availability'] = (data['count'] - data['unavailable_count'].fillna(0)) / data['count']
+        data['is_missing'] = (data['count'] - data_count).astype('int64')
+
+        # The capacity factor of each slot is computed with the slot length, which is the same for all of them
+        # except the last one, that is clipped at datetime_end
+        last_ac_production = data['last_ac_production'].fillna(0) / 1000
+        slot_hours, last_slot_hours = self._get_hours_in_period(date_range[[0, -1]])
+        production_per_hour = (data['ac_production'] - last_ac_production) / slot_hours if slot_hours else 0
+        production_per_hour = production_per_hour + (last_ac_production / last_slot_hours if last_slot_hours else 0)
+        data['capacity_factor'] = production_per_hour / data_count.replace(0, np.nan) / (self.loc_total_capacity / 1000)
+
+        self.data_aggregated_by_period = data[['power', 'ac_production', 'avg_ambient_temp', 'avg_module_temp', 'irradiation', 'time_based_availability',
+                                               'from', 'count', 'is_missing', 'ac_production_prediction', 'capacity_factor']].copy()
+        self._compute_agg_by_period_calculated_columns()
+        return self.data_aggregated_by_period
+
     def fetch_aggregated_by_period(self, db: Session):
+        if self.data is None and self._can_aggregate_in_db():
+            data = solar_fetches.do(('aggregated_by_period', self.freq) + self._get_cache_key(db), lambda: self._fetch_aggregated_by_period_in_db(db))
+            if data is not self.data_aggregated_by_period:
+                self.data_aggregated_by_period = data.copy() if data is not None else None
+            return
+
+        if self.data is None and self._can_use_rollups(db):
+            data = solar_fetches.do(('rollups_by_period', self.freq) + self._get_cache_key(db), lambda: self._fetch_aggregated_by_period_from_rollups(db))
+            if data is not None:
+                if data is not self.data_aggregated_by_period:
+                    self.data_aggregated_by_period = data.copy()
+                return
+
+        if self.data is None and self._should_fetch_in_chunks():
+            cache_key = ('aggregated_by_period', self.freq) + self._get_cache_key(db)
+            data = solar_data_cache.get(cache_key) if self.use_cache else None
+            if data is None:
+                data = solar_fetches.do(cache_key, lambda: self._fetch_and_cache_aggregated_by_period_in_chunks(db, cache_key))
+            if data is not self.data_aggregated_by_period:
+                self.data_aggregated_by_period = data.copy() if data is not None else None
+            return
+
         if self.data is None:
             self.fetch_data(db)
 
@@ -204,7 +420,7 @@ class Solar():
         if self.data_aggregated_by_period is None:
             self.fetch_aggregated_by_period(db)
 
-        if self.data is None:
+        if self.data_aggregated_by_period is None:
             return
 
         agg = {'power': 'sum', 'ac_production': 'sum', 'avg_ambient_temp': 'mean', 'avg_module_temp': 'mean',
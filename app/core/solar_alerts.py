@@ -1,11 +1,18 @@
+import itertools
 import json
-from datetime import datetime
-from typing import List, Optional, Tuple
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
 
 import numpy as np
+import pandas as pd
 from core.solar import Solar
-from db.utils import (get_client_settings, get_gen_ids_by_data_pro_id,
-                      insert_cli_gen_alerts)
+from db.utils import (get_alert_evaluated_dates, get_client_gen_datas_by_period,
+                      get_client_settings, get_client_sta_datas_by_period,
+                      get_gen_ids_by_data_pro_id, get_gen_ids_by_loc_id,
+                      get_generators_by_client, insert_cli_gen_alerts,
+                      update_alert_evaluated_dates)
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
 
@@ -15,28 +22,84 @@ ALERT_2_DEFAULT_THRESHOLD = 94
 ALERT_3_DEFAULT_THRESHOLD = 90
 ALERT_4_DEFAULT_THRESHOLD = 90
 MAX_DATA_PER_DAY = 24 * 60 / 15
+ALERT_DATA_FREQ = '15T'
+JSON_ENCODER = json.JSONEncoder()
+ALERT_SWEEP_MAX_WORKERS = 4
 
+logger = logging.getLogger(__name__)
 
-def calculate_alerts(db: Session, datetime_start: Optional[datetime], datetime_end: Optional[datetime], data_pro_id: Optional[int] = None, cli_id: Optional[int] = None, loc_id: Optional[int] = None) -> Tuple[int, int, List[int], datetime, datetime, int]:
 
-    if not data_pro_id and not (cli_id and loc_id and datetime_start and datetime_end):
-        raise HTTPException(status_code=400, detail='Invalid parameters: either data_pro_id or cli_id, loc_id, datetime_start and datetime_end must be provided')
-    gen_ids = None
-    if data_pro_id:
-        cli_id, loc_id, gen_ids, datetime_start, datetime_end = get_gen_ids_by_data_pro_id(db, data_pro_id)
+def _format(values: pd.Series, spec: str) -> pd.Series:
+    return values.map(spec.format)
 
-    if cli_id is None or loc_id is None:
-        raise HTTPException(status_code=400, detail='data_pro_id not found')
 
-    solar = Solar(db, cli_id=cli_id, loc_id=loc_id, datetime_start=datetime_start, datetime_end=datetime_end, freq='1D', gen_ids=gen_ids, sta_id=None)
-    solar.fetch_aggregated_by_period(db)
+def get_alert_rows(data: pd.DataFrame, gen_codes: pd.Series, cli_id: int, now: datetime,
+                   alert_1_threshold: float, alert_2_threshold: float, alert_3_threshold: float, alert_4_threshold: float) -> List[Dict]:
+    """
+    Build the cli_gen_alert rows of the daily data of all the generators. The thresholds are evaluated as
+    masks over the whole frame and the descriptions and JSON payloads are built only for the rows of each alert.
+    The rows are sorted by data row and then alert, as they were inserted row by row.
+    """
+    masks = [
+        data['missing_percentage'] >= alert_1_threshold,
+        data['performance_ratio_diff_percentage'] >= alert_2_threshold,
+        data['time_based_availability_diff_percentage'] >= alert_3_threshold,
+        data['production_diff_percentage'] < alert_4_threshold,
+    ]
+    gen_ids = data.index.get_level_values(0)
+    dates = data.index.get_level_values(1)
+    data = data.assign(gen_code=gen_codes.reindex(gen_ids).values, date=dates.strftime('%Y-%m-%d').values)
 
-    if solar.data is None or solar.data.empty:
-        return HTTPException(status_code=404, detail='No data found')
+    alerts = []
+    for alert_number, mask in enumerate(masks, start=1):
+        positions = np.flatnonzero(mask.values)
+        if len(positions) == 0:
+            continue
+        rows = data.iloc[positions]
+        prefix = rows['date'] + ' for generator ' + rows['gen_code'].astype(str) + ' was '
+        if alert_number == 1:
+            value = 100 - rows['missing_percentage']
+            descriptions = 'Data availability on ' + prefix + _format(value, '{:.0f}') + '%.'
+            payloads = [{'type': 'alertDataAvailabilityLow', 'gen_code': gen_code, "description": description, 'value': value,
+                         "previous_value": None, 'threshold': alert_1_threshold, "date": date}
+                        for gen_code, description, value, date in zip(rows['gen_code'], descriptions, value.values, rows['date'])]
+        elif alert_number == 2:
+            descriptions = ('Performance ratio on ' + prefix + _format(rows['performance_ratio'], '{:.0f}') + '%, which is '
+                            + _format(rows['performance_ratio_diff_percentage'], '{:.0f}') + '% lower than the previous day ('
+                            + _format(rows['prev_performance_ratio'], '{:.0f}') + '%)')
+            payloads = [{'type': 'alertPerformanceRatioLow', 'gen_code': gen_code, 'description:': description,
+                         'value': value, "previous_value": previous_value, 'threshold': alert_2_threshold, "date": date, "diff_percentage": diff_percentage}
+                        for gen_code, description, value, previous_value, date, diff_percentage
+                        in zip(rows['gen_code'], descriptions, rows['performance_ratio'].values, rows['prev_performance_ratio'].values,
+                               rows['date'], rows['performance_ratio_diff_percentage'].values)]
+        elif alert_number == 3:
+            descriptions = ('Time based availability on ' + prefix + _format(rows['time_based_availability'] * 100, '{:.0f}') + '%, which is '
+                            + _format(rows['time_based_availability_diff_percentage'], '{:.0f}') + '% lower than the previous day ('
+                            + _format(rows['prev_time_based_availability'] * 100, '{:.0f}') + '%)')
+            payloads = [{'type': 'alertTimeBasedAvailabilityLow', 'gen_code': gen_code, 'description': description, 'value': value,
+                         "previous_value": previous_value, 'threshold': alert_3_threshold, "date": date, "diff_percentage": diff_percentage}
+                        for gen_code, description, value, previous_value, date, diff_percentage
+                        in zip(rows['gen_code'], descriptions, rows['time_based_availability'].values, rows['prev_time_based_availability'].values,
+                               rows['date'], rows['time_based_availability_diff_percentage'].values)]
+        else:
+            descriptions = ('Production on ' + prefix + _format(rows['ac_production'], '{:.4f}') + ' MW/h, which is '
+                            + _format(100 - rows['production_diff_percentage'], '{:.0f}') + '% lower than the predicted ('
+                            + _format(rows['ac_production_prediction'], '{:.4f}') + ' MW/h)')
+            payloads = [{'type': 'alertProductionLowerThanPredicted', 'gen_code': gen_code, 'description:': description,
+                         'value': value, "predicted_value": predicted_value, 'threshold': alert_4_threshold, "date": date, "diff_percentage": diff_percentage}
+                        for gen_code, description, value, predicted_value, date, diff_percentage
+                        in zip(rows['gen_code'], descriptions, rows['ac_production'].values, rows['ac_production_prediction'].values,
+                               rows['date'], rows['production_diff_percentage'].round(2).values)]
 
-    data = solar.data_aggregated_by_period
+        alerts.extend(zip(positions, itertools.repeat(alert_number), gen_ids[positions], dates[positions], map(JSON_ENCODER.encode, payloads)))
 
-    cli_settings = get_client_settings(db, cli_id)
+    alerts.sort(key=lambda alert: alert[:2])
+    return [{"cli_id": cli_id, "gen_id": gen_id, "cli_gen_alert_added": now, "cli_gen_alert_type": ALERT_DATA_TYPE,
+             "cli_gen_alert_data": alert_data, "cli_gen_alert_trigger": date}
+            for _, _, gen_id, date, alert_data in alerts]
+
+
+def get_alert_thresholds(cli_settings: pd.DataFrame) -> Tuple[int, int, int, int]:
     alert_1_threshold = 100 - (int(cli_settings.loc['alertDataAvailabilityLowerThan']['cli_set_value'])
                                if 'alertDataAvailabilityLowerThan' in cli_settings.index and cli_settings.loc['alertDataAvailabilityLowerThan']['cli_set_value'] else ALERT_1_DEFAULT_THRESHOLD)
     alert_2_threshold = 100 - (int(cli_settings.loc['alertPerformanceRatioLowerThan']['cli_set_value'])
@@ -45,6 +108,29 @@ def calculate_alerts(db: Session, datetime_start: Optional[datetime], datetime_e
                                if 'alertTimeBasedAvailabilityLowerThan' in cli_settings.index and cli_settings.loc['alertTimeBasedAvailabilityLowerThan']['cli_set_value'] else ALERT_3_DEFAULT_THRESHOLD)
     alert_4_threshold = (int(cli_settings.loc['alertProductionLowerThanPredicted']['cli_set_value'])
                          if 'alertProductionLowerThanPredicted' in cli_settings.index and cli_settings.loc['alertProductionLowerThanPredicted']['cli_set_value'] else ALERT_4_DEFAULT_THRESHOLD)
+    return alert_1_threshold, alert_2_threshold, alert_3_threshold, alert_4_threshold
+
+
+def get_location_alert_rows(db: Session, cli_id: int, loc_id: int, gen_ids: Optional[List[int]], datetime_start: datetime, datetime_end: datetime,
+                            thresholds: Tuple[int, int, int, int], now: datetime) -> Tuple[Solar, Optional[List[Dict]]]:
+    """
+    Compute the alerts of the generators of a location from their daily data.
+    Returns the Solar instance used and the alert rows, None if there is no data.
+    """
+    solar = Solar(db, cli_id=cli_id, loc_id=loc_id, datetime_start=datetime_start, datetime_end=datetime_end, freq='1D', gen_ids=gen_ids, sta_id=None, aggregate_in_db=True,
+                  use_rollups=True)
+    solar.fetch_aggregated_by_period(db)
+    return solar, get_solar_alert_rows(solar, cli_id, thresholds, now)
+
+
+def get_solar_alert_rows(solar: Solar, cli_id: int, thresholds: Tuple[int, int, int, int], now: datetime) -> Optional[List[Dict]]:
+    """
+    Compute the alert rows from the daily data_aggregated_by_period of a Solar instance, None if there is no data.
+    """
+    if solar.data_aggregated_by_period is None or solar.data_aggregated_by_period.empty:
+        return None
+
+    data = solar.data_aggregated_by_period
 
     data['prev_performance_ratio'] = data['performance_ratio'].shift(1)
     data['prev_time_based_availability'] = data['time_based_availability'].shift(1)
@@ -64,49 +150,140 @@ def calculate_alerts(db: Session, datetime_start: Optional[datetime], datetime_e
         data['ac_production'] * 100 / np.where(data['ac_production_prediction'] != 0, data['ac_production_prediction'], 1),
         0)
 
-    for i, rows in data.groupby(level=0):
-        alert_1 = rows['missing_percentage'] >= alert_1_threshold
-        alert_2 = rows['performance_ratio_diff_percentage'] >= alert_2_threshold
-        alert_3 = rows['time_based_availability_diff_percentage'] >= alert_3_threshold
-        alert_4 = rows['production_diff_percentage'] < alert_4_threshold
+    return get_alert_rows(data, solar.gen_codes_and_names['gen_code'], cli_id, now, *thresholds)
 
-        data.loc[i, 'alert_1'] = alert_1
-        data.loc[i, 'alert_2'] = alert_2
-        data.loc[i, 'alert_3'] = alert_3
-        data.loc[i, 'alert_4'] = alert_4
 
-    rows_to_insert = []
-    now = datetime.utcnow()
-    for i, alert in data.iterrows():
-        gen_id = i[0]
-        date = i[1]
-        gen_code = solar.gen_codes_and_names.loc[gen_id, 'gen_code']
-        if alert['alert_1']:
-            description = f"Data availability on {date.strftime('%Y-%m-%d')} for generator {gen_code} was {100 - alert['missing_percentage']:.0f}%."
-            alert_data = {'type': 'alertDataAvailabilityLow', 'gen_code': gen_code, "description": description, 'value': 100 -
-                          alert['missing_percentage'], "previous_value": None, 'threshold': alert_1_threshold, "date": date.strftime('%Y-%m-%d')}
-            rows_to_insert.append({"cli_id": cli_id, "gen_id": gen_id, "cli_gen_alert_added": now, "cli_gen_alert_type": ALERT_DATA_TYPE,
-                                  "cli_gen_alert_data": json.dumps(alert_data), "cli_gen_alert_trigger": date})
-        if alert['alert_2']:
-            description = f"Performance ratio on {date.strftime('%Y-%m-%d')} for generator {gen_code} was {alert['performance_ratio']:.0f}%, which is {alert['performance_ratio_diff_percentage']:.0f}% lower than the previous day ({alert['prev_performance_ratio']:.0f}%)"
-            alert_data = {'type': 'alertPerformanceRatioLow', 'gen_code': gen_code, 'description:': description,
-                          'value': alert['performance_ratio'], "previous_value": alert['prev_performance_ratio'], 'threshold': alert_2_threshold, "date": date.strftime('%Y-%m-%d'), "diff_percentage": alert['performance_ratio_diff_percentage']}
-            rows_to_insert.append({"cli_id": cli_id, "gen_id": gen_id, "cli_gen_alert_added": now, "cli_gen_alert_type": ALERT_DATA_TYPE,
-                                  "cli_gen_alert_data": json.dumps(alert_data), "cli_gen_alert_trigger": date})
-        if alert['alert_3']:
-            description = f"Time based availability on {date.strftime('%Y-%m-%d')} for generator {gen_code} was {alert['time_based_availability']*100:.0f}%, which is { alert['time_based_availability_diff_percentage']:.0f}% lower than the previous day ({alert['prev_time_based_availability']*100:.0f}%)"
-            alert_data = {'type': 'alertTimeBasedAvailabilityLow', 'gen_code': gen_code, 'description': description, 'value': alert['time_based_availability'], "previous_value": alert[
-                'prev_time_based_availability'], 'threshold': alert_3_threshold, "date": date.strftime('%Y-%m-%d'), "diff_percentage": alert['time_based_availability_diff_percentage']}
-            rows_to_insert.append({"cli_id": cli_id, "gen_id": gen_id, "cli_gen_alert_added": now, "cli_gen_alert_type": ALERT_DATA_TYPE,
-                                  "cli_gen_alert_data": json.dumps(alert_data), "cli_gen_alert_trigger": date})
-
-        if alert['alert_4']:
-            description = f"Production on {date.strftime('%Y-%m-%d')} for generator {gen_code} was {alert['ac_production']:.4f} MW/h, which is {100 - alert['production_diff_percentage']:.0f}% lower than the predicted ({alert['ac_production_prediction']:.4f} MW/h)"
-            alert_data = {'type': 'alertProductionLowerThanPredicted', 'gen_code': gen_code, 'description:': description,
-                          'value': alert['ac_production'], "predicted_value": alert['ac_production_prediction'], 'threshold': alert_4_threshold, "date": date.strftime('%Y-%m-%d'), "diff_percentage": round(alert['production_diff_percentage'], 2)}
-            rows_to_insert.append({"cli_id": cli_id, "gen_id": gen_id, "cli_gen_alert_added": now, "cli_gen_alert_type": ALERT_DATA_TYPE,
-                                  "cli_gen_alert_data": json.dumps(alert_data), "cli_gen_alert_trigger": date})
+def get_days_to_evaluate(evaluated_dates: Dict[int, datetime], gen_ids: List[int], datetime_start: datetime, datetime_end: datetime,
+                         new_data: bool) -> Tuple[datetime, datetime]:
+    """
+    Get the first and last day between datetime_start and datetime_end whose alerts have to be evaluated.
+    For new data these are all the days, plus the next one if it was already evaluated, since its alerts compare it
+    with the last new day. Otherwise these are the days after the last one evaluated for every generator, up to
+    yesterday, since today is evaluated once it is complete.
+    """
+    first_day = pd.Timestamp(datetime_start).normalize()
+    last_day = pd.Timestamp(datetime_end).normalize()
+    last_evaluated_days = [pd.Timestamp(evaluated_dates[gen_id]) for gen_id in gen_ids if evaluated_dates.get(gen_id) is not None]
+    if new_data:
+        if any(day > last_day for day in last_evaluated_days):
+            last_day += pd.Timedelta(days=1)
+    else:
+        last_day = min(last_day, pd.Timestamp.now().normalize() - pd.Timedelta(days=1))
+        if last_evaluated_days and len(last_evaluated_days) == len(gen_ids):
+            first_day = max(first_day, min(last_evaluated_days) + pd.Timedelta(days=1))
+    return first_day.to_pydatetime(), last_day.to_pydatetime()
+
+
+def calculate_alerts_incrementally(db: Session, cli_id: int, loc_id: int, gen_ids: Optional[List[int]], datetime_start: datetime, datetime_end: datetime,
+                                   new_data: bool) -> Tuple[int, int, List[int], datetime, datetime, int]:
+    """
+    Compute only the alerts of the days returned by get_days_to_evaluate, reading the day before them for the
+    comparisons with the previous day, replace the alerts of those days and record the last day evaluated.
+    """
+    if not gen_ids:
+        gen_ids = [int(x) for x in get_gen_ids_by_loc_id(db, loc_id)['gen_id_auto'].values]
+    first_day, last_day = get_days_to_evaluate(get_alert_evaluated_dates(db, cli_id, gen_ids), gen_ids, datetime_start, datetime_end, new_data)
+    evaluated_end = last_day + timedelta(days=1, seconds=-1)
+    if first_day > last_day:
+        return cli_id, loc_id, gen_ids, first_day, evaluated_end, 0
+
+    thresholds = get_alert_thresholds(get_client_settings(db, cli_id))
+    solar, rows_to_insert = get_location_alert_rows(db, cli_id, loc_id, gen_ids, first_day - timedelta(days=1), evaluated_end, thresholds, datetime.utcnow())
+    if rows_to_insert is None:
+        raise HTTPException(status_code=404, detail='No data found')
+    rows_to_insert = [row for row in rows_to_insert if row['cli_gen_alert_trigger'] >= first_day]
+
+    insert_cli_gen_alerts(db, cli_id, solar.gen_ids, first_day, last_day + timedelta(days=1), rows_to_insert)
+    update_alert_evaluated_dates(db, cli_id, solar.gen_ids, last_day)
+
+    return cli_id, loc_id, solar.gen_ids, first_day, evaluated_end, len(rows_to_insert)
+
+
+def calculate_alerts(db: Session, datetime_start: Optional[datetime], datetime_end: Optional[datetime], data_pro_id: Optional[int] = None, cli_id: Optional[int] = None, loc_id: Optional[int] = None,
+                     incremental: bool = False) -> Tuple[int, int, List[int], datetime, datetime, int]:
+
+    if not data_pro_id and not (cli_id and loc_id and datetime_start and datetime_end):
+        raise HTTPException(status_code=400, detail='Invalid parameters: either data_pro_id or cli_id, loc_id, datetime_start and datetime_end must be provided')
+    gen_ids = None
+    if data_pro_id:
+        cli_id, loc_id, gen_ids, datetime_start, datetime_end = get_gen_ids_by_data_pro_id(db, data_pro_id)
+
+    if cli_id is None or loc_id is None:
+        raise HTTPException(status_code=400, detail='data_pro_id not found')
+
+    if incremental:
+        return calculate_alerts_incrementally(db, cli_id, loc_id, gen_ids, datetime_start, datetime_end, new_data=bool(data_pro_id))
+
+    thresholds = get_alert_thresholds(get_client_settings(db, cli_id))
+    solar, rows_to_insert = get_location_alert_rows(db, cli_id, loc_id, gen_ids, datetime_start, datetime_end, thresholds, datetime.utcnow())
+    if rows_to_insert is None:
+        return HTTPException(status_code=404, detail='No data found')
 
     insert_cli_gen_alerts(db, cli_id,  solar.gen_ids, datetime_start, datetime_end, rows_to_insert)
 
     return cli_id, loc_id, solar.gen_ids, datetime_start, datetime_end, len(rows_to_insert)
+
+
+def calculate_client_alerts(db: Session, cli_id: int, generators: pd.DataFrame, datetime_start: datetime, datetime_end: datetime) -> Dict:
+    """
+    Compute the alerts of all the locations of a client, given its generators as returned by get_generators_by_client.
+    The daily data of all the generators, joined with their stations by the database, and of all the stations
+    is read with one query each, the client settings are read once and the alerts of the generators with data
+    are replaced with one bulk insert. Locations without data or station are skipped.
+    """
+    thresholds = get_alert_thresholds(get_client_settings(db, cli_id))
+    now = datetime.utcnow()
+    gen_data = get_client_gen_datas_by_period(db, cli_id, datetime_start, datetime_end, '1D', ALERT_DATA_FREQ)
+    sta_data = get_client_sta_datas_by_period(db, cli_id, datetime_start, datetime_end, '1D', ALERT_DATA_FREQ)
+    gen_ids = []
+    rows_to_insert = []
+    for loc_id, loc_generators in generators.groupby('loc_id'):
+        sta_id = loc_generators['sta_id'].iloc[0]
+        if pd.isna(sta_id):
+            logger.warning("Skipping alerts of client %s location %s: No station found for location %s", cli_id, loc_id, loc_id)
+            continue
+        loc_gen_ids = [int(x) for x in loc_generators['gen_id']]
+        solar = Solar(db, cli_id=cli_id, loc_id=int(loc_id), gen_ids=loc_gen_ids, sta_id=int(sta_id), datetime_start=datetime_start, datetime_end=datetime_end,
+                      freq='1D', data_freq=ALERT_DATA_FREQ, loc_total_capacity=loc_generators['loc_output_capacity'].fillna(0).iloc[0],
+                      gen_codes_and_names=loc_generators.set_index('gen_id')[['gen_code', 'gen_name', 'gen_rate_power']])
+        solar.aggregate_by_period(gen_data[gen_data['gen_id'].isin(loc_gen_ids)],
+                                  sta_data[sta_data['sta_id'] == sta_id].drop(columns='sta_id'))
+        rows = get_solar_alert_rows(solar, cli_id, thresholds, now)
+        if rows is None:
+            continue
+        gen_ids.extend(solar.gen_ids)
+        rows_to_insert.extend(rows)
+
+    count = insert_cli_gen_alerts(db, cli_id, gen_ids, datetime_start, datetime_end, rows_to_insert) if gen_ids else 0
+    return {'client': cli_id, 'locations': int(generators['loc_id'].nunique()), 'generators': len(gen_ids), 'count': count, 'error': None}
+
+
+def calculate_fleet_alerts(session_factory: Callable[[], Session], datetime_start: datetime, datetime_end: datetime,
+                           cli_ids: Optional[List[int]] = None, max_workers: int = ALERT_SWEEP_MAX_WORKERS) -> List[Dict]:
+    """
+    Compute the alerts of all the locations of the cli_ids clients, or of every client without cli_ids.
+    The generators of all the clients are read with a single query and each client is processed by a pool
+    of at most max_workers threads, each with its own session from session_factory. A failing client is
+    reported with its error without stopping the others.
+    """
+    db = session_factory()
+    try:
+        generators = get_generators_by_client(db, cli_ids)
+    finally:
+        db.close()
+
+    def process_client(cli_id: int, client_generators: pd.DataFrame) -> Dict:
+        db = session_factory()
+        try:
+            return calculate_client_alerts(db, cli_id, client_generators, datetime_start, datetime_end)
+        except Exception as e:
+            logger.error("Alerts of client %s failed: %s", cli_id, e, exc_info=True)
+            db.rollback()
+            return {'client': cli_id, 'locations': int(client_generators['loc_id'].nunique()), 'generators': 0, 'count': 0, 'error': repr(e)}
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(process_client, int(cli_id), client_generators)
+                   for cli_id, client_generators in generators.groupby('cli_id')]
+        return [future.result() for future in futures]
@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+import pandas as pd
+
+SOLAR_DATA_CACHE_HISTORICAL_TTL_SECONDS = 24 * 60 * 60
+SOLAR_DATA_CACHE_RECENT_TTL_SECONDS = 5 * 60
+SOLAR_DATA_CACHE_MAX_ENTRIES = 64
+SOLAR_DATA_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+class SolarDataCache():
+    """
+    In-process cache for the merged Solar.data frame, shared by the endpoints that read the same
+    client, location, generators, station, dates and data_freq. Ranges that end before today are
+    kept for historical_ttl_seconds and ranges touching today for recent_ttl_seconds. The least
+    recently used frames are evicted when there are more than max_entries or they use more than max_bytes.
+    """
+
+    def __init__(self, historical_ttl_seconds: float = SOLAR_DATA_CACHE_HISTORICAL_TTL_SECONDS,
+                 recent_ttl_seconds: float = SOLAR_DATA_CACHE_RECENT_TTL_SECONDS,
+                 max_entries: int = SOLAR_DATA_CACHE_MAX_ENTRIES, max_bytes: int = SOLAR_DATA_CACHE_MAX_BYTES):
+        self.historical_ttl_seconds = historical_ttl_seconds
+        self.recent_ttl_seconds = recent_ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = Counter()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[pd.DataFrame]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= time.monotonic():
+                self._remove(key)
+                self.evictions['expired'] += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1].copy()
+
+    def put(self, key: Hashable, data: pd.DataFrame, datetime_end: datetime):
+        size = int(data.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self._get_ttl(datetime_end)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, data.copy(), size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions['size'] += 1
+
+    def _get_ttl(self, datetime_end: datetime) -> float:
+        today = pd.Timestamp.now().normalize()
+        if pd.Timestamp(datetime_end) >= today:
+            return self.recent_ttl_seconds
+        return self.historical_ttl_seconds
+
+    def _remove(self, key: Hashable):
+        self._bytes -= self._entries.pop(key)[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'bytes': self._bytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': dict(self.evictions)}
+
+
+class SingleFlight():
+    """
+    Coalesces identical concurrent computations: while one caller runs the function for a key, other
+    callers with the same key wait for it and share its result (or exception) instead of running it again.
+    do is for the endpoints run in the thread pool and do_async for the ones run in the event loop.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key: Hashable) -> Tuple[Future, bool]:
+        with self._lock:
+            self.calls += 1
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._in_flight[key] = Future()
+            return future, True
+
+    def _run(self, key: Hashable, future: Future, function: Callable):
+        try:
+            result = function()
+        except BaseException as e:
+            self._leave(key)
+            future.set_exception(e)
+        else:
+            self._leave(key)
+            future.set_result(result)
+
+    def _leave(self, key: Hashable):
+        with self._lock:
+            del self._in_flight[key]
+
+    def do(self, key: Hashable, function: Callable):
+        future, leader = self._join(key)
+        if leader:
+            self._run(key, future, function)
+        return future.result()
+
+    async def do_async(self, key: Hashable, function: Callable):
+        future, leader = self._join(key)
+        if leader:
+            asyncio.get_running_loop().run_in_executor(None, self._run, key, future, function)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'in_flight': len(self._in_flight),
+                    'calls': self.calls,
+                    'coalesced': self.coalesced}
+
+
+solar_data_cache = SolarDataCache()
+solar_fetches = SingleFlight()
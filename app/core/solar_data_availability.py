@@ -2,8 +2,8 @@ from datetime import datetime
 from typing import Dict
 
 import pandas as pd
-from db.utils import (get_expected_data_count_per_period, get_gen_data_count,
-                      get_period_end, get_sta_data_count)
+from db.utils import (get_expected_data_counts_per_period, get_gen_data_count,
+                      get_period_ends, get_sta_data_count)
 from sqlalchemy.orm import Session
 
 
@@ -24,7 +24,7 @@ def _get_data_availability(count_df: pd.DataFrame, datetime_start: datetime, dat
     # Merge the actual data with the periods to fill in the missing gaps in the data
     df = all_periods.merge(count_df, on=['data_type_id', 'period'], how='left').fillna(0)
 
-    df['expected_count'] = df.apply(lambda row: get_expected_data_count_per_period(row['period'], datetime_end, pd_freq, data_freq), axis=1)
+    df['expected_count'] = get_expected_data_counts_per_period(df['period'], datetime_end, pd_freq, data_freq)
     df['data_availability_pct'] = df['data_count'] / df['expected_count'] * 100
 
     df = df.pivot_table(
@@ -34,8 +34,7 @@ def _get_data_availability(count_df: pd.DataFrame, datetime_start: datetime, dat
     )
     df.rename(columns=data_type_names, inplace=True)
     df['from'] = df.index
-    df['to'] = df.apply(
-        lambda x: get_period_end(x['from'], pd_freq, datetime_end), axis=1)
+    df['to'] = get_period_ends(df['from'], pd_freq, datetime_end)
 
     # The resulting df will look like this:
     # from               power from                 to
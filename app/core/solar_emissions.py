@@ -5,15 +5,15 @@ import numpy as np
 import pandas as pd
 from core.solar import Solar
 from db.utils import (get_client_settings, get_co2_emissions_tons_per_Mwh,
-                      get_group_period_end_date)
+                      get_period_ends)
 from sqlalchemy.orm import Session
 
 
 def calculate_co2_avoided(db: Session, cli_id: int, loc_id: int, datetime_start: datetime, datetime_end: datetime, freq: str, data_freq: str) -> pd.DataFrame:
-    solar = Solar(db, cli_id, loc_id, None, None, datetime_start, datetime_end, freq, data_freq)
+    solar = Solar(db, cli_id, loc_id, None, None, datetime_start, datetime_end, freq, data_freq, aggregate_in_db=True, use_rollups=True)
     solar.fetch_aggregated_by_loc_and_period(db)
 
-    if solar.data is None:
+    if solar.data_aggregated_by_period is None:
         return None
 
     co2_per_mwh = get_co2_emissions_tons_per_Mwh(db, solar.loc_id, datetime_start, datetime_end, freq)
@@ -46,6 +46,6 @@ def calculate_co2_avoided(db: Session, cli_id: int, loc_id: int, datetime_start:
         df = df.groupby(pd.Grouper(freq=freq)).agg(agg)
 
     df.fillna(0, inplace=True)
-    df['to'] = df.apply(lambda x: get_group_period_end_date(x, solar.freq, solar.datetime_end), axis=1)
+    df['to'] = get_period_ends(df['from'], solar.freq, solar.datetime_end)
 
     return df[['co2_avoided', 'cert_sold', 'cert_generated', 'co2_per_mwh', 'price', 'income', 'from', 'to']]
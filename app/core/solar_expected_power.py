@@ -1,7 +1,7 @@
 from datetime import datetime
 
 import pandas as pd
-from db.utils import get_loc_output_capacity, get_period_end, get_sta_data
+from db.utils import get_loc_output_capacity, get_period_ends, get_sta_data
 from sqlalchemy.orm import Session
 
 PERFORMANCE_RATIO = 0.8
@@ -17,9 +17,8 @@ def get_expected_power(db: Session, cli_id: int, loc_id: int, datetime_start: da
     if pd_freq:
         df = df.reset_index().set_index('data_date').groupby([pd.Grouper(freq=pd_freq)]).agg({'irradiation': 'sum'})
 
-    df['expected_power'] = df.apply(lambda x: x['irradiation'] * loc_capacity * PERFORMANCE_RATIO / 1000, axis=1)
+    df['expected_power'] = df['irradiation'] * loc_capacity * PERFORMANCE_RATIO / 1000
 
     df['from'] = df.index
-    df['to'] = df.apply(
-        lambda x: get_period_end(x['from'], pd_freq, datetime_end), axis=1)
+    df['to'] = get_period_ends(df['from'], pd_freq, datetime_end)
     return df
@@ -125,6 +125,69 @@ class StaData(Base):
     data_date_added = Column(DateTime(timezone=True))
 
 
+class GenDataDaily(Base):
+    __tablename__ = "gen_data_daily"
+
+    cli_id = Column(Integer, ForeignKey(
+        "client.cli_id_auto"), primary_key=True)
+    gen_id = Column(Integer, ForeignKey(
+        "generator.gen_id_auto"), primary_key=True)
+    sta_id = Column(Integer, ForeignKey(
+        "station.sta_id_auto"), primary_key=True)
+    data_date = Column(DateTime, primary_key=True)
+    data_freq = Column(String, primary_key=True)
+    data_pro_id = Column(Integer, ForeignKey(
+        "data_processing.data_pro_id_auto"))
+    power = Column(Float)
+    ac_production = Column(Float)
+    ac_production_prediction = Column(Float)
+    data_count = Column(Integer)
+    unavailable_count = Column(Integer)
+    last_ac_production = Column(Float)
+    data_date_added = Column(DateTime(timezone=True))
+
+
+class StaDataDaily(Base):
+    __tablename__ = "sta_data_daily"
+
+    cli_id = Column(Integer, ForeignKey(
+        "client.cli_id_auto"), primary_key=True)
+    sta_id = Column(Integer, ForeignKey(
+        "station.sta_id_auto"), primary_key=True)
+    data_date = Column(DateTime, primary_key=True)
+    data_freq = Column(String, primary_key=True)
+    data_pro_id = Column(Integer, ForeignKey(
+        "data_processing.data_pro_id_auto"))
+    ambient_temp_sum = Column(Float)
+    module_temp_sum = Column(Float)
+    irradiation = Column(Float)
+    slot_count = Column(Integer)
+    data_date_added = Column(DateTime(timezone=True))
+
+
+class GenDataFeatures(Base):
+    __tablename__ = "gen_data_features"
+
+    cli_id = Column(Integer, ForeignKey(
+        "client.cli_id_auto"), primary_key=True)
+    gen_id = Column(Integer, ForeignKey(
+        "generator.gen_id_auto"), primary_key=True)
+    data_date = Column(DateTime, primary_key=True)
+    loc_id = Column(Integer, ForeignKey(
+        "location.loc_id_auto"))
+    data_pro_id = Column(Integer, ForeignKey(
+        "data_processing.data_pro_id_auto"))
+    temperature = Column(Float)
+    precipitation_total = Column(Float)
+    cloud_cover_total = Column(Float)
+    shortwave_radiation = Column(Float)
+    generated_power = Column(Float)
+    generated_power_lag = Column(Float)
+    hours_since_last_rain = Column(Float)
+    solar_zenith_angle = Column(Float)
+    data_date_added = Column(DateTime(timezone=True))
+
+
 class LocData(Base):
     __tablename__ = "loc_data"
 
@@ -422,5 +485,14 @@ class CliGenAlert(Base):
     cli_gen_alert_trigger = Column(DateTime(timezone=True))
 
 
+class CliGenAlertEvaluation(Base):
+    __tablename__ = "cli_gen_alert_evaluation"
+
+    cli_id = Column(Integer, ForeignKey("client.cli_id_auto"), primary_key=True)
+    gen_id = Column(Integer, ForeignKey("generator.gen_id_auto"), primary_key=True)
+    cli_gen_alert_evaluated_date = Column(DateTime)
+    cli_gen_alert_evaluation_updated = Column(DateTime(timezone=True))
+
+
 
     
\ No newline at end of file
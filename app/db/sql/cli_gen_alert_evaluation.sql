@@ -0,0 +1,11 @@
+-- Last day whose alerts were evaluated for each generator, read and written by the incremental alerts
+-- (db/utils.py get_alert_evaluated_dates and update_alert_evaluated_dates).
+-- The primary key is the conflict target of the upsert of update_alert_evaluated_dates.
+
+CREATE TABLE IF NOT EXISTS cli_gen_alert_evaluation (
+    cli_id integer NOT NULL,
+    gen_id integer NOT NULL,
+    cli_gen_alert_evaluated_date timestamp without time zone,
+    cli_gen_alert_evaluation_updated timestamp with time zone,
+    CONSTRAINT cli_gen_alert_evaluation_pkey PRIMARY KEY (cli_id, gen_id)
+);
@@ -0,0 +1,33 @@
+-- Daily generator and station rollups read by Solar for ranges of whole days (db/utils.py refresh_daily_rollups).
+-- The primary keys are the conflict targets of the upserts of refresh_daily_rollups.
+
+CREATE TABLE IF NOT EXISTS gen_data_daily (
+    cli_id integer NOT NULL,
+    gen_id integer NOT NULL,
+    sta_id integer NOT NULL,
+    data_date timestamp without time zone NOT NULL,
+    data_freq character varying NOT NULL,
+    data_pro_id integer,
+    power double precision,
+    ac_production double precision,
+    ac_production_prediction double precision,
+    data_count integer,
+    unavailable_count integer,
+    last_ac_production double precision,
+    data_date_added timestamp with time zone,
+    CONSTRAINT gen_data_daily_pkey PRIMARY KEY (cli_id, gen_id, sta_id, data_date, data_freq)
+);
+
+CREATE TABLE IF NOT EXISTS sta_data_daily (
+    cli_id integer NOT NULL,
+    sta_id integer NOT NULL,
+    data_date timestamp without time zone NOT NULL,
+    data_freq character varying NOT NULL,
+    data_pro_id integer,
+    ambient_temp_sum double precision,
+    module_temp_sum double precision,
+    irradiation double precision,
+    slot_count integer,
+    data_date_added timestamp with time zone,
+    CONSTRAINT sta_data_daily_pkey PRIMARY KEY (cli_id, sta_id, data_date, data_freq)
+);
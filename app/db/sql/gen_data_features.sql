@@ -0,0 +1,20 @@
+-- Hourly anomaly detection features of each generator (db/utils.py insert_or_update_gens_features).
+-- The primary key is the conflict target of the upsert of insert_or_update_gens_features.
+
+CREATE TABLE IF NOT EXISTS gen_data_features (
+    cli_id integer NOT NULL,
+    gen_id integer NOT NULL,
+    data_date timestamp without time zone NOT NULL,
+    loc_id integer,
+    data_pro_id integer,
+    temperature double precision,
+    precipitation_total double precision,
+    cloud_cover_total double precision,
+    shortwave_radiation double precision,
+    generated_power double precision,
+    generated_power_lag double precision,
+    hours_since_last_rain double precision,
+    solar_zenith_angle double precision,
+    data_date_added timestamp with time zone,
+    CONSTRAINT gen_data_features_pkey PRIMARY KEY (cli_id, gen_id, data_date)
+);
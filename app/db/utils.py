@@ -1,15 +1,120 @@
 import datetime
+import functools
+import inspect
+import io
+import threading
 import time
-from typing import Dict, List, Optional, Tuple
+import uuid
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 import pandas as pd
+import pytz
 import sqlalchemy.dialects.postgresql as pq
 from dateutil.relativedelta import SU, relativedelta
-from db.models import (CliGenAlert, CliSetting, CtrData, GenData, Generator,
-                       Location, StaData, Station)
+from db.models import (CliGenAlert, CliGenAlertEvaluation, CliSetting, Country, CtrData, DataProcessing,
+                       GenData, GenDataDaily, GenDataFeatures, Generator, Location, StaData,
+                       StaDataDaily, Station)
+from sqlalchemy import BigInteger, Integer, column, inspect as sa_inspect, select, table
 from sqlalchemy.orm import Session
 from sqlalchemy.sql import func
-from sqlalchemy.sql.expression import extract
+from sqlalchemy.sql.expression import and_, cast, extract, literal_column, text
+
+
+METADATA_CACHE_TTL_SECONDS = 60 * 60
+METADATA_CACHE_MAX_ENTRIES = 1024
+
+
+class MetadataCache():
+    """
+    In-process cache for metadata lookups (generators, stations, locations and client settings),
+    which rarely change. Entries expire after ttl_seconds, the least recently used ones are evicted
+    when there are more than max_entries, and entries can be invalidated by cli_id or loc_id.
+    """
+
+    def __init__(self, ttl_seconds: float = METADATA_CACHE_TTL_SECONDS, max_entries: int = METADATA_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = Counter()
+        self.misses = Counter()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key: Tuple, tags: Dict[str, int], load: Callable):
+        name = key[0]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits[name] += 1
+                return _copy_cached_value(entry[1])
+            self.misses[name] += 1
+
+        value = load()
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value, tags)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return _copy_cached_value(value)
+
+    def cached(self, cli_id: Optional[str] = None, loc_id: Optional[str] = None):
+        """
+        Decorator for lookups taking the session as first argument. cli_id and loc_id are the names of the
+        arguments holding the client and location the entry belongs to, used by invalidate.
+        """
+        def decorator(function):
+            signature = inspect.signature(function)
+
+            @functools.wraps(function)
+            def wrapper(db: Session, *args, **kwargs):
+                arguments = signature.bind(db, *args, **kwargs).arguments
+                del arguments[next(iter(signature.parameters))]
+                key = (function.__name__, get_bind_key(db)) + tuple((name, _to_hashable(value)) for name, value in arguments.items())
+                tags = {'cli_id': arguments.get(cli_id), 'loc_id': arguments.get(loc_id)}
+                return self.get_or_load(key, tags, lambda: function(db, *args, **kwargs))
+            return wrapper
+        return decorator
+
+    def invalidate(self, cli_id: Optional[int] = None, loc_id: Optional[int] = None):
+        with self._lock:
+            for key in [key for key, entry in self._entries.items()
+                        if (cli_id is not None and entry[2]['cli_id'] == cli_id) or (loc_id is not None and entry[2]['loc_id'] == loc_id)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits.clear()
+            self.misses.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'hits': dict(self.hits),
+                    'misses': dict(self.misses),
+                    'saved_round_trips': sum(self.hits.values())}
+
+
+def get_bind_key(db: Session) -> Optional[str]:
+    # Sessions bound to different databases must not share entries
+    bind = getattr(db, 'bind', None)
+    return str(getattr(bind, 'url', bind)) if bind is not None else None
+
+
+def _to_hashable(value):
+    if isinstance(value, (list, tuple, set)):
+        return tuple(value)
+    return value
+
+
+def _copy_cached_value(value):
+    if isinstance(value, pd.DataFrame):
+        return value.copy()
+    return value
+
+
+metadata_cache = MetadataCache()
 
 
 def get_group_period_end_date(rows, freq, datetime_end):
@@ -50,6 +155,45 @@ def get_period_end(datetime_start, freq, end_date):
     return period_end
 
 
+def get_period_ends(datetime_starts, freq, end_date):
+    """
+    Vectorized get_period_end for a DatetimeIndex or a Series of period starts.
+    Returns a Series with the same index when given a Series, and a DatetimeIndex otherwise.
+    """
+    starts = pd.DatetimeIndex(datetime_starts)
+    end_of_last_day = pd.Timestamp(datetime.datetime(end_date.year, end_date.month, end_date.day, 23, 59, 59))
+    one_second = pd.Timedelta(seconds=1)
+    end_of_day = pd.Timedelta(hours=23, minutes=59, seconds=59)
+
+    if freq is None:
+        period_ends = pd.DatetimeIndex([end_date] * len(starts))
+    else:
+        if freq == "1H":
+            period_ends = starts + pd.Timedelta(hours=1) - one_second
+        elif freq == "15T":
+            period_ends = starts + pd.Timedelta(minutes=15) - one_second
+        elif freq == "1D":
+            period_ends = starts - pd.to_timedelta(starts.hour, unit='h') - pd.to_timedelta(starts.minute, unit='m') + pd.Timedelta(days=1) - one_second
+        elif freq == "1W":
+            period_ends = starts.normalize() + end_of_day + pd.to_timedelta(starts.microsecond, unit='us') + pd.Timedelta(days=1)
+            period_ends = period_ends + pd.to_timedelta((6 - period_ends.weekday) % 7, unit='D')
+        elif freq == "1M" or freq == "1MS":
+            period_ends = starts.normalize() + pd.offsets.MonthEnd(0) + end_of_day + pd.to_timedelta(starts.microsecond, unit='us')
+        elif freq == "1Y" or freq == "1YS":
+            period_ends = starts.to_period('Y').end_time.floor('s')
+        else:
+            period_ends = pd.DatetimeIndex([pd.NaT] * len(starts))
+        period_ends = period_ends.where(period_ends.notna() & (period_ends <= end_date), end_of_last_day)
+
+    if isinstance(datetime_starts, pd.Series):
+        return pd.Series(period_ends, index=datetime_starts.index)
+    return period_ends
+
+
+PERIOD_FREQUENCIES = {'1H': 'hour', '1D': 'day', '1W': 'week', '1MS': 'month', '1YS': 'year'}
+STREAM_CHUNK_SIZE = 100000
+
+
 def group_by_to_pd_frequency(group_by):
 
     if group_by == "hour":
@@ -133,46 +277,534 @@ def adjust_data_date_by_freq(row, freq):
     return row
 
 
-def get_gen_datas_grouped(db: Session, cli_id: int, gen_ids: list, datetime_start, datetime_end, freq: str, data_type_names: Dict[int, str]) -> pd.DataFrame:
+def data_date_slot(data_date, freq: str):
+    """
+    SQL expression equivalent to remove_microseconds followed by dropping the seconds
+    and adjust_data_date_by_freq, so timestamps can be normalized by the database.
+    """
+    data_date = func.date_trunc(literal_column("'minute'"), data_date + text("interval '499999 microseconds'"))
+    if freq in ['1MS', '1Y']:
+        return func.date_trunc(literal_column("'day'"), data_date)
+    return data_date
+
+
+def read_sql_chunks(db: Session, query, chunksize: int, group_columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Stream the result of query through a server side cursor in DataFrames of about chunksize rows, so
+    only one chunk is held in memory at a time. When group_columns is given the query must be ordered
+    by them, and rows sharing their values are never split across chunks.
+    """
+    statement = query.statement.execution_options(stream_results=True, max_row_buffer=chunksize)
+    pending = None
+    for chunk in pd.read_sql(statement, db.bind, chunksize=chunksize):
+        if pending is not None:
+            chunk = pd.concat([pending, chunk], ignore_index=True)
+        if group_columns:
+            is_last_group = (chunk[group_columns] == chunk[group_columns].iloc[-1]).all(axis=1)
+            pending = chunk[is_last_group]
+            chunk = chunk[~is_last_group]
+        if not chunk.empty:
+            yield chunk
+    if pending is not None and not pending.empty:
+        yield pending
+
+
+def read_sql_copy(db: Session, query) -> pd.DataFrame:
+    """
+    Read query with COPY (SELECT ...) TO STDOUT as CSV parsed by the pandas CSV reader, which builds the
+    columns directly instead of going through a Python tuple per row as read_sql does.
+    The data_date column is parsed as datetime.
+    """
+    compiled = query.statement.compile(dialect=db.bind.dialect, compile_kwargs={'render_postcompile': True})
+    buffer = io.StringIO()
+    connection = db.bind.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            sql = cursor.mogrify(str(compiled), compiled.params).decode()
+            cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER true)", buffer)
+    finally:
+        connection.close()
+
+    buffer.seek(0)
+    df = pd.read_csv(buffer)
+    if 'data_date' in df.columns:
+        df['data_date'] = pd.to_datetime(df['data_date'], format='ISO8601')
+    return df
+
+
+def _read_query(db: Session, query, use_copy: bool = False) -> pd.DataFrame:
+    if use_copy:
+        return read_sql_copy(db, query)
+    return pd.read_sql(query.statement, db.bind)
+
+
+def _index_gen_datas_grouped(df: pd.DataFrame, data_type_names: Dict[int, str]) -> pd.DataFrame:
+    df = df.set_index(['gen_id', 'data_date']).dropna(axis=1, how='all').dropna(how='all').sort_index()
+    for column in [x for x in data_type_names.values() if x not in df.columns]:
+        df[column] = None
+    return df[[data_type_names[x] for x in sorted(data_type_names.keys())]]
+
+
+def get_gen_datas_grouped(db: Session, cli_id: int, gen_ids: list, datetime_start, datetime_end, freq: str, data_type_names: Dict[int, str],
+                          chunksize: Optional[int] = None, use_copy: bool = False) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
     """
     Get generator data for multiple data types and multiple generators.
+    The data types are pivoted into columns by the database, returning one row per generator and date.
+    With chunksize, an iterator of DataFrames of at most chunksize rows ordered by generator and date is returned instead.
+    With use_copy, the data is read with read_sql_copy.
     """
     t0 = time.time()
-    df = pd.read_sql(
-        db.query(GenData.gen_id, GenData.data_date,
-                 GenData.data_value, GenData.data_type_id)
+    data_date = data_date_slot(GenData.data_date, freq)
+    data_type_columns = [func.avg(GenData.data_value).filter(GenData.data_type_id == data_type_id).label(data_type_names[data_type_id])
+                         for data_type_id in sorted(data_type_names.keys())]
+    query = (
+        db.query(GenData.gen_id, data_date.label('data_date'), *data_type_columns)
         .filter(GenData.gen_id.in_(gen_ids))
         .filter(GenData.data_type_id.in_(data_type_names.keys()))
         .filter(GenData.data_date < datetime_end)
         .filter(GenData.data_date >= datetime_start)
-        .statement,
-        db.bind)
+        .group_by(GenData.gen_id, data_date))
 
-    if not df.empty:
-        df["data_date"] = df["data_date"].apply(
-            lambda row: remove_microseconds(row))
-        df['data_date'] = df['data_date'] - \
-            pd.to_timedelta(df['data_date'].dt.second, unit='s')
-        df['data_date'] = df['data_date'].apply(
-            lambda row: adjust_data_date_by_freq(row, freq))
+    if chunksize:
+        return (_index_gen_datas_grouped(chunk, data_type_names)
+                for chunk in read_sql_chunks(db, query.order_by(GenData.gen_id, data_date), chunksize))
 
-    df = pd.pivot_table(df, values='data_value', index=[
-                        'gen_id', 'data_date'], columns='data_type_id')
-    df.rename(columns=data_type_names, inplace=True)
-    for column in [x for x in data_type_names.values() if x not in df.columns]:
-        df[column] = None
+    df = _index_gen_datas_grouped(_read_query(db, query, use_copy), data_type_names)
     t1 = time.time()
     print(
         f"Function get_gen_datas for {len(gen_ids)} generators and {len(data_type_names.keys())} data types took {t1 - t0:.2f} seconds.")
     return df
 
 
-def get_sta_datas_grouped(db: Session, cli_id: int, sta_id: int, datetime_start, datetime_end, data_freq: str, data_type_names: Dict[int, str]) -> pd.DataFrame:
+def data_date_period(data_date, freq: str):
+    """
+    SQL expression with the label pd.Grouper(freq=freq) gives to the period containing data_date.
+    """
+    period = func.date_trunc(literal_column(f"'{PERIOD_FREQUENCIES[freq]}'"), data_date)
+    if freq == '1W':
+        # Weekly periods are labeled by pandas with the sunday that ends them
+        return period + text("interval '6 days'")
+    return period
+
+
+def _is_aligned_to_data_freq(data_date, datetime_start, data_freq: str):
+    data_freq_seconds = int(pd.to_timedelta(data_freq).total_seconds())
+    return func.mod(cast(extract('epoch', data_date - datetime_start), BigInteger), data_freq_seconds) == 0
+
+
+def _get_sta_slots(db: Session, cli_id: int, sta_id: Optional[int], datetime_start, datetime_end, data_freq: str):
+    # Without sta_id, the slots of every station of the client
+    data_date = data_date_slot(StaData.data_date, data_freq)
+    query = (
+        db.query(
+            StaData.sta_id,
+            data_date.label('data_date'),
+            func.coalesce(func.sum(StaData.data_value).filter(StaData.data_type_id == 503), 0).label('avg_ambient_temp'),
+            func.coalesce(func.sum(StaData.data_value).filter(StaData.data_type_id == 504), 0).label('avg_module_temp'),
+            func.coalesce(func.sum(StaData.data_value).filter(StaData.data_type_id == 505), 0).label('irradiation'))
+        .filter(StaData.cli_id == cli_id))
+    if sta_id is not None:
+        query = query.filter(StaData.sta_id == sta_id)
+    return (
+        query
+        .filter(StaData.data_type_id.in_([503, 504, 505]))
+        .filter(StaData.data_date < datetime_end)
+        .filter(StaData.data_date >= datetime_start)
+        .group_by(StaData.sta_id, data_date)
+        .subquery())
+
+
+def _get_loc_stations(db: Session):
+    # The station of each location, the first one when it has several
+    return db.query(Station.loc_id, func.min(Station.sta_id_auto).label('sta_id')).group_by(Station.loc_id).subquery()
+
+
+def _get_gen_datas_by_period_query(db: Session, cli_id: int, gen_ids: Optional[list], sta_id: Optional[int], datetime_start, datetime_end, freq: Optional[str],
+                                   data_freq: str, last_slot_per_day: bool = False):
+    # Without gen_ids and sta_id, every generator of the client joined with the station of its location
+    data_date = data_date_slot(GenData.data_date, data_freq)
+    gen_slots = (
+        db.query(
+            GenData.gen_id,
+            data_date.label('data_date'),
+            func.avg(GenData.data_value).filter(GenData.data_type_id == 501).label('power'),
+            func.avg(GenData.data_value).filter(GenData.data_type_id == 502).label('ac_production'),
+            func.avg(GenData.data_value).filter(GenData.data_type_id == 508).label('ac_production_prediction'))
+        .filter(GenData.gen_id.in_(gen_ids) if gen_ids is not None else GenData.cli_id == cli_id)
+        .filter(GenData.data_type_id.in_([501, 502, 508]))
+        .filter(GenData.data_date < datetime_end)
+        .filter(GenData.data_date >= datetime_start)
+        .group_by(GenData.gen_id, data_date)
+        .subquery())
+    sta_slots = _get_sta_slots(db, cli_id, sta_id, datetime_start, datetime_end, data_freq)
+
+    if last_slot_per_day:
+        last_slot_seconds = 24 * 60 * 60 - int(pd.to_timedelta(data_freq).total_seconds())
+        is_last_slot = gen_slots.c.data_date == func.date_trunc(literal_column("'day'"), gen_slots.c.data_date) + text(f"interval '{last_slot_seconds} seconds'")
+    else:
+        is_last_slot = gen_slots.c.data_date == pd.date_range(datetime_start, datetime_end, freq=data_freq)[-1].to_pydatetime()
+    power = func.coalesce(gen_slots.c.power, gen_slots.c.ac_production)
+    ac_production = func.coalesce(gen_slots.c.ac_production, gen_slots.c.power)
+    columns = [
+        func.sum(power).label('power'),
+        func.sum(ac_production).label('ac_production'),
+        func.sum(gen_slots.c.ac_production_prediction).label('ac_production_prediction'),
+        func.count(power).label('data_count'),
+        func.count().filter(and_(power == 0, sta_slots.c.irradiation > 0)).label('unavailable_count'),
+        func.sum(ac_production).filter(is_last_slot).label('last_ac_production')
+    ]
+    group_by = [gen_slots.c.gen_id]
+    if freq:
+        period = data_date_period(gen_slots.c.data_date, freq)
+        columns.insert(0, period.label('data_date'))
+        group_by.append(period)
+
+    query = db.query(gen_slots.c.gen_id, *columns)
+    if sta_id is not None:
+        query = query.outerjoin(sta_slots, sta_slots.c.data_date == gen_slots.c.data_date)
+    else:
+        loc_stations = _get_loc_stations(db)
+        query = (query
+                 .join(Generator, Generator.gen_id_auto == gen_slots.c.gen_id)
+                 .outerjoin(loc_stations, loc_stations.c.loc_id == Generator.loc_id)
+                 .outerjoin(sta_slots, and_(sta_slots.c.sta_id == loc_stations.c.sta_id, sta_slots.c.data_date == gen_slots.c.data_date)))
+    return (
+        query
+        .filter(gen_slots.c.data_date <= datetime_end)
+        .filter(_is_aligned_to_data_freq(gen_slots.c.data_date, datetime_start, data_freq))
+        .group_by(*group_by))
+
+
+def get_gen_datas_by_period(db: Session, cli_id: int, gen_ids: list, sta_id: int, datetime_start, datetime_end, freq: Optional[str], data_freq: str,
+                            use_copy: bool = False) -> pd.DataFrame:
+    """
+    Get power (501), AC production (502) and predicted AC production (508) aggregated by the database
+    per generator and period, applying the same rules Solar applies to the raw data at data_freq:
+    power and AC production fill each other, unavailable_count counts the data_freq slots with no power
+    and positive irradiation and last_ac_production is the AC production of the last slot of the range.
+    Without freq the whole range is a single period and no data_date column is returned.
+    With use_copy, the data is read with read_sql_copy.
+    """
+    t0 = time.time()
+    df = _read_query(db, _get_gen_datas_by_period_query(db, cli_id, gen_ids, sta_id, datetime_start, datetime_end, freq, data_freq), use_copy)
+    t1 = time.time()
+    print(f"Function get_gen_datas_by_period for {len(gen_ids)} generators took {t1 - t0:.2f} seconds.")
+    return df
+
+
+def get_client_gen_datas_by_period(db: Session, cli_id: int, datetime_start, datetime_end, freq: Optional[str], data_freq: str,
+                                   use_copy: bool = False) -> pd.DataFrame:
+    """
+    Same as get_gen_datas_by_period for every generator of a client with a single query, each one
+    joined in the database with the station of its location.
+    """
+    t0 = time.time()
+    df = _read_query(db, _get_gen_datas_by_period_query(db, cli_id, None, None, datetime_start, datetime_end, freq, data_freq), use_copy)
+    t1 = time.time()
+    print(f"Function get_client_gen_datas_by_period for client {cli_id} took {t1 - t0:.2f} seconds.")
+    return df
+
+
+def _get_sta_datas_by_period_query(db: Session, cli_id: int, sta_id: Optional[int], datetime_start, datetime_end, freq: Optional[str], data_freq: str):
+    # Without sta_id, every station of the client with a sta_id column
+    sta_slots = _get_sta_slots(db, cli_id, sta_id, datetime_start, datetime_end, data_freq)
+    columns = [
+        func.avg(sta_slots.c.avg_ambient_temp).label('avg_ambient_temp'),
+        func.avg(sta_slots.c.avg_module_temp).label('avg_module_temp'),
+        func.sum(sta_slots.c.irradiation).label('irradiation')
+    ]
+    keys = [] if sta_id is not None else [sta_slots.c.sta_id]
+    group_by = list(keys)
+    if freq:
+        period = data_date_period(sta_slots.c.data_date, freq)
+        columns.insert(0, period.label('data_date'))
+        group_by.append(period)
+
+    query = (
+        db.query(*keys, *columns)
+        .filter(sta_slots.c.data_date <= datetime_end)
+        .filter(_is_aligned_to_data_freq(sta_slots.c.data_date, datetime_start, data_freq)))
+    return query.group_by(*group_by) if group_by else query
+
+
+def get_sta_datas_by_period(db: Session, cli_id: int, sta_id: int, datetime_start, datetime_end, freq: Optional[str], data_freq: str,
+                            use_copy: bool = False) -> pd.DataFrame:
+    """
+    Get ambient temperature (503), module temperature (504) and irradiation (505) aggregated by the
+    database per period, averaging the temperatures and adding up the irradiation of the data_freq slots.
+    Without freq the whole range is a single period and no data_date column is returned.
+    With use_copy, the data is read with read_sql_copy.
+    """
+    t0 = time.time()
+    df = _read_query(db, _get_sta_datas_by_period_query(db, cli_id, sta_id, datetime_start, datetime_end, freq, data_freq), use_copy)
+    t1 = time.time()
+    print(f"Function get_sta_datas_by_period for 1 station took {t1 - t0:.2f} seconds.")
+    return df
+
+
+def get_client_sta_datas_by_period(db: Session, cli_id: int, datetime_start, datetime_end, freq: Optional[str], data_freq: str,
+                                   use_copy: bool = False) -> pd.DataFrame:
+    """
+    Same as get_sta_datas_by_period for every station of a client with a single query, plus a sta_id column.
+    """
+    t0 = time.time()
+    df = _read_query(db, _get_sta_datas_by_period_query(db, cli_id, None, datetime_start, datetime_end, freq, data_freq), use_copy)
+    t1 = time.time()
+    print(f"Function get_client_sta_datas_by_period for client {cli_id} took {t1 - t0:.2f} seconds.")
+    return df
+
+
+ROLLUP_DATA_FREQS = ['15T']
+ROLLUP_FREQUENCIES = ['1D', '1W', '1MS', '1YS']
+ROLLUP_INSERT_CHUNK_SIZE = 1000
+GEN_ROLLUP_COLUMNS = ['power', 'ac_production', 'ac_production_prediction', 'data_count', 'unavailable_count', 'last_ac_production']
+STA_ROLLUP_COLUMNS = ['ambient_temp_sum', 'module_temp_sum', 'irradiation', 'slot_count']
+
+
+def _get_rollup_days(datetime_start, datetime_end) -> pd.DatetimeIndex:
+    return pd.date_range(pd.Timestamp(datetime_start).normalize(), pd.Timestamp(datetime_end).normalize(), freq='D', name='data_date')
+
+
+def compute_daily_rollups(db: Session, cli_id: int, gen_ids: List[int], sta_id: int, datetime_start, datetime_end, data_freq: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Compute from the raw data the rows of gen_data_daily and sta_data_daily for the days between
+    datetime_start and datetime_end. Every generator and day gets a row, also without data, so a day
+    without data can be told apart from a day that was not refreshed yet.
+    """
+    days = _get_rollup_days(datetime_start, datetime_end)
+    day_start = days[0].to_pydatetime()
+    day_end = (days[-1] + pd.Timedelta(days=1, seconds=-1)).to_pydatetime()
+
+    gen = pd.read_sql(
+        _get_gen_datas_by_period_query(db, cli_id, gen_ids, sta_id, day_start, day_end, '1D', data_freq, last_slot_per_day=True).statement,
+        db.bind)
+    sta_slots = _get_sta_slots(db, cli_id, sta_id, day_start, day_end, data_freq)
+    period = data_date_period(sta_slots.c.data_date, '1D')
+    sta = pd.read_sql(
+        db.query(
+            period.label('data_date'),
+            func.sum(sta_slots.c.avg_ambient_temp).label('ambient_temp_sum'),
+            func.sum(sta_slots.c.avg_module_temp).label('module_temp_sum'),
+            func.sum(sta_slots.c.irradiation).label('irradiation'),
+            func.count().label('slot_count'))
+        .filter(sta_slots.c.data_date <= day_end)
+        .filter(_is_aligned_to_data_freq(sta_slots.c.data_date, day_start, data_freq))
+        .group_by(period)
+        .statement,
+        db.bind)
+
+    gen['data_date'] = pd.to_datetime(gen['data_date'])
+    gen = gen.set_index(['gen_id', 'data_date']).reindex(pd.MultiIndex.from_product([sorted(gen_ids), days], names=['gen_id', 'data_date']))
+    gen[['data_count', 'unavailable_count']] = gen[['data_count', 'unavailable_count']].fillna(0).astype('int64')
+    sta['data_date'] = pd.to_datetime(sta['data_date'])
+    sta = sta.set_index('data_date').reindex(days)
+    sta['slot_count'] = sta['slot_count'].fillna(0).astype('int64')
+    return gen[GEN_ROLLUP_COLUMNS].reset_index(), sta[STA_ROLLUP_COLUMNS].reset_index()
+
+
+def _upsert_rollups(db: Session, model, df: pd.DataFrame, index_elements: List[str]):
+    rows = df.astype(object).where(df.notna(), None).to_dict('records')
+    for chunk_start in range(0, len(rows), ROLLUP_INSERT_CHUNK_SIZE):
+        insert_stmt = pq.insert(model).values(rows[chunk_start:chunk_start + ROLLUP_INSERT_CHUNK_SIZE])
+        db.execute(insert_stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={column: insert_stmt.excluded[column] for column in df.columns if column not in index_elements}))
+
+
+@metadata_cache.cached()
+def has_table(db: Session, table_name: str) -> bool:
+    return sa_inspect(db.get_bind()).has_table(table_name)
+
+
+def has_daily_rollups(db: Session) -> bool:
+    """
+    Whether the gen_data_daily and sta_data_daily tables exist (db/sql/daily_rollups.sql). The answer is cached
+    with the other metadata, so tables created while the API runs are used once the entry expires.
+    """
+    return has_table(db, GenDataDaily.__tablename__) and has_table(db, StaDataDaily.__tablename__)
+
+
+def refresh_daily_rollups(db: Session, cli_id: int, loc_id: int, datetime_start, datetime_end, data_pro_id: Optional[int] = None, data_freqs: List[str] = ROLLUP_DATA_FREQS) -> int:
+    """
+    Recompute the daily rollups of every generator and the station of a location for the days between
+    datetime_start and datetime_end. Returns the number of rows written.
+    """
+    gen_ids = [int(x) for x in get_gen_ids_by_loc_id(db, loc_id)['gen_id_auto'].values]
+    station = get_sta_id_by_loc_id(db, loc_id)
+    if not gen_ids or station.empty:
+        return 0
+    sta_id = int(station['sta_id_auto'][0])
+
+    row_count = 0
+    for data_freq in data_freqs:
+        gen, sta = compute_daily_rollups(db, cli_id, gen_ids, sta_id, datetime_start, datetime_end, data_freq)
+        keys = {'cli_id': cli_id, 'sta_id': sta_id, 'data_freq': data_freq, 'data_pro_id': data_pro_id, 'data_date_added': datetime.datetime.now()}
+        _upsert_rollups(db, GenDataDaily, gen.assign(**keys), ['cli_id', 'gen_id', 'sta_id', 'data_date', 'data_freq'])
+        _upsert_rollups(db, StaDataDaily, sta.assign(**keys), ['cli_id', 'sta_id', 'data_date', 'data_freq'])
+        row_count += len(gen) + len(sta)
+    db.commit()
+    return row_count
+
+
+def refresh_daily_rollups_by_data_pro_id(db: Session, data_pro_id: int) -> Tuple[int, int, datetime.datetime, datetime.datetime, int]:
+    """
+    Refresh the daily rollups of the days touched by a data_processing batch.
+    """
+    processing = db.query(DataProcessing).filter(DataProcessing.data_pro_id_auto == data_pro_id).first()
+    if processing is None:
+        return None, None, None, None, 0
+
+    dates = [date for model in [GenData, StaData]
+             for date in db.query(func.min(model.data_date), func.max(model.data_date)).filter(model.data_pro_id == data_pro_id).one()
+             if date is not None]
+    if not dates:
+        return processing.cli_id, processing.loc_id, None, None, 0
+
+    datetime_start, datetime_end = min(dates), max(dates)
+    row_count = refresh_daily_rollups(db, processing.cli_id, processing.loc_id, datetime_start, datetime_end, data_pro_id)
+    return processing.cli_id, processing.loc_id, datetime_start, datetime_end, row_count
+
+
+def refresh_prediction_rollups(db: Session, cli_id: int, predictions: pd.DataFrame) -> int:
+    """
+    Refresh the daily rollups of the locations and days of the gen_id, data_date and data_pro_id predictions just
+    written, so ac_production_prediction includes them. Nothing is done while the rollup tables do not exist.
+    """
+    if predictions.empty or not has_daily_rollups(db):
+        return 0
+    gen_ids = [int(x) for x in predictions['gen_id'].unique()]
+    loc_ids = pd.read_sql(db.query(Generator.loc_id)
+                          .filter(Generator.cli_id == cli_id)
+                          .filter(Generator.gen_id_auto.in_(gen_ids))
+                          .distinct()
+                          .statement, db.bind)['loc_id'].dropna()
+    data_pro_ids = predictions['data_pro_id'].dropna()
+    data_pro_id = int(data_pro_ids.max()) if not data_pro_ids.empty else None
+    datetime_start, datetime_end = predictions['data_date'].min(), predictions['data_date'].max()
+    return sum(refresh_daily_rollups(db, cli_id, int(loc_id), datetime_start, datetime_end, data_pro_id) for loc_id in loc_ids)
+
+
+def get_gen_rollups_by_period(db: Session, cli_id: int, gen_ids: list, sta_id: int, datetime_start, datetime_end, freq: Optional[str], data_freq: str) -> pd.DataFrame:
+    """
+    Same columns as get_gen_datas_by_period, read from gen_data_daily for ranges made of whole days,
+    plus day_count with the number of daily rows found.
+    """
+    last_day = pd.Timestamp(datetime_end).normalize().to_pydatetime()
+    columns = [
+        func.sum(GenDataDaily.power).label('power'),
+        func.sum(GenDataDaily.ac_production).label('ac_production'),
+        func.sum(GenDataDaily.ac_production_prediction).label('ac_production_prediction'),
+        func.sum(GenDataDaily.data_count).label('data_count'),
+        func.sum(GenDataDaily.unavailable_count).label('unavailable_count'),
+        func.sum(GenDataDaily.last_ac_production).filter(GenDataDaily.data_date == last_day).label('last_ac_production'),
+        func.count().label('day_count')
+    ]
+    group_by = [GenDataDaily.gen_id]
+    if freq:
+        period = data_date_period(GenDataDaily.data_date, freq)
+        columns.insert(0, period.label('data_date'))
+        group_by.append(period)
+
+    return pd.read_sql(
+        db.query(GenDataDaily.gen_id, *columns)
+        .filter(GenDataDaily.cli_id == cli_id)
+        .filter(GenDataDaily.gen_id.in_(gen_ids))
+        .filter(GenDataDaily.sta_id == sta_id)
+        .filter(GenDataDaily.data_freq == data_freq)
+        .filter(GenDataDaily.data_date >= datetime_start)
+        .filter(GenDataDaily.data_date <= datetime_end)
+        .group_by(*group_by)
+        .statement,
+        db.bind)
+
+
+def get_sta_rollups_by_period(db: Session, cli_id: int, sta_id: int, datetime_start, datetime_end, freq: Optional[str], data_freq: str) -> pd.DataFrame:
+    """
+    Same columns as get_sta_datas_by_period, read from sta_data_daily for ranges made of whole days,
+    plus day_count with the number of daily rows found.
+    """
+    slot_count = func.nullif(func.sum(StaDataDaily.slot_count), 0)
+    columns = [
+        (func.sum(StaDataDaily.ambient_temp_sum) / slot_count).label('avg_ambient_temp'),
+        (func.sum(StaDataDaily.module_temp_sum) / slot_count).label('avg_module_temp'),
+        func.sum(StaDataDaily.irradiation).label('irradiation'),
+        func.count().label('day_count')
+    ]
+    query = db.query(*columns)
+    if freq:
+        period = data_date_period(StaDataDaily.data_date, freq)
+        query = db.query(period.label('data_date'), *columns).group_by(period)
+
+    return pd.read_sql(
+        query
+        .filter(StaDataDaily.cli_id == cli_id)
+        .filter(StaDataDaily.sta_id == sta_id)
+        .filter(StaDataDaily.data_freq == data_freq)
+        .filter(StaDataDaily.data_date >= datetime_start)
+        .filter(StaDataDaily.data_date <= datetime_end)
+        .statement,
+        db.bind)
+
+
+def _compare_rollups(table: str, expected: pd.DataFrame, stored: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    merged = expected.merge(stored, on=keys, how='outer', suffixes=('_expected', '_stored'))
+    mismatches = []
+    for column in [x for x in expected.columns if x not in keys]:
+        expected_values = merged[f'{column}_expected'].astype(float)
+        stored_values = merged[f'{column}_stored'].astype(float)
+        matches = ((expected_values - stored_values).abs() <= 1e-6 * stored_values.abs().clip(lower=1)) | (expected_values.isna() & stored_values.isna())
+        mismatches.append(merged.loc[~matches, keys].assign(table=table, column=column, expected=expected_values[~matches], stored=stored_values[~matches]))
+    return pd.concat(mismatches, ignore_index=True)
+
+
+def check_daily_rollups(db: Session, cli_id: int, loc_id: int, datetime_start, datetime_end, data_freq: str = ROLLUP_DATA_FREQS[0]) -> pd.DataFrame:
+    """
+    Compare the stored daily rollups of a location against the raw data. Returns one row per table,
+    day and column whose stored value is missing or differs from the one computed from the raw data.
+    """
+    gen_ids = [int(x) for x in get_gen_ids_by_loc_id(db, loc_id)['gen_id_auto'].values]
+    station = get_sta_id_by_loc_id(db, loc_id)
+    if not gen_ids or station.empty:
+        return pd.DataFrame(columns=['gen_id', 'data_date', 'table', 'column', 'expected', 'stored'])
+    sta_id = int(station['sta_id_auto'][0])
+    days = _get_rollup_days(datetime_start, datetime_end)
+    expected_gen, expected_sta = compute_daily_rollups(db, cli_id, gen_ids, sta_id, datetime_start, datetime_end, data_freq)
+
+    stored_gen = pd.read_sql(
+        db.query(GenDataDaily.gen_id, GenDataDaily.data_date, *[getattr(GenDataDaily, x) for x in GEN_ROLLUP_COLUMNS])
+        .filter(GenDataDaily.cli_id == cli_id)
+        .filter(GenDataDaily.gen_id.in_(gen_ids))
+        .filter(GenDataDaily.sta_id == sta_id)
+        .filter(GenDataDaily.data_freq == data_freq)
+        .filter(GenDataDaily.data_date >= days[0])
+        .filter(GenDataDaily.data_date <= days[-1])
+        .statement,
+        db.bind)
+    stored_sta = pd.read_sql(
+        db.query(StaDataDaily.data_date, *[getattr(StaDataDaily, x) for x in STA_ROLLUP_COLUMNS])
+        .filter(StaDataDaily.cli_id == cli_id)
+        .filter(StaDataDaily.sta_id == sta_id)
+        .filter(StaDataDaily.data_freq == data_freq)
+        .filter(StaDataDaily.data_date >= days[0])
+        .filter(StaDataDaily.data_date <= days[-1])
+        .statement,
+        db.bind)
+    stored_gen['data_date'] = pd.to_datetime(stored_gen['data_date'])
+    stored_sta['data_date'] = pd.to_datetime(stored_sta['data_date'])
+
+    return pd.concat([_compare_rollups('gen_data_daily', expected_gen, stored_gen, ['gen_id', 'data_date']),
+                      _compare_rollups('sta_data_daily', expected_sta, stored_sta, ['data_date'])], ignore_index=True)
+
+
+def get_sta_datas_grouped(db: Session, cli_id: int, sta_id: int, datetime_start, datetime_end, data_freq: str, data_type_names: Dict[int, str],
+                          use_copy: bool = False) -> pd.DataFrame:
     """
     Get data for multiple data types grouped by date_time.
+    With use_copy, the data is read with read_sql_copy.
     """
     t0 = time.time()
-    df = pd.read_sql(
+    df = _read_query(
+        db,
         db.query(
             StaData.sta_id, StaData.data_date, StaData.data_value, StaData.data_type_id
         )
@@ -180,9 +812,8 @@ def get_sta_datas_grouped(db: Session, cli_id: int, sta_id: int, datetime_start,
         .filter(StaData.sta_id == sta_id)
         .filter(StaData.data_type_id.in_(data_type_names.keys()))
         .filter(StaData.data_date < datetime_end)
-        .filter(StaData.data_date >= datetime_start)
-        .statement,
-        db.bind)
+        .filter(StaData.data_date >= datetime_start),
+        use_copy)
 
     if not df.empty:
         df["data_date"] = df["data_date"].apply(
@@ -213,14 +844,16 @@ def get_gen_datas(
     datetime_start,
     datetime_end,
     data_name: str = "data_value",
-
-
+    chunksize: Optional[int] = None,
+    use_copy: bool = False,
 ):
     """
     Get generator data for multiple data types and multiple generators.
+    With chunksize, an iterator of DataFrames of at most chunksize rows is returned instead.
+    With use_copy, the data is read with read_sql_copy.
     """
     t0 = time.time()
-    df = pd.read_sql(
+    query = (
         db.query(
             GenData.gen_id, GenData.data_date, GenData.data_value, GenData.data_type_id
         )
@@ -228,11 +861,18 @@ def get_gen_datas(
         .filter(GenData.data_type_id.in_(data_type_ids))
         .filter(GenData.data_date < datetime_end)
         .filter(GenData.data_date >= datetime_start)
-        .statement,
-        db.bind,
-    ).rename(columns={"data_value": data_name})
-    df["data_date"] = df["data_date"].apply(
-        lambda row: remove_microseconds(row))
+    )
+
+    def adjust(df):
+        df = df.rename(columns={"data_value": data_name})
+        df["data_date"] = df["data_date"].apply(
+            lambda row: remove_microseconds(row))
+        return df
+
+    if chunksize:
+        return (adjust(chunk) for chunk in read_sql_chunks(db, query.order_by(GenData.gen_id, GenData.data_date), chunksize))
+
+    df = adjust(_read_query(db, query, use_copy))
     t1 = time.time()
     print(
         f"Function get_gen_datas for {len(gen_ids)} generators and {len(data_type_ids)} data types took {t1 - t0:.2f} seconds."
@@ -247,21 +887,23 @@ def get_sta_datas(
     datetime_start,
     datetime_end,
     data_name: str = "data_value",
+    use_copy: bool = False,
 ):
     """
     Get data for multiple data types and multiple stations.
+    With use_copy, the data is read with read_sql_copy.
     """
     t0 = time.time()
-    df = pd.read_sql(
+    df = _read_query(
+        db,
         db.query(
             StaData.sta_id, StaData.data_date, StaData.data_value, StaData.data_type_id
         )
         .filter(StaData.sta_id.in_(sta_ids))
         .filter(StaData.data_type_id.in_(data_type_ids))
         .filter(StaData.data_date < datetime_end)
-        .filter(StaData.data_date >= datetime_start)
-        .statement,
-        db.bind,
+        .filter(StaData.data_date >= datetime_start),
+        use_copy,
     ).rename(columns={"data_value": data_name})
     df["data_date"] = df["data_date"].apply(
         lambda row: remove_microseconds(row))
@@ -272,6 +914,7 @@ def get_sta_datas(
     return df
 
 
+@metadata_cache.cached(loc_id='loc_id')
 def get_gen_ids_by_loc_id(db: Session, loc_id: int):
     df = pd.read_sql(db.query(Generator.gen_id_auto)
                      .filter(Generator.loc_id == loc_id)
@@ -280,10 +923,28 @@ def get_gen_ids_by_loc_id(db: Session, loc_id: int):
     return df
 
 
+def get_generators_by_client(db: Session, cli_ids: Optional[List[int]] = None) -> pd.DataFrame:
+    """
+    Get the cli_id, loc_id and gen_id of the generators of the cli_ids clients, or of every client without cli_ids,
+    with their gen_code, gen_name and gen_rate_power and the sta_id and loc_output_capacity of their location.
+    sta_id is null for locations without station.
+    """
+    loc_stations = _get_loc_stations(db)
+    query = (
+        db.query(Generator.cli_id, Generator.loc_id, Generator.gen_id_auto.label('gen_id'), Generator.gen_code, Generator.gen_name,
+                 Generator.gen_rate_power, loc_stations.c.sta_id, Location.loc_output_capacity)
+        .outerjoin(loc_stations, loc_stations.c.loc_id == Generator.loc_id)
+        .outerjoin(Location, Location.loc_id_auto == Generator.loc_id))
+    if cli_ids is not None:
+        query = query.filter(Generator.cli_id.in_(cli_ids))
+    return pd.read_sql(query.order_by(Generator.cli_id, Generator.loc_id, Generator.gen_id_auto).statement, db.bind)
+
+
 def get_gen_id_by_loc_id(db: Session, loc_id: int) -> int:
     return int(get_gen_ids_by_loc_id(db, loc_id)['gen_id_auto'].values[0])
 
 
+@metadata_cache.cached(loc_id='loc_id')
 def get_sta_id_by_loc_id(db: Session, loc_id: int):
     df = pd.read_sql(db.query(Station.sta_id_auto)
                      .filter(Station.loc_id == loc_id)
@@ -292,6 +953,7 @@ def get_sta_id_by_loc_id(db: Session, loc_id: int):
     return df
 
 
+@metadata_cache.cached()
 def get_gen_codes_and_names(db: Session, gen_ids: List[int]):
     df = pd.read_sql(
         db.query(Generator.gen_id_auto, Generator.gen_code,
@@ -301,6 +963,7 @@ def get_gen_codes_and_names(db: Session, gen_ids: List[int]):
     return df.set_index(df['gen_id_auto']).drop('gen_id_auto', axis=1)
 
 
+@metadata_cache.cached(loc_id='locId')
 def get_loc_output_capacity(db: Session, locId: int):
     capacity = (
         db.query(Location.loc_output_capacity)
@@ -312,6 +975,7 @@ def get_loc_output_capacity(db: Session, locId: int):
     return capacity[0]
 
 
+@metadata_cache.cached(cli_id='cli_id')
 def get_client_settings(db: Session, cli_id: int):
     df = pd.read_sql(
         db.query(CliSetting.cli_set_name, CliSetting.cli_set_value)
@@ -321,6 +985,60 @@ def get_client_settings(db: Session, cli_id: int):
     return df.set_index('cli_set_name', drop=True)
 
 
+BULK_WRITE_CHUNK_SIZE = 50000
+
+
+def _copy_to_staging(cursor, staging_name: str, df: pd.DataFrame):
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep='\\N')
+    buffer.seek(0)
+    cursor.execute(f"TRUNCATE {staging_name}")
+    cursor.copy_expert(f"COPY {staging_name} FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+
+
+def bulk_write(db: Session, model, df: pd.DataFrame, index_elements: Optional[List[str]] = None,
+               chunksize: int = BULK_WRITE_CHUNK_SIZE) -> int:
+    """
+    Write the rows of df into the table of model. Each chunk of chunksize rows is COPYed into a temporary
+    staging table and merged with a single INSERT ... SELECT, updating the other columns of the rows that
+    conflict on index_elements, or only inserting them without index_elements.
+    All the chunks are written in one transaction, committed at the end. Returns the number of rows written.
+    """
+    if df.empty:
+        return 0
+    model_table = model.__table__
+    columns = list(df.columns)
+    df = df.copy()
+    for name in columns:
+        # Integer columns with missing values are float in pandas and 1.0 is not a valid integer for COPY
+        if isinstance(model_table.c[name].type, Integer) and pd.api.types.is_float_dtype(df[name]):
+            df[name] = df[name].astype('Int64')
+    if index_elements:
+        # A single INSERT ... ON CONFLICT can not update the same row twice
+        df = df.drop_duplicates(subset=index_elements, keep='last')
+
+    staging_name = f"{model_table.name}_staging_{uuid.uuid4().hex[:8]}"
+    staging = table(staging_name, *[column(name) for name in columns])
+    statement = pq.insert(model).from_select(columns, select(*staging.c))
+    if index_elements:
+        statement = statement.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={name: statement.excluded[name] for name in columns if name not in index_elements})
+
+    try:
+        with db.connection().connection.cursor() as cursor:
+            cursor.execute(f"CREATE TEMP TABLE {staging_name} ON COMMIT DROP AS "
+                           f"SELECT {', '.join(columns)} FROM {model_table.name} WITH NO DATA")
+            for chunk_start in range(0, len(df), chunksize):
+                _copy_to_staging(cursor, staging_name, df.iloc[chunk_start:chunk_start + chunksize])
+                db.execute(statement)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(df)
+
+
 def insert_cli_gen_alerts(db: Session, cli_id: int, gen_ids: List[int], datetime_start: datetime.datetime, datetime_end: datetime.datetime, rows_to_insert: List[Dict]) -> int:
 
     db.query(CliGenAlert).filter(
@@ -331,13 +1049,38 @@ def insert_cli_gen_alerts(db: Session, cli_id: int, gen_ids: List[int], datetime
     ).delete()
 
     if len(rows_to_insert) > 0:
-        statement = pq.insert(CliGenAlert).values(rows_to_insert)
-        db.execute(statement)
-        db.commit()
+        bulk_write(db, CliGenAlert, pd.DataFrame(rows_to_insert))
 
     return len(rows_to_insert)
 
 
+def get_alert_evaluated_dates(db: Session, cli_id: int, gen_ids: List[int]) -> Dict[int, datetime.datetime]:
+    """
+    Get the last day the alerts of each generator were evaluated, for the generators evaluated at least once.
+    """
+    df = pd.read_sql(
+        db.query(CliGenAlertEvaluation.gen_id, CliGenAlertEvaluation.cli_gen_alert_evaluated_date)
+        .filter(CliGenAlertEvaluation.cli_id == cli_id)
+        .filter(CliGenAlertEvaluation.gen_id.in_(gen_ids))
+        .statement, db.bind)
+    return {int(gen_id): evaluated_date for gen_id, evaluated_date in zip(df['gen_id'], df['cli_gen_alert_evaluated_date'])}
+
+
+def update_alert_evaluated_dates(db: Session, cli_id: int, gen_ids: List[int], evaluated_date: datetime.datetime):
+    """
+    Record evaluated_date as the last day the alerts of the generators were evaluated, unless a later day already was.
+    """
+    insert_stmt = pq.insert(CliGenAlertEvaluation).values([
+        {'cli_id': cli_id, 'gen_id': gen_id, 'cli_gen_alert_evaluated_date': evaluated_date, 'cli_gen_alert_evaluation_updated': datetime.datetime.now()}
+        for gen_id in gen_ids])
+    db.execute(insert_stmt.on_conflict_do_update(
+        index_elements=['cli_id', 'gen_id'],
+        set_={'cli_gen_alert_evaluated_date': func.greatest(CliGenAlertEvaluation.cli_gen_alert_evaluated_date,
+                                                             insert_stmt.excluded.cli_gen_alert_evaluated_date),
+              'cli_gen_alert_evaluation_updated': insert_stmt.excluded.cli_gen_alert_evaluation_updated}))
+    db.commit()
+
+
 def get_gen_ids_by_data_pro_id(db: Session, data_pro_id: int) -> Tuple[int, int, List[int], datetime.datetime, datetime.datetime]:
 
     df = pd.read_sql(db.query(GenData.gen_id, Generator.loc_id, Generator.cli_id, GenData.data_date)
@@ -359,7 +1102,8 @@ def get_gen_ids_by_data_pro_id(db: Session, data_pro_id: int) -> Tuple[int, int,
     return cli_id[0], loc_id[0], gen_ids, min_date, max_date
 
 
-def get_co2_emissions_tons_per_Mwh(db: Session, loc_id: int, datetime_start: datetime.datetime, datetime_end: datetime.datetime, freq: str) -> pd.DataFrame:
+@metadata_cache.cached(loc_id='loc_id')
+def get_co2_emissions_by_year(db: Session, loc_id: int) -> pd.DataFrame:
     query = (
         db.query(CtrData.data_value, extract('year', CtrData.data_date).label('year'))
         .join(Location, Location.ctr_id == CtrData.ctr_id)
@@ -369,6 +1113,11 @@ def get_co2_emissions_tons_per_Mwh(db: Session, loc_id: int, datetime_start: dat
     )
     df = pd.read_sql(query.statement, db.bind)
     df['year'] = df['year'].astype(int)
+    return df
+
+
+def get_co2_emissions_tons_per_Mwh(db: Session, loc_id: int, datetime_start: datetime.datetime, datetime_end: datetime.datetime, freq: str) -> pd.DataFrame:
+    df = get_co2_emissions_by_year(db, loc_id)
     all_time = pd.date_range(datetime_start, datetime_end, freq=freq)
 
     if df.empty:
@@ -394,34 +1143,101 @@ def get_location(db: Session, loc_id: int, cli_id: int) -> Location:
                                      Location.cli_id == cli_id).first()
 
 
+@metadata_cache.cached(loc_id='loc_id')
+def get_location_timezone(db: Session, loc_id: int) -> Optional[str]:
+    """
+    Timezone name of the location, from the timezones of its country. When the country has several, the one with
+    the standard UTC offset closest to the solar time of the location longitude is used. None when the country is unknown.
+    """
+    row = (db.query(Country.ctr_code_2, Location.loc_coord_lng)
+           .join(Country, Country.ctr_id_auto == Location.ctr_id)
+           .filter(Location.loc_id_auto == loc_id)
+           .first())
+    if row is None or not row.ctr_code_2:
+        return None
+    timezones = pytz.country_timezones.get(row.ctr_code_2.upper())
+    if not timezones:
+        return None
+    timezones = [name for name in timezones if not name.startswith('Antarctica/')] or timezones
+    if len(timezones) == 1 or row.loc_coord_lng is None:
+        return timezones[0]
+    solar_offset = row.loc_coord_lng / 15
+
+    def offset_distance(timezone_name):
+        localized = pytz.timezone(timezone_name).localize(datetime.datetime(2021, 1, 1))
+        return abs((localized.utcoffset() - localized.dst()).total_seconds() / 3600 - solar_offset)
+    return min(timezones, key=offset_distance)
+
+
 def update_location(db: Session, location: Location, address: Optional[str], capacity: Optional[int]):
     if address:
         location.loc_address = address
     if capacity:
         location.loc_output_total_capacity = capacity
     db.commit()
+    metadata_cache.invalidate(loc_id=location.loc_id_auto)
+
 
+def get_gen_data(db: Session, cli_id, gen_id, start_date, end_date, chunksize: Optional[int] = None) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+    query = (db.query(GenData.data_date, GenData.data_value, GenData.data_pro_id)
+             .filter(GenData.cli_id == cli_id,
+                     GenData.gen_id == gen_id,
+                     GenData.data_date >= start_date,
+                     GenData.data_date < end_date,
+                     GenData.data_type_id == 502))
 
-def get_gen_data(db: Session, cli_id, gen_id, start_date, end_date) -> pd.DataFrame:
-    df = pd.read_sql(db.query(GenData.data_date, GenData.data_value, GenData.data_pro_id)
+    def adjust(df):
+        df.columns = ['data_date', 'Generated Power', 'data_pro_id']
+        df["data_date"] = df["data_date"].apply(
+            lambda row: remove_microseconds(row))
+        df.set_index('data_date', inplace=True)
+        return df
+
+    if chunksize:
+        return (adjust(chunk) for chunk in read_sql_chunks(db, query.order_by(GenData.data_date), chunksize))
+
+    return adjust(pd.read_sql(query.statement, db.bind))
+
+
+def get_gens_data(db: Session, cli_id: int, gen_ids: List[int], start_date, end_date) -> pd.DataFrame:
+    """
+    Generated power and data_pro_id of the gen_ids generators read with one query, indexed by gen_id and data_date.
+    """
+    df = pd.read_sql(db.query(GenData.gen_id, GenData.data_date, GenData.data_value, GenData.data_pro_id)
                      .filter(GenData.cli_id == cli_id,
-                             GenData.gen_id == gen_id,
+                             GenData.gen_id.in_(gen_ids),
                              GenData.data_date >= start_date,
                              GenData.data_date < end_date,
                              GenData.data_type_id == 502)
+                     .order_by(GenData.gen_id, GenData.data_date)
                      .statement, db.bind)
-    df.columns = ['data_date', 'Generated Power', 'data_pro_id']
-    df["data_date"] = df["data_date"].apply(
-        lambda row: remove_microseconds(row))
-    df.set_index('data_date', inplace=True)
-    return df
+    df.columns = ['gen_id', 'data_date', 'Generated Power', 'data_pro_id']
+    if not df.empty:
+        df["data_date"] = df["data_date"].apply(
+            lambda row: remove_microseconds(row))
+    return df.set_index(['gen_id', 'data_date'])
 
 
-def get_sta_data(db: Session, cli_id, loc_id, start_date, end_date, data_freq='15T', data_type_names={503: 'Temperature', 507: 'Precipitation Total', 506: 'Cloud Cover Total', 505: 'Shortwave Radiation'}) -> pd.DataFrame:
+def get_sta_data(db: Session, cli_id, loc_id, start_date, end_date, data_freq='15T', data_type_names={503: 'Temperature', 507: 'Precipitation Total', 506: 'Cloud Cover Total', 505: 'Shortwave Radiation'},
+                 chunksize: Optional[int] = None) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
     sta_id_query = db.query(Station.sta_id_auto).filter(Station.cli_id == cli_id, Station.loc_id == loc_id).first()
     if sta_id_query is None or len(sta_id_query) == 0:
         raise ValueError(f"No station found for cli_id {cli_id} and loc_id {loc_id}")
     sta_id = sta_id_query[0]
+
+    if chunksize:
+        # Dates are normalized by the database so all the data types of a date are read in the same chunk
+        data_date = data_date_slot(StaData.data_date, data_freq)
+        query = (db.query(data_date.label('data_date'), StaData.data_type_id, StaData.data_value)
+                 .filter(StaData.cli_id == cli_id,
+                         StaData.sta_id == sta_id,
+                         StaData.data_date >= start_date,
+                         StaData.data_date < end_date,
+                         StaData.data_type_id.in_(data_type_names.keys()))
+                 .order_by(data_date))
+        return (pd.pivot_table(chunk, values='data_value', index=['data_date'], columns='data_type_id').rename(columns=data_type_names)
+                for chunk in read_sql_chunks(db, query, chunksize, group_columns=['data_date']))
+
     df = pd.read_sql(db.query(StaData.data_date, StaData.data_type_id, StaData.data_value)
                      .filter(StaData.cli_id == cli_id,
                              StaData.sta_id == sta_id,
@@ -443,32 +1259,83 @@ def get_sta_data(db: Session, cli_id, loc_id, start_date, end_date, data_freq='1
     return df
 
 
-def insert_or_update_predictions(db: Session, cli_id: int, gen_id: int, predictions: List[Tuple[datetime.datetime, float, int]]):
-    rows_to_insert = []
-    for prediction in predictions:
-        rows_to_insert.append({
-            'cli_id': cli_id,
-            'gen_id': gen_id,
-            'data_date': prediction[0],
-            'data_type_id': 508,
-            'data_pro_id': prediction[2],
-            'data_value': prediction[1],
-            'data_date_added': datetime.datetime.now()
-        })
+def insert_or_update_predictions(db: Session, cli_id: int, gen_id: int, predictions: Union[pd.DataFrame, List[Tuple[datetime.datetime, float, int]]]) -> int:
+    """
+    Insert the (data_date, data_value, data_pro_id) predictions of a generator as data type 508,
+    updating the ones already stored. predictions is a list of tuples or a DataFrame with those columns.
+    """
+    df = predictions if isinstance(predictions, pd.DataFrame) else pd.DataFrame(predictions, columns=['data_date', 'data_value', 'data_pro_id'])
+    return insert_or_update_gens_predictions(db, cli_id, df.assign(gen_id=gen_id))
 
-    insert_stmt = pq.insert(GenData).values(rows_to_insert)
 
-    update_stmt = insert_stmt.on_conflict_do_update(
-        index_elements=['cli_id', 'gen_id', 'data_date', 'data_type_id'],  # Primary Key
-        set_={
-            'data_value': insert_stmt.excluded.data_value,
-            'data_pro_id': insert_stmt.excluded.data_pro_id,
-            'data_date_added': datetime.datetime.now()
-        }
-    )
+def insert_or_update_gens_predictions(db: Session, cli_id: int, predictions: pd.DataFrame) -> int:
+    """
+    Insert the gen_id, data_date, data_value and data_pro_id predictions of several generators as data type 508
+    with one bulk write, updating the ones already stored, then refresh the daily rollups of their days.
+    """
+    df = predictions.assign(cli_id=cli_id, data_type_id=508, data_date_added=datetime.datetime.now())
+    row_count = bulk_write(db, GenData, df[['cli_id', 'gen_id', 'data_date', 'data_type_id', 'data_pro_id', 'data_value', 'data_date_added']],
+                           index_elements=['cli_id', 'gen_id', 'data_date', 'data_type_id'])
+    refresh_prediction_rollups(db, cli_id, predictions)
+    return row_count
 
-    db.execute(update_stmt)
-    db.commit()
+
+FEATURE_STORE_COLUMNS = {'temperature': 'Temperature',
+                         'precipitation_total': 'Precipitation Total',
+                         'cloud_cover_total': 'Cloud Cover Total',
+                         'shortwave_radiation': 'Shortwave Radiation',
+                         'generated_power': 'Generated Power',
+                         'generated_power_lag': 'Generated Power 1 Hour Lag',
+                         'hours_since_last_rain': 'Hours Since Last Rain',
+                         'solar_zenith_angle': 'Solar Zenith Angle'}
+
+
+def _index_gens_features(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.rename(columns=FEATURE_STORE_COLUMNS)
+    df['data_date'] = pd.to_datetime(df['data_date'])
+    return df.set_index(['gen_id', 'data_date'])
+
+
+def get_gens_features(db: Session, cli_id: int, gen_ids: List[int], start_date, end_date) -> pd.DataFrame:
+    """
+    Hourly features stored for the gen_ids generators between start_date and end_date included, indexed by gen_id
+    and data_date, with data_pro_id and the column names of the model.
+    """
+    df = pd.read_sql(db.query(GenDataFeatures.gen_id, GenDataFeatures.data_date, GenDataFeatures.data_pro_id,
+                              *[getattr(GenDataFeatures, name) for name in FEATURE_STORE_COLUMNS])
+                     .filter(GenDataFeatures.cli_id == cli_id,
+                             GenDataFeatures.gen_id.in_(gen_ids),
+                             GenDataFeatures.data_date >= start_date,
+                             GenDataFeatures.data_date <= end_date)
+                     .order_by(GenDataFeatures.gen_id, GenDataFeatures.data_date)
+                     .statement, db.bind)
+    return _index_gens_features(df)
+
+
+def get_last_gens_features(db: Session, cli_id: int, gen_ids: List[int], before) -> pd.DataFrame:
+    """
+    Last hour stored before the date before for each of the gen_ids generators, as get_gens_features.
+    """
+    df = pd.read_sql(db.query(GenDataFeatures.gen_id, GenDataFeatures.data_date, GenDataFeatures.data_pro_id,
+                              *[getattr(GenDataFeatures, name) for name in FEATURE_STORE_COLUMNS])
+                     .filter(GenDataFeatures.cli_id == cli_id,
+                             GenDataFeatures.gen_id.in_(gen_ids),
+                             GenDataFeatures.data_date < before)
+                     .distinct(GenDataFeatures.gen_id)
+                     .order_by(GenDataFeatures.gen_id, GenDataFeatures.data_date.desc())
+                     .statement, db.bind)
+    return _index_gens_features(df)
+
+
+def insert_or_update_gens_features(db: Session, cli_id: int, loc_id: int, features: pd.DataFrame) -> int:
+    """
+    Store the hourly features of several generators of a location, indexed by gen_id and data_date with data_pro_id
+    and the column names of the model, updating the hours already stored.
+    """
+    df = features.rename(columns={value: key for key, value in FEATURE_STORE_COLUMNS.items()}).reset_index()
+    df = df.assign(cli_id=cli_id, loc_id=loc_id, data_date_added=datetime.datetime.now())
+    return bulk_write(db, GenDataFeatures, df[['cli_id', 'gen_id', 'data_date', 'loc_id', 'data_pro_id', *FEATURE_STORE_COLUMNS, 'data_date_added']],
+                      index_elements=['cli_id', 'gen_id', 'data_date'])
 
 
 def get_gen_data_count(db: Session, loc_id: int, datetime_start, datetime_end, data_types: List[int], group_by: str) -> pd.DataFrame:
@@ -548,6 +1415,22 @@ def get_expected_data_count_per_period(period_start: datetime.datetime, datetime
     return int(period_seconds / data_freq_seconds)
 
 
+def get_expected_data_counts_per_period(period_starts, datetime_end: datetime.datetime, pd_freq: str, data_freq: str):
+    """
+    Vectorized get_expected_data_count_per_period for a DatetimeIndex or a Series of period starts.
+    """
+    period_ends = get_period_ends(period_starts, pd_freq, datetime_end) + pd.Timedelta(seconds=1)
+    period_seconds = (period_ends - period_starts).dt.total_seconds() if isinstance(period_starts, pd.Series) else (period_ends - period_starts).total_seconds()
+
+    if data_freq == '1M' or data_freq == '1MS':
+        data_freq_seconds = 30 * 24 * 60 * 60
+    elif data_freq == '1YS' or data_freq == '1Y':
+        data_freq_seconds = 365 * 24 * 60 * 60
+    else:
+        data_freq_seconds = int(pd.to_timedelta(data_freq).total_seconds())
+    return (period_seconds.astype(int) / data_freq_seconds).astype(int)
+
+
 def insert_irradiation_per_month(db: Session, start_date: datetime.datetime, end_date: datetime.datetime):
     # - Toma la suma de la irradiación mensual de sta_data para sta_id=51, data_type_id=505, cli_id=83.
     df = pd.read_sql(db.query(StaData.data_date, StaData.data_value)
@@ -577,9 +1460,7 @@ def insert_irradiation_per_month(db: Session, start_date: datetime.datetime, end
             'data_date_added': datetime.datetime.now()
         })
     if rows_to_insert:
-        insert_stmt = pq.insert(StaData).values(rows_to_insert)
-        db.execute(insert_stmt)
-        db.commit()
+        bulk_write(db, StaData, pd.DataFrame(rows_to_insert))
 
 
 def insert_production_per_month(db: Session, start_date: datetime.datetime, end_date: datetime.datetime):
@@ -605,11 +1486,8 @@ def insert_production_per_month(db: Session, start_date: datetime.datetime, end_
     df['cli_id'] = 84
     df['gen_id'] = gen_id
     df['data_date_added'] = datetime.datetime.now()
-    rows_to_insert = df.to_dict('records')
-    if rows_to_insert:
-        insert_stmt = pq.insert(GenData).values(rows_to_insert)
-        db.execute(insert_stmt)
-        db.commit()
+    if not df.empty:
+        bulk_write(db, GenData, df)
 
 
 def get_date_intervals_without_data(db: Session, start_date: datetime.datetime, end_date: datetime.datetime) -> List[Tuple[datetime.datetime, datetime.datetime]]:
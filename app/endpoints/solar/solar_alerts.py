@@ -1,11 +1,12 @@
 import json
 from datetime import timedelta, datetime
 from typing import List, Optional
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from dateutil.parser import parse
 from pydantic import BaseModel, Field
+from db import db as database
 from db.db import get_db
-from core.solar_alerts import calculate_alerts
+from core.solar_alerts import ALERT_SWEEP_MAX_WORKERS, calculate_alerts, calculate_fleet_alerts
 from sqlalchemy.orm import Session
 
 router = APIRouter(
@@ -34,6 +35,7 @@ class Request(BaseModel):
     client: Optional[int]
     location: Optional[int]
     data_pro_id: Optional[int]
+    incremental: bool = False
 
 
 def parse_request(param_json) -> Request:
@@ -56,12 +58,66 @@ def parse_request(param_json) -> Request:
                    end_date=end_date,
                    client=client,
                    location=location,
-                   data_pro_id=data_pro_id)
+                   data_pro_id=data_pro_id,
+                   incremental=params.get('incremental', False))
 
 
 @router.get("/", tags=["solar", "overview"], response_model=Response)
 def process_alerts(param_json, db: Session = Depends(get_db)):
     request = parse_request(param_json)
     cli_id, loc_id, gen_ids, datetime_start, datetime_end, alert_count = calculate_alerts(db,
-                                                                                          cli_id=request.client, loc_id=request.location, data_pro_id=request.data_pro_id, datetime_start=request.start_date, datetime_end=request.end_date)
+                                                                                          cli_id=request.client, loc_id=request.location, data_pro_id=request.data_pro_id, datetime_start=request.start_date, datetime_end=request.end_date,
+                                                                                          incremental=request.incremental)
     return Response(data=Data(**{"from": datetime_start.strftime('%Y-%m-%d %H:%M'), "to": datetime_end.strftime('%Y-%m-%d %H:%M'), "count": alert_count, "client": cli_id, "location": loc_id, "generators": gen_ids}))
+
+
+class ClientData(BaseModel):
+    client: int
+    locations: int
+    generators: int
+    count: int
+    error: Optional[str]
+
+
+class BatchData(BaseModel):
+    from_: str = Field(alias='from')
+    to: str
+    count: int
+    clients: List[ClientData]
+
+
+class BatchResponse(BaseModel):
+    data: BatchData
+
+
+class BatchRequest(BaseModel):
+    start_date: datetime
+    end_date: datetime
+    clients: Optional[List[int]]
+    workers: int
+
+
+def parse_batch_request(param_json) -> BatchRequest:
+    params = json.loads(param_json)
+    start_date = params.get('from')
+    end_date = params.get('to')
+    clients = params.get('clients', 'all')
+    if not start_date or not end_date:
+        raise ValueError('Invalid parameters: from and to must be provided')
+    if clients != 'all' and not (isinstance(clients, list) and clients):
+        raise ValueError('Invalid parameters: clients must be a list of clients or "all"')
+    return BatchRequest(start_date=parse(start_date, dayfirst=False, yearfirst=True),
+                        end_date=parse(end_date, dayfirst=False, yearfirst=True) + timedelta(days=1, seconds=-1),
+                        clients=None if clients == 'all' else clients,
+                        workers=max(1, min(int(params.get('workers', ALERT_SWEEP_MAX_WORKERS)), ALERT_SWEEP_MAX_WORKERS)))
+
+
+@router.get("/batch/", tags=["solar", "alerts"], response_model=BatchResponse)
+def process_batch_alerts(param_json):
+    request = parse_batch_request(param_json)
+    if database.SessionLocal is None:
+        raise HTTPException(status_code=500, detail='Database is not initialized')
+    results = calculate_fleet_alerts(database.SessionLocal, request.start_date, request.end_date, cli_ids=request.clients, max_workers=request.workers)
+    return BatchResponse(data=BatchData(**{"from": request.start_date.strftime('%Y-%m-%d %H:%M'), "to": request.end_date.strftime('%Y-%m-%d %H:%M'),
+                                           "count": sum(result['count'] for result in results),
+                                           "clients": [ClientData(**result) for result in results]}))
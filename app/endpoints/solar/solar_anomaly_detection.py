@@ -1,12 +1,13 @@
 import json
 from datetime import timedelta, datetime
-import os
 from typing import List, Optional
 from fastapi import APIRouter, Depends
 from dateutil.parser import parse
 from pydantic import BaseModel, Field
 from db.db import get_db
-from ml.model import load_model, get_data, resample_data, save_predictions
+from db.utils import get_location_timezone
+from ml.model import (expand_predictions, get_batch_data, get_data, get_gens_hourly_features, load_location_model,
+                      merge_gens_data, predict_generators_features, save_gens_predictions, save_predictions)
 from sqlalchemy.orm import Session
 
 router = APIRouter(
@@ -83,35 +84,104 @@ def process_anomaly_detection(param_json, db: Session = Depends(get_db)):
     if df.empty:
         return Response(chart=Chart(**{"resultCode": 200,
                                        "resultText": "No data found"}), data=[])
-    model_df = resample_data(df)
-    ml_model = load_model(os.path.join('ml', 'models', 'cat_boost_model.pkl'), loc_capacity)
+    features = get_gens_hourly_features(db, cli_id, loc_id, {gen_id: df}, loc_lat, loc_long, get_location_timezone(db, loc_id), request.data_pro_id)
+    ml_model = load_location_model(cli_id, loc_id, loc_capacity)
 
-    input_data = ml_model.generate_input(loc_lat, loc_long, model_df)
+    input_data = ml_model.generate_input_from_features(features[gen_id])
     prediction = ml_model.predict(input_data)
 
-    predictions = []
-    datas = []
+    predictions = expand_predictions(prediction, df)
+    save_predictions(db, cli_id, gen_id, predictions[['data_date', 'data_value', 'data_pro_id']])
+
+    datas = [Prediction(**{"dataDate": data_date,
+                           "prediction": data_value,
+                           "actual": actual})
+             for data_date, data_value, actual in zip(predictions['data_date'].dt.strftime("%Y/%m/%d %H:%M:%S"),
+                                                      predictions['data_value'].tolist(), predictions['actual'].tolist())]
+    chart = Chart(**{"from": start_date.strftime("%Y/%m/%d %H:%M:%S"),
+                     "to": end_date.strftime("%Y/%m/%d %H:%M:%S"),
+                     "resultCode": 200,
+                     "resultText": ''})
+
+    return Response(chart=chart, data=datas)
+
+
+class BatchRequest(BaseModel):
+    cli_id: Optional[int]
+    loc_id: Optional[int]
+    gen_ids: Optional[List[int]]
+    start_date: Optional[datetime]
+    end_date: Optional[datetime]
+    data_pro_id: Optional[int]
 
-    for i, pred in prediction.iterrows():
-        for j in range(4):
-            data_date = i - timedelta(minutes=15*j)
-            data_pro_id = df.loc[data_date]['data_pro_id']
-            actual_power = df.loc[data_date]['Generated Power']
-            actual_power = round(actual_power, 3)
-            predicted_power = pred['Prediction']
 
-            predictions.append((data_date, predicted_power, data_pro_id))
-            data = Prediction(**{"dataDate": data_date.strftime("%Y/%m/%d %H:%M:%S"),
-                                 "prediction": predicted_power,
-                                 "actual": actual_power})
-            datas.append(data)
+class GeneratorPrediction(Prediction):
+    generator: int
 
-    save_predictions(db, cli_id, gen_id, predictions)
 
-    datas.sort(key=lambda x: x.dataDate)
+class BatchResponse(BaseModel):
+    chart: Chart
+    generators: List[int]
+    data: List[GeneratorPrediction]
+
+
+def parse_batch_request(param_json) -> BatchRequest:
+    params = json.loads(param_json)
+    start_date = params.get('from')
+    end_date = params.get('to')
+    if start_date:
+        start_date = parse(start_date, dayfirst=False, yearfirst=True)
+    if end_date:
+        end_date = parse(end_date, dayfirst=False,
+                         yearfirst=True) + timedelta(days=1, seconds=-1)
+
+    cli_id = params.get('client')
+    loc_id = params.get('location')
+    gen_ids = params.get('generators')
+    data_pro_id = params.get('data_pro_id')
+
+    if not data_pro_id and not (cli_id and loc_id and start_date and end_date):
+        raise ValueError('Invalid parameters: either data_pro_id or client, location, start and end dates must be provided')
+
+    return BatchRequest(start_date=start_date,
+                        end_date=end_date,
+                        cli_id=cli_id,
+                        loc_id=loc_id,
+                        gen_ids=gen_ids,
+                        data_pro_id=data_pro_id)
+
+
+@router.get("/batch/", tags=["solar", "anomaly_detection"], response_model=BatchResponse)
+def process_batch_anomaly_detection(param_json, db: Session = Depends(get_db)):
+    request = parse_batch_request(param_json)
+
+    gens_df, sta_df, cli_id, loc_id, gen_ids, start_date, end_date, loc_capacity, loc_lat, loc_long = get_batch_data(db,
+                                                                                                                     start_date=request.start_date,
+                                                                                                                     end_date=request.end_date,
+                                                                                                                     cli_id=request.cli_id,
+                                                                                                                     loc_id=request.loc_id,
+                                                                                                                     gen_ids=request.gen_ids,
+                                                                                                                     data_pro_id=request.data_pro_id)
+    if gens_df.empty:
+        return BatchResponse(chart=Chart(**{"resultCode": 200,
+                                            "resultText": "No data found"}), generators=gen_ids, data=[])
+    ml_model = load_location_model(cli_id, loc_id, loc_capacity)
+
+    features = get_gens_hourly_features(db, cli_id, loc_id, merge_gens_data(gens_df, sta_df), loc_lat, loc_long,
+                                        get_location_timezone(db, loc_id), request.data_pro_id)
+    prediction = predict_generators_features(ml_model, features)
+    predictions = expand_predictions(prediction, gens_df)
+    save_gens_predictions(db, cli_id, predictions[['gen_id', 'data_date', 'data_value', 'data_pro_id']])
+
+    datas = [GeneratorPrediction(**{"generator": gen_id,
+                                    "dataDate": data_date,
+                                    "prediction": data_value,
+                                    "actual": actual})
+             for gen_id, data_date, data_value, actual in zip(predictions['gen_id'].tolist(), predictions['data_date'].dt.strftime("%Y/%m/%d %H:%M:%S"),
+                                                              predictions['data_value'].tolist(), predictions['actual'].tolist())]
     chart = Chart(**{"from": start_date.strftime("%Y/%m/%d %H:%M:%S"),
                      "to": end_date.strftime("%Y/%m/%d %H:%M:%S"),
                      "resultCode": 200,
                      "resultText": ''})
 
-    return Response(chart=chart, data=datas)
+    return BatchResponse(chart=chart, generators=gen_ids, data=datas)
@@ -2,7 +2,7 @@ import json
 from datetime import timedelta, datetime
 from typing import List, Optional
 from db.db import get_db
-from db.utils import group_by_to_pd_frequency, data_freq_to_pd_frequency, pandas_frequency_to_timedelta
+from db.utils import STREAM_CHUNK_SIZE, group_by_to_pd_frequency, data_freq_to_pd_frequency, pandas_frequency_to_timedelta
 from fastapi import APIRouter, Depends, HTTPException
 from dateutil.parser import parse
 from pydantic import BaseModel, Field
@@ -98,7 +98,8 @@ def climate(param_json, db: Session = Depends(get_db)):
         if freq_timedelta < data_freq_timedelta:
             raise HTTPException(status_code=400, detail=f'Invalid group_by {request.group_by} for frequence {request.data_freq}')
 
-    solar = Solar(db, request.client, request.location, None, None, request.start_date, request.end_date, request.freq, request.data_freq)
+    solar = Solar(db, request.client, request.location, None, None, request.start_date, request.end_date, request.freq, request.data_freq, use_cache=True,
+                  chunksize=STREAM_CHUNK_SIZE, use_rollups=True)
     for gen_id in request.generators:
         if gen_id not in solar.gen_ids:
             raise HTTPException(status_code=400, detail=f'Generator {gen_id} not found in location {request.location}')
@@ -113,7 +114,7 @@ def climate(param_json, db: Session = Depends(get_db)):
 
     datas = []
 
-    if solar.data is None:
+    if solar.data_aggregated_by_loc_and_period is None:
         return Response(chart=chart, data=datas)
 
     for date, row in solar.data_aggregated_by_loc_and_period.iterrows():
@@ -5,7 +5,7 @@ from typing import List, Optional
 from core.solar import Solar
 from dateutil.parser import parse
 from db.db import get_db
-from db.utils import data_freq_to_pd_frequency
+from db.utils import STREAM_CHUNK_SIZE, data_freq_to_pd_frequency
 from fastapi import APIRouter, Depends
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
@@ -73,10 +73,11 @@ def parse_request(param_json) -> Request:
 @router.get("/", tags=["solar", "overview"], response_model=Response)
 def overview(param_json, db: Session = Depends(get_db)):
     request = parse_request(param_json)
-    solar = Solar(db, request.client, request.location, None, None, request.start_date, request.end_date, None, request.data_freq)
+    solar = Solar(db, request.client, request.location, None, None, request.start_date, request.end_date, None, request.data_freq, use_cache=True,
+                  chunksize=STREAM_CHUNK_SIZE, use_rollups=True)
     solar.fetch_aggregated_by_loc_and_period(db)
 
-    if solar.data is None:
+    if solar.data_aggregated_by_loc_and_period is None:
 
         chart = Chart(**{"from": request.start_date.strftime("%Y/%m/%d %H:%M:%S"),
                          "to": request.end_date.strftime("%Y/%m/%d %H:%M:%S"),
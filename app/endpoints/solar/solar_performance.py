@@ -5,8 +5,8 @@ from typing import List, Optional
 from core.solar import Solar
 from dateutil.parser import parse
 from db.db import get_db
-from db.utils import (data_freq_to_pd_frequency, group_by_to_pd_frequency,
-                      pandas_frequency_to_timedelta)
+from db.utils import (STREAM_CHUNK_SIZE, data_freq_to_pd_frequency,
+                      group_by_to_pd_frequency, pandas_frequency_to_timedelta)
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
@@ -101,7 +101,8 @@ def performance(param_json, db: Session = Depends(get_db)):
         if freq_timedelta < data_freq_timedelta:
             raise HTTPException(status_code=400, detail=f'Invalid group_by {request.group_by} for frequence {request.data_freq}')
 
-    solar = Solar(db, request.client, request.location, request.generators, None, request.start_date, request.end_date, request.freq, request.data_freq)
+    solar = Solar(db, request.client, request.location, request.generators, None, request.start_date, request.end_date, request.freq, request.data_freq, use_cache=True,
+                  chunksize=STREAM_CHUNK_SIZE, use_rollups=True)
 
     solar.fetch_aggregated_by_loc_and_period(db)
 
@@ -113,7 +114,7 @@ def performance(param_json, db: Session = Depends(get_db)):
 
     datas = []
 
-    if solar.data is None:
+    if solar.data_aggregated_by_loc_and_period is None:
         return Response(chart=chart, data=datas)
 
     for date, row in solar.data_aggregated_by_loc_and_period.iterrows():
@@ -5,7 +5,7 @@ from typing import List, Optional
 import numpy as np
 import pandas as pd
 from db.db import get_db
-from db.utils import data_freq_to_pd_frequency, get_period_end
+from db.utils import data_freq_to_pd_frequency, get_period_ends
 from core.solar import Solar
 from dateutil.parser import parse
 from fastapi import APIRouter, Depends
@@ -83,21 +83,19 @@ def parse_request(param_json) -> Request:
                    data_freq=data_freq)
 
 
-def _adjust_units(row, data_freq, datetime_end):
-    row_start_date = row.name[1]
-    row_end_date = get_period_end(row_start_date, data_freq, datetime_end)
+def _adjust_units(values: pd.Series, data_freq, datetime_end) -> pd.Series:
+    row_start_dates = pd.Series(values.index.get_level_values(1), index=values.index)
+    row_end_dates = get_period_ends(row_start_dates, data_freq, datetime_end)
     seconds_in_one_hour = 60*60
-    seconds_in_row_period = (row_end_date - row_start_date).total_seconds() + 1
+    seconds_in_row_period = (row_end_dates - row_start_dates).dt.total_seconds() + 1
     multiplier = seconds_in_one_hour / seconds_in_row_period
-    row_value = row[0]
-    if row_value is not None:
-        return row_value * multiplier
+    return pd.to_numeric(values, errors='coerce') * multiplier
 
 
 @router.get("/", tags=["solar", "power_curve"], response_model=Response)
 def power_curve(param_json, db: Session = Depends(get_db)):
     request = parse_request(param_json)
-    solar = Solar(db, request.client, request.location, request.generators, None, request.start_date, request.end_date, "100Y", request.data_freq)
+    solar = Solar(db, request.client, request.location, request.generators, None, request.start_date, request.end_date, "100Y", request.data_freq, use_cache=True)
 
     solar.fetch_data(db)
 
@@ -109,8 +107,8 @@ def power_curve(param_json, db: Session = Depends(get_db)):
 
     power_curve = solar.data[['ac_production', 'irradiation']]
 
-    power_curve["ac_production"] = power_curve[["ac_production"]].apply(lambda x: _adjust_units(x, request.data_freq, request.end_date), axis=1)
-    power_curve["irradiation"] = power_curve[["irradiation"]].apply(lambda x: _adjust_units(x, request.data_freq, request.end_date), axis=1)
+    power_curve["ac_production"] = _adjust_units(power_curve["ac_production"], request.data_freq, request.end_date)
+    power_curve["irradiation"] = _adjust_units(power_curve["irradiation"], request.data_freq, request.end_date)
     power_curve.fillna(0, inplace=True)
     gen_data: List[GenData] = []
     for i, gen_id in enumerate(request.generators):
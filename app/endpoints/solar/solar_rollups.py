@@ -0,0 +1,75 @@
+import json
+from datetime import datetime, timedelta
+from typing import Optional
+
+from db.db import get_db
+from db.utils import refresh_daily_rollups, refresh_daily_rollups_by_data_pro_id
+from dateutil.parser import parse
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
+from sqlalchemy.orm import Session
+
+router = APIRouter(
+    prefix="/solar/rollups",
+    tags=["solar", "rollups"],
+    responses={400: {"description": "Could not refresh rollups"}},
+)
+
+
+class Data(BaseModel):
+    from_: Optional[str] = Field(alias='from')
+    to: Optional[str]
+    count: int
+    client: int
+    location: int
+
+
+class Response(BaseModel):
+    data: Data
+
+
+class Request(BaseModel):
+    start_date: Optional[datetime]
+    end_date: Optional[datetime]
+    client: Optional[int]
+    location: Optional[int]
+    data_pro_id: Optional[int]
+
+
+def parse_request(param_json) -> Request:
+    params = json.loads(param_json)
+    start_date = params.get('from')
+    end_date = params.get('to')
+    if start_date:
+        start_date = parse(start_date, dayfirst=False, yearfirst=True)
+    if end_date:
+        end_date = parse(end_date, dayfirst=False,
+                         yearfirst=True) + timedelta(days=1, seconds=-1)
+
+    data_pro_id = params.get('data_pro_id')
+    client = params.get('client')
+    location = params.get('location')
+
+    if not data_pro_id and not (client and location and start_date and end_date):
+        raise ValueError('Invalid parameters: either data_pro_id or client, location, from and to must be provided')
+    return Request(start_date=start_date,
+                   end_date=end_date,
+                   client=client,
+                   location=location,
+                   data_pro_id=data_pro_id)
+
+
+@router.get("/", tags=["solar", "rollups"], response_model=Response)
+def refresh_rollups(param_json, db: Session = Depends(get_db)):
+    request = parse_request(param_json)
+    if request.data_pro_id:
+        cli_id, loc_id, datetime_start, datetime_end, count = refresh_daily_rollups_by_data_pro_id(db, request.data_pro_id)
+        if cli_id is None:
+            raise HTTPException(status_code=400, detail='data_pro_id not found')
+    else:
+        cli_id, loc_id, datetime_start, datetime_end = request.client, request.location, request.start_date, request.end_date
+        count = refresh_daily_rollups(db, cli_id, loc_id, datetime_start, datetime_end)
+
+    return Response(data=Data(**{"from": datetime_start.strftime('%Y-%m-%d %H:%M') if datetime_start else None,
+                                 "to": datetime_end.strftime('%Y-%m-%d %H:%M') if datetime_end else None,
+                                 "count": count, "client": cli_id, "location": loc_id}))
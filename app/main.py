@@ -2,14 +2,18 @@ import logging
 from urllib.parse import unquote
 
 import uvicorn
+from core.solar_cache import solar_data_cache, solar_fetches
+from db.utils import metadata_cache
 from endpoints.solar import (solar_alerts, solar_anomaly_detection,
                              solar_certificates, solar_climate,
                              solar_data_availability, solar_emissions,
                              solar_expected_power, solar_overview,
-                             solar_performance, solar_power_curve, solar_sales)
+                             solar_performance, solar_power_curve,
+                             solar_rollups, solar_sales)
 from fastapi import FastAPI, Request
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse
+from ml.model import model_registry
 
 logging.config.fileConfig('logging.conf')
 logger = logging.getLogger('root')
@@ -43,6 +47,26 @@ def root():
     return {"General information about graphs on this API": msg}
 
 
+@app.get("/info/metadata_cache/")
+def metadata_cache_stats():
+    return metadata_cache.stats()
+
+
+@app.get("/info/solar_data_cache/")
+def solar_data_cache_stats():
+    return solar_data_cache.stats()
+
+
+@app.get("/info/solar_fetches/")
+def solar_fetches_stats():
+    return solar_fetches.stats()
+
+
+@app.get("/info/model_registry/")
+def model_registry_stats():
+    return model_registry.stats()
+
+
 # Solar
 app.include_router(solar_overview.router)
 app.include_router(solar_climate.router)
@@ -55,6 +79,7 @@ app.include_router(solar_sales.router)
 app.include_router(solar_anomaly_detection.router)
 app.include_router(solar_data_availability.router)
 app.include_router(solar_expected_power.router)
+app.include_router(solar_rollups.router)
 
 
 if __name__ == "__main__":
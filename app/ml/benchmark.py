@@ -0,0 +1,160 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytz
+from ml.model import (TARGET_COLUMN, add_calculated_features, add_hours_since_last_rain,
+                      add_lag_based_feature_generation, add_solar_zenith_angle,
+                      get_feature_layout, load_model)
+from ml.solar_position import get_solar_altitude
+from pysolar.solar import get_altitude
+
+PRE_PROCESSED_DATA_PATH = os.path.join('ml', 'data', '1_pre_processed_data.parquet')
+MODEL_PATH = os.path.join('ml', 'models', 'cat_boost_model.pkl')
+INFERENCE_SIZES = {'1 day': 24, '1 month': 30 * 24, '1 year': 365 * 24}
+
+
+def add_hours_since_last_rain_by_row(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Row by row version of add_hours_since_last_rain, as used to build the training data.
+    """
+    df['Hours Since Last Rain'] = 0
+    last_rain_date = None
+    for index, row in df.iterrows():
+        if row['Precipitation Total'] > 0:
+            df.at[index, 'Hours Since Last Rain'] = 0
+            last_rain_date = index
+        else:
+            if last_rain_date is None:
+                df.at[index, 'Hours Since Last Rain'] = 0
+            else:
+                df.at[index, 'Hours Since Last Rain'] = (index - last_rain_date).total_seconds() / 3600
+    return df
+
+
+def get_solar_altitude_by_row(latitude: float, longitude: float, index: pd.DatetimeIndex, timezone_name: str) -> np.ndarray:
+    """
+    Row by row version of get_solar_altitude, as used to build the training data.
+    """
+    tz = pytz.timezone(timezone_name)
+    return np.array([get_altitude(latitude, longitude, tz.localize(time.to_pydatetime())) for time in index])
+
+
+def predict_by_dataframe(model, loc_latitude: float, loc_longitude: float, data: pd.DataFrame) -> np.ndarray:
+    """
+    DataFrame version of generate_input and predict, with the features built by add_calculated_features.
+    """
+    data['Generated Power'] = data['Generated Power'] * 1000 * 4
+    data['Shortwave Radiation'] = data['Shortwave Radiation'] * 1000
+    data = add_calculated_features(data, loc_latitude, loc_longitude)
+    data = data[model.features]
+    data[f'{TARGET_COLUMN} {1} Hour Lag'] = data[f'{TARGET_COLUMN} {1} Hour Lag'] * model.trained_capacity / model.prediction_capacity
+    data = data.dropna()
+    prediction = model.cat_boost_model.predict(model.x_scaler.transform(data))
+    prediction = model.y_scaler.inverse_transform(prediction.reshape(-1, 1))
+    prediction = prediction * model.prediction_capacity / model.trained_capacity
+    prediction = np.where(prediction < 0, 0, prediction)
+    prediction = np.round(prediction / 4000, 3)
+    return np.array([x[0] for x in prediction])
+
+
+def predict_by_array(model, loc_latitude: float, loc_longitude: float, data: pd.DataFrame) -> np.ndarray:
+    data['Generated Power'] = data['Generated Power'] * 1000 * 4
+    data['Shortwave Radiation'] = data['Shortwave Radiation'] * 1000
+    data = add_lag_based_feature_generation(data)
+    data = add_hours_since_last_rain(data)
+    data = add_solar_zenith_angle(data, loc_latitude, loc_longitude)
+    data[f'{TARGET_COLUMN} {1} Hour Lag'] = data[f'{TARGET_COLUMN} {1} Hour Lag'] * model.trained_capacity / model.prediction_capacity
+    x = get_feature_layout(tuple(model.features)).build_array(data)
+    return model.predict_array(x[~np.isnan(x).any(axis=1)])
+
+
+def get_model_input(hours: int) -> pd.DataFrame:
+    index = pd.date_range('2022-01-01', periods=hours, freq='1H')
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({'Temperature': rng.random(hours) * 30,
+                         'Precipitation Total': np.where(rng.random(hours) > 0.9, rng.random(hours), 0.0),
+                         'Cloud Cover Total': rng.random(hours) * 100,
+                         'Shortwave Radiation': rng.random(hours),
+                         'Generated Power': rng.random(hours) * 0.02}, index=index)
+
+
+def get_hourly_series(years: int) -> pd.DataFrame:
+    index = pd.date_range('2019-01-01', periods=years * 365 * 24, freq='1H')
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({'Precipitation Total': np.where(rng.random(len(index)) > 0.9, rng.random(len(index)) * 5, 0.0)}, index=index)
+
+
+def timed(function, *args):
+    t0 = time.time()
+    result = function(*args)
+    return result, time.time() - t0
+
+
+def benchmark_hours_since_last_rain(args):
+    df = get_hourly_series(args.years)
+    expected, by_row_time = timed(add_hours_since_last_rain_by_row, df.copy())
+    result, vectorized_time = timed(add_hours_since_last_rain, df.copy())
+    assert result.equals(expected), 'Vectorized output differs from the row by row output'
+    print(f"{len(df)} hourly rows: row by row {by_row_time:.3f} s, vectorized {vectorized_time:.4f} s, "
+          f"speedup {by_row_time / vectorized_time:.0f}x")
+
+    if os.path.isfile(PRE_PROCESSED_DATA_PATH):
+        try:
+            df = pd.read_parquet(PRE_PROCESSED_DATA_PATH)
+        except ImportError as e:
+            print(f"Skipping {PRE_PROCESSED_DATA_PATH}: {e}")
+            return
+        expected, by_row_time = timed(add_hours_since_last_rain_by_row, df.copy())
+        result, vectorized_time = timed(add_hours_since_last_rain, df.copy())
+        assert result.equals(expected), f'Vectorized output differs from the row by row output on {PRE_PROCESSED_DATA_PATH}'
+        print(f"{PRE_PROCESSED_DATA_PATH}, {len(df)} rows: row by row {by_row_time:.3f} s, vectorized {vectorized_time:.4f} s, same output")
+
+
+def benchmark_solar_zenith_angle(args):
+    index = pd.date_range('2019-01-01', periods=args.days * 24, freq='1H')
+    expected, by_row_time = timed(get_solar_altitude_by_row, args.latitude, args.longitude, index, args.timezone)
+    result, vectorized_time = timed(get_solar_altitude, args.latitude, args.longitude, index, args.timezone)
+    print(f"{len(index)} hourly rows: row by row {by_row_time:.3f} s, vectorized {vectorized_time:.4f} s, "
+          f"speedup {by_row_time / vectorized_time:.0f}x, max difference {np.abs(result - expected).max():.2e} degrees")
+
+
+def benchmark_inference(args):
+    model = load_model(MODEL_PATH, args.capacity)
+    for name, hours in INFERENCE_SIZES.items():
+        df = get_model_input(hours)
+        by_dataframe = [timed(predict_by_dataframe, model, args.latitude, args.longitude, df.copy()) for _ in range(args.repeat)]
+        by_array = [timed(predict_by_array, model, args.latitude, args.longitude, df.copy()) for _ in range(args.repeat)]
+        assert np.array_equal(by_dataframe[0][0], by_array[0][0]), f'Array predictions differ from the DataFrame predictions for {name}'
+        dataframe_time = min(t for _, t in by_dataframe)
+        array_time = min(t for _, t in by_array)
+        print(f"{name}, {hours} hourly rows: DataFrame {dataframe_time * 1000:.1f} ms, arrays {array_time * 1000:.1f} ms, "
+              f"speedup {dataframe_time / array_time:.1f}x, same predictions")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmarks of the anomaly detection feature generation. Run it from the /app directory.")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    hours_since_last_rain = subparsers.add_parser('hours_since_last_rain', help="Row by row against vectorized add_hours_since_last_rain")
+    hours_since_last_rain.add_argument('--years', type=int, default=5, help="Years of hourly data")
+    hours_since_last_rain.set_defaults(function=benchmark_hours_since_last_rain)
+    solar_zenith_angle = subparsers.add_parser('solar_zenith_angle', help="pysolar row by row against the vectorized solar altitude")
+    solar_zenith_angle.add_argument('--days', type=int, default=365, help="Days of hourly data")
+    solar_zenith_angle.add_argument('--latitude', type=float, default=-34.9)
+    solar_zenith_angle.add_argument('--longitude', type=float, default=-56.2)
+    solar_zenith_angle.add_argument('--timezone', default='America/Montevideo')
+    solar_zenith_angle.set_defaults(function=benchmark_solar_zenith_angle)
+    inference = subparsers.add_parser('inference', help="DataFrame against array inference with the anomaly model, for 1 day, 1 month and 1 year of hourly input")
+    inference.add_argument('--capacity', type=float, default=80, help="Prediction capacity of the location")
+    inference.add_argument('--latitude', type=float, default=-34.9)
+    inference.add_argument('--longitude', type=float, default=-56.2)
+    inference.add_argument('--repeat', type=int, default=5)
+    inference.set_defaults(function=benchmark_inference)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.function(args)
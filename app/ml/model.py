@@ -1,18 +1,35 @@
 
 import datetime
-from typing import List, Optional, Tuple
+import functools
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
 
 import joblib
 import numpy as np
 import pandas as pd
-import pytz
-from db.utils import (get_gen_data, get_gen_ids_by_data_pro_id, get_location,
-                      get_sta_data, insert_or_update_predictions)
-from pysolar.solar import *
+from core.solar_cache import SingleFlight
+from db.utils import (get_gen_data, get_gen_ids_by_data_pro_id, get_gen_ids_by_loc_id,
+                      get_gens_data, get_gens_features, get_last_gens_features, get_location,
+                      get_sta_data, insert_or_update_gens_features,
+                      insert_or_update_gens_predictions, insert_or_update_predictions)
+from ml.solar_position import solar_position_cache
 from sqlalchemy import Float
 from sqlalchemy.orm import Session
 
 TARGET_COLUMN = 'Generated Power'
+# Hourly data and engineered features of a generator kept in the feature store, before any scaling
+HOURLY_FEATURES = ['Temperature', 'Precipitation Total', 'Cloud Cover Total', 'Shortwave Radiation', TARGET_COLUMN,
+                   f'{TARGET_COLUMN} {1} Hour Lag', 'Hours Since Last Rain', 'Solar Zenith Angle']
+# Timezone of the data the model was trained with, used when the timezone of a location is unknown
+DEFAULT_TIMEZONE = 'America/Montevideo'
+GLOBAL_MODEL_PATH = os.path.join('ml', 'models', 'cat_boost_model.pkl')
+LOCATION_MODELS_PATH = os.path.join('ml', 'models', 'locations')
+MODEL_CACHE_MAX_MODELS = 16
+MODEL_CACHE_MAX_BYTES = 1024 ** 3
+# Season of each month, 0 for December to February, the month 0 is never used
+SEASON_BY_MONTH = np.array([-1, 0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3, 0])
 
 
 class Model:
@@ -27,32 +44,233 @@ class Model:
     def save(self, path):
         joblib.dump(self, path)
 
-    def generate_input(self, loc_latitude: int, loc_longitude: int, data: pd.DataFrame) -> pd.DataFrame:
+    def generate_input(self, loc_latitude: int, loc_longitude: int, data: pd.DataFrame, timezone: Optional[str] = None) -> pd.DataFrame:
+        return self.generate_input_from_features(add_hourly_features(data, loc_latitude, loc_longitude, timezone))
+
+    def generate_input_from_features(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Model input from the hourly features of add_hourly_features, computed or read from the feature store.
+        """
         data['Generated Power'] = data['Generated Power'] * 1000 * 4
         data['Shortwave Radiation'] = data['Shortwave Radiation'] * 1000
-        data = add_calculated_features(data, loc_latitude, loc_longitude)
-        data = data[self.features]
-        data[f'{TARGET_COLUMN} {1} Hour Lag'] = data[f'{TARGET_COLUMN} {1} Hour Lag'] * self.trained_capacity / self.prediction_capacity
-        return data
+        data[f'{TARGET_COLUMN} {1} Hour Lag'] = data[f'{TARGET_COLUMN} {1} Hour Lag'] * 1000 * 4 * self.trained_capacity / self.prediction_capacity
+        return get_feature_layout(tuple(self.features)).build(data)
 
-    def predict(self, data):
+    def predict(self, data: pd.DataFrame) -> pd.DataFrame:
         data = data.dropna()
-        indexes = data.index
-        data = self.x_scaler.transform(data)
-        prediction = self.cat_boost_model.predict(data)
-        prediction = self.y_scaler.inverse_transform(prediction.reshape(-1, 1))
-        prediction = prediction * self.prediction_capacity / self.trained_capacity
-        prediction = np.where(prediction < 0, 0, prediction)
-        prediction = prediction / 4000
-        prediction = np.round(prediction, 3)
-        prediction = [x[0] for x in prediction]
-        return pd.DataFrame(prediction, index=indexes, columns=['Prediction'])
-
-
-def load_model(path, prediction_capacity: Float) -> Model:
-    model = joblib.load(path)
-    model.prediction_capacity = prediction_capacity
-    return model
+        return pd.DataFrame({'Prediction': self.predict_array(data.to_numpy(dtype=np.float32))}, index=data.index)
+
+    def predict_array(self, x: np.ndarray) -> np.ndarray:
+        """
+        Predicted power in MW of each row of a feature matrix in the order of features, without missing values.
+        """
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        if len(x) == 0:
+            return np.empty(0)
+        x_scaling = get_affine_scaling(self.x_scaler)
+        x = ((x - x_scaling[0]) / x_scaling[1]).astype(np.float32) if x_scaling else self.x_scaler.transform(x)
+        prediction = np.asarray(self.cat_boost_model.predict(x), dtype=np.float64).ravel()
+        # Inverse scaling and capacity adjustment as a single multiply and add
+        capacity_ratio = self.prediction_capacity / self.trained_capacity
+        y_scaling = get_affine_scaling(self.y_scaler)
+        if y_scaling:
+            prediction = prediction * (y_scaling[1] * capacity_ratio) + y_scaling[0] * capacity_ratio
+        else:
+            prediction = np.asarray(self.y_scaler.inverse_transform(prediction.reshape(-1, 1))).ravel() * capacity_ratio
+        return np.round(np.maximum(prediction, 0) / 4000, 3)
+
+
+def get_affine_scaling(scaler) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Mean and scale of a StandardScaler, to scale arrays with plain arithmetic. None for other scalers.
+    """
+    if not (hasattr(scaler, 'mean_') and hasattr(scaler, 'scale_')):
+        return None
+    return (scaler.mean_ if scaler.mean_ is not None else 0.0,
+            scaler.scale_ if scaler.scale_ is not None else 1.0)
+
+
+class FeatureLayout:
+    """
+    Positions of the features of a model, to build its input as a single float32 matrix in the order of the
+    features: the hour, month and season indicators and the day are written from the index of the data, the
+    other features are copied from the columns of the data with the same name.
+    """
+
+    def __init__(self, features: Tuple[str, ...]):
+        self.features = list(features)
+        positions = {name: i for i, name in enumerate(self.features)}
+        self.hour_positions = np.array([positions.get(f'hour_{hour}', -1) for hour in range(24)])
+        self.month_positions = np.array([positions.get(f'month_{month}', -1) for month in range(13)])
+        self.season_positions = np.array([positions.get(f'season_{season}', -1) for season in range(4)])
+        self.day_position = positions.get('day', -1)
+        temporal = {f'hour_{hour}' for hour in range(24)} | {f'month_{month}' for month in range(13)} | {f'season_{season}' for season in range(4)} | {'day'}
+        self.data_columns = [name for name in self.features if name not in temporal]
+        self.data_positions = [positions[name] for name in self.data_columns]
+
+    def build(self, data: pd.DataFrame) -> pd.DataFrame:
+        return pd.DataFrame(self.build_array(data), index=data.index, columns=self.features)
+
+    def build_array(self, data: pd.DataFrame) -> np.ndarray:
+        index = pd.DatetimeIndex(data.index)
+        matrix = np.zeros((len(data), len(self.features)), dtype=np.float32)
+        rows = np.arange(len(data))
+        months = index.month.values
+        for positions, values in ((self.hour_positions, index.hour.values),
+                                  (self.month_positions, months),
+                                  (self.season_positions, SEASON_BY_MONTH[months])):
+            columns = positions[values]
+            found = columns >= 0
+            matrix[rows[found], columns[found]] = 1
+        if self.day_position >= 0:
+            matrix[:, self.day_position] = index.day.values
+        matrix[:, self.data_positions] = data[self.data_columns].to_numpy(dtype=np.float32)
+        return matrix
+
+
+@functools.lru_cache(maxsize=32)
+def get_feature_layout(features: Tuple[str, ...]) -> FeatureLayout:
+    return FeatureLayout(features)
+
+
+class CapacityModel:
+    """
+    Per request view of a shared Model with its own prediction_capacity, so requests for locations
+    with different capacities never change the Model they share.
+    """
+
+    def __init__(self, model: Model, prediction_capacity: Float):
+        self.model = model
+        self.prediction_capacity = prediction_capacity
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def generate_input(self, loc_latitude: int, loc_longitude: int, data: pd.DataFrame, timezone: Optional[str] = None) -> pd.DataFrame:
+        return Model.generate_input(self, loc_latitude, loc_longitude, data, timezone)
+
+    def generate_input_from_features(self, data: pd.DataFrame) -> pd.DataFrame:
+        return Model.generate_input_from_features(self, data)
+
+    def predict(self, data: pd.DataFrame) -> pd.DataFrame:
+        return Model.predict(self, data)
+
+    def predict_array(self, x: np.ndarray) -> np.ndarray:
+        return Model.predict_array(self, x)
+
+
+class ModelRegistry:
+    """
+    Loads each model file once per process and loads it again when the file changes (modification
+    time or size). With mmap_mode, the numpy arrays stored by joblib are memory-mapped instead of read.
+    The least recently used models are dropped beyond max_models models or max_bytes, with the size
+    of the model files as an estimate of their memory. Files are read outside the registry lock, so a
+    slow load does not block the models already loaded, and concurrent loads of the same file share one read.
+    """
+
+    def __init__(self, mmap_mode: Optional[str] = None, max_models: Optional[int] = MODEL_CACHE_MAX_MODELS,
+                 max_bytes: Optional[int] = MODEL_CACHE_MAX_BYTES):
+        self.mmap_mode = mmap_mode
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self._models: OrderedDict[str, Tuple[Tuple[int, int], Model]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._loads = SingleFlight()
+
+    def get(self, path: str) -> Model:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._models.get(path)
+            if entry is not None and entry[0] == version:
+                self._models.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+        return self._loads.do((path, version), lambda: self._load(path, version))
+
+    def _load(self, path: str, version: Tuple[int, int]) -> Model:
+        model = joblib.load(path, mmap_mode=self.mmap_mode)
+        with self._lock:
+            self.loads += 1
+            entry = self._models.get(path)
+            # A newer version of the file loaded meanwhile is not replaced by this one
+            if entry is None or entry[0][0] <= version[0]:
+                self._models[path] = (version, model)
+                self._models.move_to_end(path)
+                self._evict()
+        return model
+
+    def _evict(self):
+        # The model just loaded is kept even when it is larger than max_bytes on its own
+        while len(self._models) > 1 and ((self.max_models is not None and len(self._models) > self.max_models) or
+                                         (self.max_bytes is not None and self._get_bytes() > self.max_bytes)):
+            self._models.popitem(last=False)
+            self.evictions += 1
+
+    def _get_bytes(self) -> int:
+        return sum(version[1] for version, _ in self._models.values())
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self.hits = 0
+            self.loads = 0
+            self.evictions = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'models': list(self._models),
+                    'bytes': self._get_bytes(),
+                    'hits': self.hits,
+                    'loads': self.loads,
+                    'evictions': self.evictions}
+
+
+class ModelIndex:
+    """
+    Models trained for a single location, stored as <cli_id>_<loc_id>.pkl in directory, with the global
+    model for the locations without one. Models are loaded through the registry the first time they are used.
+    """
+
+    def __init__(self, directory: str, default_path: str, registry: ModelRegistry):
+        self.directory = directory
+        self.default_path = default_path
+        self.registry = registry
+
+    def get_location_path(self, cli_id: int, loc_id: int) -> str:
+        return os.path.join(self.directory, f'{cli_id}_{loc_id}.pkl')
+
+    def get_path(self, cli_id: int, loc_id: int) -> str:
+        path = self.get_location_path(cli_id, loc_id)
+        return path if os.path.isfile(path) else self.default_path
+
+    def get(self, cli_id: int, loc_id: int, prediction_capacity: Float) -> CapacityModel:
+        return CapacityModel(self.registry.get(self.get_path(cli_id, loc_id)), prediction_capacity)
+
+    def locations(self) -> List[Tuple[int, int]]:
+        if not os.path.isdir(self.directory):
+            return []
+        names = [os.path.splitext(name)[0].split('_') for name in os.listdir(self.directory) if name.endswith('.pkl')]
+        return sorted((int(name[0]), int(name[1])) for name in names if len(name) == 2 and name[0].isdigit() and name[1].isdigit())
+
+
+model_registry = ModelRegistry()
+model_index = ModelIndex(LOCATION_MODELS_PATH, GLOBAL_MODEL_PATH, model_registry)
+
+
+def load_model(path, prediction_capacity: Float) -> CapacityModel:
+    return CapacityModel(model_registry.get(path), prediction_capacity)
+
+
+def load_location_model(cli_id: int, loc_id: int, prediction_capacity: Float) -> CapacityModel:
+    """
+    Model trained for the location when there is one, the global model otherwise.
+    """
+    return model_index.get(cli_id, loc_id, prediction_capacity)
 
 
 def get_data(db: Session,
@@ -88,6 +306,169 @@ def get_data(db: Session,
     return model_df, cli_id, loc_id, gen_id, start_date, end_date, capacity, latitude, longitude
 
 
+def get_batch_data(db: Session,
+                   start_date: Optional[datetime.datetime],
+                   end_date: Optional[datetime.datetime],
+                   cli_id: Optional[int] = None,
+                   loc_id: Optional[int] = None,
+                   gen_ids: Optional[List[int]] = None,
+                   data_pro_id: Optional[int] = None) -> Tuple[pd.DataFrame, pd.DataFrame, int, int, List[int], datetime.datetime, datetime.datetime, Float, Float, Float]:
+    """
+    Like get_data for several generators of a location: the station data is read once and the generated power of
+    every generator with one query, indexed by gen_id and data_date. Without gen_ids every generator of the
+    location is used, or every generator of the data_pro_id batch.
+    """
+    if not data_pro_id and not (cli_id and loc_id and start_date and end_date):
+        raise ValueError('Invalid parameters: either data_pro_id or cli_id, loc_id, start_date and end_date must be provided')
+
+    if data_pro_id:
+        cli_id, loc_id, gen_ids, start_date, end_date = get_gen_ids_by_data_pro_id(db, data_pro_id)
+        if cli_id is None:
+            return pd.DataFrame(), pd.DataFrame(), None, None, [], None, None, None, None, None
+    elif not gen_ids:
+        gen_ids = get_gen_ids_by_loc_id(db, loc_id)['gen_id_auto'].tolist()
+
+    if isinstance(start_date, int):
+        start_date = datetime.datetime.fromtimestamp(start_date)
+    if isinstance(end_date, int):
+        end_date = datetime.datetime.fromtimestamp(end_date)
+
+    start_date = start_date - datetime.timedelta(hours=2)
+    location = get_location(db, loc_id, cli_id)
+    gens_df = get_gens_data(db, cli_id, gen_ids, start_date, end_date)
+    sta_df = get_sta_data(db, cli_id, loc_id, start_date, end_date)
+    return (gens_df, sta_df, cli_id, loc_id, sorted(gen_ids), start_date, end_date,
+            location.loc_output_total_capacity, location.loc_coord_lat, location.loc_coord_lng)
+
+
+def merge_gens_data(gens_df: pd.DataFrame, sta_df: pd.DataFrame) -> Dict[int, pd.DataFrame]:
+    """
+    Data of each generator of gens_df merged with the station data, as get_data returns it.
+    """
+    return {gen_id: pd.merge(gen_df.droplevel('gen_id'), sta_df, left_index=True, right_index=True, how='outer')
+            for gen_id, gen_df in gens_df.groupby(level='gen_id')}
+
+
+def resample_gens_data(gens_df: pd.DataFrame, sta_df: pd.DataFrame) -> Dict[int, pd.DataFrame]:
+    """
+    Hourly model data of each generator of gens_df, merged with the station data as get_data does.
+    """
+    return {gen_id: resample_data(model_df) for gen_id, model_df in merge_gens_data(gens_df, sta_df).items()}
+
+
+def get_resampled_hours(model_df: pd.DataFrame) -> pd.DatetimeIndex:
+    """
+    Hours resample_data keeps for model_df, with at least 4 rows without missing values, and the hour of each row.
+    """
+    hours = pd.DatetimeIndex(model_df.index).ceil('H')
+    counts = hours.value_counts()
+    return counts.index[counts >= 4].sort_values(), hours
+
+
+def get_gens_hourly_features(db: Session, cli_id: int, loc_id: int, model_dfs: Dict[int, pd.DataFrame], loc_latitude: Float, loc_longitude: Float,
+                             timezone: Optional[str] = None, data_pro_id: Optional[int] = None) -> Dict[int, pd.DataFrame]:
+    """
+    Hourly features of each generator, from its data as get_data returns it, with the HOURLY_FEATURES columns.
+    The hours already in the feature store are read. A stored hour is kept while its data_pro_id is still the last
+    data_pro_id of the generator data of the hour. From the first hour that is not stored or kept, or the first hour
+    of the data_pro_id batch, the data is resampled and the features are computed following the hour stored right
+    before, then written to the store. When that hour is not stored, the features of the whole data are computed
+    without the store. Rows with missing values are dropped from model_dfs, as resample_data does.
+    """
+    hours = {}
+    for gen_id, model_df in model_dfs.items():
+        model_df.dropna(inplace=True)
+        hours[gen_id] = get_resampled_hours(model_df)
+    gen_ids = [gen_id for gen_id in model_dfs if len(hours[gen_id][0])]
+    features = {gen_id: pd.DataFrame(columns=HOURLY_FEATURES) for gen_id in model_dfs}
+    if not gen_ids:
+        return features
+
+    stored = get_gens_features(db, cli_id, gen_ids, min(hours[gen_id][0][0] for gen_id in gen_ids), max(hours[gen_id][0][-1] for gen_id in gen_ids))
+    stored_gen_ids = set(stored.index.get_level_values('gen_id'))
+    compute_from = {}
+    for gen_id in gen_ids:
+        gen_hours, row_hours = hours[gen_id]
+        gen_stored = stored.xs(gen_id, level='gen_id') if gen_id in stored_gen_ids else stored.iloc[:0].droplevel('gen_id')
+        # Hours whose generator data was written again by another batch since they were stored are computed again
+        data_pro_ids = model_dfs[gen_id]['data_pro_id'].groupby(row_hours).max().reindex(gen_stored.index)
+        is_current = (gen_stored['data_pro_id'] == data_pro_ids) | (gen_stored['data_pro_id'].isna() & data_pro_ids.isna())
+        new_hours = gen_hours.difference(gen_stored.index[is_current.values])
+        if data_pro_id is not None:
+            new_hours = new_hours.union(gen_hours.intersection(row_hours[model_dfs[gen_id]['data_pro_id'].values == data_pro_id]))
+        features[gen_id] = gen_stored.loc[gen_hours[gen_hours < new_hours[0]] if len(new_hours) else gen_hours, HOURLY_FEATURES]
+        if len(new_hours):
+            compute_from[gen_id] = new_hours[0]
+    if not compute_from:
+        return features
+
+    contexts = [get_last_gens_features(db, cli_id, [gen_id for gen_id in compute_from if compute_from[gen_id] == start], start)
+                for start in sorted(set(compute_from.values()))]
+    context = pd.concat(contexts)
+    context_gen_ids = set(context.index.get_level_values('gen_id'))
+    computed = {}
+    for gen_id, start in compute_from.items():
+        gen_context = context.xs(gen_id, level='gen_id').iloc[0] if gen_id in context_gen_ids else None
+        # The lag and the hours since the last rain only follow from the hour right before start. After a gap in
+        # the store the whole window is computed again without the stored hours, as without a feature store
+        if gen_context is not None and gen_context.name != start - pd.Timedelta(hours=1):
+            gen_context = None
+            start = hours[gen_id][0][0]
+            features[gen_id] = features[gen_id].iloc[:0]
+        model_df = model_dfs[gen_id][hours[gen_id][1] >= start]
+        data_pro_ids = model_df['data_pro_id'].groupby(pd.DatetimeIndex(model_df.index).ceil('H')).max()
+        gen_features = add_hourly_features(resample_data(model_df.copy()), loc_latitude, loc_longitude, timezone, gen_context)
+        computed[gen_id] = gen_features.assign(data_pro_id=data_pro_ids.reindex(gen_features.index).values)
+        features[gen_id] = pd.concat([features[gen_id], gen_features[HOURLY_FEATURES]]) if len(features[gen_id]) else gen_features[HOURLY_FEATURES]
+    insert_or_update_gens_features(db, cli_id, loc_id, pd.concat(list(computed.values()), keys=list(computed), names=['gen_id', 'data_date']))
+    return features
+
+
+def predict_generators(ml_model: CapacityModel, loc_latitude: Float, loc_longitude: Float, model_dfs: Dict[int, pd.DataFrame],
+                       timezone: Optional[str] = None) -> pd.DataFrame:
+    """
+    Predictions of several generators with a single call to the model on their stacked features, indexed by gen_id and data_date.
+    """
+    return _predict_inputs(ml_model, {gen_id: ml_model.generate_input(loc_latitude, loc_longitude, model_df, timezone)
+                                      for gen_id, model_df in model_dfs.items() if not model_df.empty})
+
+
+def predict_generators_features(ml_model: CapacityModel, features_dfs: Dict[int, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Like predict_generators, from the hourly features of get_gens_hourly_features.
+    """
+    return _predict_inputs(ml_model, {gen_id: ml_model.generate_input_from_features(features_df)
+                                      for gen_id, features_df in features_dfs.items() if not features_df.empty})
+
+
+def _predict_inputs(ml_model: CapacityModel, inputs: Dict[int, pd.DataFrame]) -> pd.DataFrame:
+    if not inputs:
+        return pd.DataFrame(columns=['Prediction'], index=pd.MultiIndex.from_tuples([], names=['gen_id', 'data_date']))
+    return ml_model.predict(pd.concat(list(inputs.values()), keys=list(inputs), names=['gen_id', 'data_date']))
+
+
+def expand_predictions(prediction: pd.DataFrame, df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Hourly predictions spread to the four quarter hours ending at each hour, with the actual generated power and
+    data_pro_id of the quarter hours found in df. prediction and df are indexed by data_date, or by gen_id and
+    data_date for several generators, in which case the result has a gen_id column too.
+    """
+    quarters = pd.to_timedelta([45, 30, 15, 0], unit='min').values
+    dates = np.repeat(prediction.index.get_level_values(-1).values, 4) - np.tile(quarters, len(prediction))
+    gen_ids = np.repeat(prediction.index.get_level_values(0).values, 4) if prediction.index.nlevels > 1 else None
+    positions = df.index.get_indexer(pd.MultiIndex.from_arrays([gen_ids, dates]) if gen_ids is not None else pd.DatetimeIndex(dates))
+    found = positions >= 0
+    positions = positions[found]
+
+    result = pd.DataFrame({'data_date': dates[found],
+                           'data_value': np.repeat(prediction['Prediction'].values, 4)[found],
+                           'data_pro_id': df['data_pro_id'].values[positions],
+                           'actual': np.round(df['Generated Power'].values[positions], 3)})
+    if gen_ids is not None:
+        result.insert(0, 'gen_id', gen_ids[found])
+    return result.sort_values(list(result.columns[:2]) if gen_ids is not None else 'data_date', kind='stable').reset_index(drop=True)
+
+
 def resample_data(model_df: pd.DataFrame) -> pd.DataFrame:
     model_df.dropna(inplace=True)
     model_df['count'] = 1
@@ -135,40 +516,54 @@ def add_lag_based_feature_generation(df: pd.DataFrame) -> pd.DataFrame:
 
 
 def add_hours_since_last_rain(df: pd.DataFrame) -> pd.DataFrame:
-    df['Hours Since Last Rain'] = 0
-    last_rain_date = None
-    for index, row in df.iterrows():
-        if row['Precipitation Total'] > 0:
-            df.at[index, 'Hours Since Last Rain'] = 0
-            last_rain_date = index
-        else:
-            if last_rain_date is None:
-                df.at[index, 'Hours Since Last Rain'] = 0
-            else:
-                df.at[index, 'Hours Since Last Rain'] = (index - last_rain_date).total_seconds() / 3600
+    rain = df['Precipitation Total'] > 0
+    last_rain_date = pd.Series(df.index.where(rain), index=df.index).ffill()
+    hours = (df.index.to_series() - last_rain_date).dt.total_seconds() / 3600
+    hours = hours.fillna(0)
+    # Whole hours are kept as integers, as when the hours were written one by one into the column of zeros
+    df['Hours Since Last Rain'] = hours.astype('int64') if (hours == hours.round()).all() else hours
     return df
 
 
-def get_solar_zenith_angle(row, tz, latitude: Float, longitude: Float) -> float:
-    time = tz.localize(row.name)
-    sza = get_altitude(latitude, longitude, time)
-    return sza
+def add_solar_zenith_angle(df, latitude: Float, longitude: Float, timezone: Optional[str] = None) -> pd.DataFrame:
+    # The feature is the solar altitude as given by pysolar.solar.get_altitude, with the index as local times of the location
+    df['Solar Zenith Angle'] = solar_position_cache.get_solar_altitude(latitude, longitude, pd.DatetimeIndex(df.index), timezone or DEFAULT_TIMEZONE)
+    return df
 
 
-def add_solar_zenith_angle(df, latitude: Float, longitude: Float) -> pd.DataFrame:
-    tz = pytz.timezone('America/Montevideo')
-    df['Solar Zenith Angle'] = df.apply(lambda row: get_solar_zenith_angle(row, tz, latitude, longitude), axis=1)
+def add_hourly_features(df: pd.DataFrame, latitude: Float, longitude: Float, timezone: Optional[str] = None,
+                        context: Optional[pd.Series] = None) -> pd.DataFrame:
+    """
+    Lag, hours since the last rain and solar zenith angle of hourly data from resample_data. context is the hour
+    before df in the feature store, named by its date, that the lag and the hours since the last rain follow from.
+    """
+    df = add_lag_based_feature_generation(df)
+    df = add_hours_since_last_rain(df)
+    df = add_solar_zenith_angle(df, latitude, longitude, timezone)
+    if context is None or df.empty:
+        return df
+    df.iloc[0, df.columns.get_loc(f'{TARGET_COLUMN} {1} Hour Lag')] = context[TARGET_COLUMN]
+    if context['Hours Since Last Rain'] > 0 or context['Precipitation Total'] > 0:
+        last_rain_date = context.name - pd.Timedelta(hours=context['Hours Since Last Rain'])
+        before_rain = ~(df['Precipitation Total'] > 0).cummax().values
+        hours = df['Hours Since Last Rain'].astype('float64')
+        hours[before_rain] = (df.index[before_rain] - last_rain_date).total_seconds() / 3600
+        df['Hours Since Last Rain'] = hours
     return df
 
 
-def add_calculated_features(df, latitude: Float, longitude: Float) -> pd.DataFrame:
+def add_calculated_features(df, latitude: Float, longitude: Float, timezone: Optional[str] = None) -> pd.DataFrame:
     df = add_temporal_feature_engineering(df)
     df = add_lag_based_feature_generation(df)
     df = add_hours_since_last_rain(df)
-    df = add_solar_zenith_angle(df, latitude, longitude)
+    df = add_solar_zenith_angle(df, latitude, longitude, timezone)
     df = df.drop(columns=[TARGET_COLUMN])
     return df
 
 
-def save_predictions(db: Session, cli_id: int, gen_id: int, predictions: List[Tuple[datetime.datetime, float, int]]):
+def save_predictions(db: Session, cli_id: int, gen_id: int, predictions: Union[pd.DataFrame, List[Tuple[datetime.datetime, float, int]]]):
     insert_or_update_predictions(db, cli_id, gen_id, predictions)
+
+
+def save_gens_predictions(db: Session, cli_id: int, predictions: pd.DataFrame):
+    insert_or_update_gens_predictions(db, cli_id, predictions)
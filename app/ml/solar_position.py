@@ -0,0 +1,160 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+from pysolar import constants, solartime
+
+SOLAR_POSITION_CACHE_MAX_ENTRIES = 128
+
+_HELIOCENTRIC_LONGITUDE_COEFFS = [np.array(line, dtype=float) for line in constants.heliocentric_longitude_coeffs]
+_HELIOCENTRIC_LATITUDE_COEFFS = [np.array(line, dtype=float) for line in constants.heliocentric_latitude_coeffs]
+_SUN_EARTH_DISTANCE_COEFFS = [np.array(line, dtype=float) for line in constants.sun_earth_distance_coeffs]
+_NUTATION_COEFFS = np.array(constants.nutation_coefficients, dtype=float)
+_NUTATION_SIN_TERMS = np.array(constants.aberration_sin_terms, dtype=float)
+# Mean elongation of the moon, mean anomaly of the sun, mean anomaly of the moon, argument of latitude of the moon
+# and longitude of the ascending node, as a + b * jce + c * jce ** 2 + jce ** 3 / d
+_NUTATION_ARGUMENTS = np.array([(297.85036, 445267.111480, -0.0019142, 189474.0),
+                                (357.52772, 35999.050340, -0.0001603, -300000.0),
+                                (134.96298, 477198.867398, 0.0086972, 56250.0),
+                                (93.27191, 483202.017538, -0.0036825, 327270.0),
+                                (125.04452, -1934.136261, 0.0020708, 450000.0)])
+_GREGORIAN_TO_JULIAN_DAY = solartime.gregorian_day_offset + solartime.julian_day_offset
+
+
+def _get_coeff(jme: np.ndarray, coeffs) -> np.ndarray:
+    result = np.zeros_like(jme)
+    x = np.ones_like(jme)
+    for line in coeffs:
+        result += (line[:, 0, None] * np.cos(line[:, 1, None] + line[:, 2, None] * jme)).sum(axis=0) * x
+        x = x * jme
+    return result
+
+
+def _get_time_corrections(utc: pd.DatetimeIndex):
+    """
+    Leap seconds and delta T of each timestamp, which pysolar looks up by month.
+    """
+    months = utc.year * 12 + utc.month - 1
+    unique_months, inverse = np.unique(months, return_inverse=True)
+    leap_seconds = np.empty(len(unique_months))
+    delta_t = np.empty(len(unique_months))
+    for i, month in enumerate(unique_months):
+        when = datetime(month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+        leap_seconds[i] = solartime.get_leap_seconds(when)
+        delta_t[i] = solartime.get_delta_t(when)
+    return leap_seconds[inverse], delta_t[inverse]
+
+
+def get_solar_altitude(latitude: float, longitude: float, index: pd.DatetimeIndex, timezone_name: str) -> np.ndarray:
+    """
+    Solar altitude in degrees at sea level for every timestamp of index, naive times in timezone_name.
+    Same algorithm as pysolar.solar.get_altitude (NREL SPA with standard temperature and pressure), computed with NumPy
+    for the whole index at once. Ambiguous and missing local times are taken as standard time, as pytz localize does.
+    """
+    if len(index) == 0:
+        return np.empty(0)
+    utc = index.tz_localize(timezone_name, ambiguous=np.zeros(len(index), dtype=bool), nonexistent=timedelta(hours=1)).tz_convert('UTC')
+    seconds = utc.asi8 / 1e9
+    leap_seconds, delta_t = _get_time_corrections(utc)
+    jd = (seconds + leap_seconds + solartime.tt_offset - delta_t) / constants.seconds_per_day + _GREGORIAN_TO_JULIAN_DAY
+    jde = (seconds + leap_seconds + solartime.tt_offset) / constants.seconds_per_day + _GREGORIAN_TO_JULIAN_DAY
+    jc = (jd - 2451545.0) / 36525.0
+    jce = (jde - 2451545.0) / 36525.0
+    jme = jce / 10.0
+
+    geocentric_latitude = -np.degrees(_get_coeff(jme, _HELIOCENTRIC_LATITUDE_COEFFS) / 1e8)
+    geocentric_longitude = (np.degrees(_get_coeff(jme, _HELIOCENTRIC_LONGITUDE_COEFFS) / 1e8) % 360 + 180) % 360
+    sun_earth_distance = _get_coeff(jme, _SUN_EARTH_DISTANCE_COEFFS) / 1e8
+    aberration_correction = -20.4898 / (3600.0 * sun_earth_distance)
+    equatorial_horizontal_parallax = 8.794 / (3600 / sun_earth_distance)
+
+    a, b, c, d = _NUTATION_ARGUMENTS.T
+    arguments = a[:, None] + b[:, None] * jce + c[:, None] * jce ** 2 + jce ** 3 / d[:, None]
+    sigma = np.radians(_NUTATION_SIN_TERMS @ arguments)
+    nutation_longitude = ((_NUTATION_COEFFS[:, 0, None] + _NUTATION_COEFFS[:, 1, None] * jce) * np.sin(sigma)).sum(axis=0) / 36000000.0
+    nutation_obliquity = ((_NUTATION_COEFFS[:, 2, None] + _NUTATION_COEFFS[:, 3, None] * jce) * np.cos(sigma)).sum(axis=0) / 36000000.0
+
+    u = jme / 10.0
+    mean_obliquity = (84381.448 - (4680.93 * u) - (1.55 * u ** 2) + (1999.25 * u ** 3) - (51.38 * u ** 4) - (249.67 * u ** 5) - (39.05 * u ** 6)
+                      + (7.12 * u ** 7) + (27.87 * u ** 8) + (5.79 * u ** 9) + (2.45 * u ** 10))
+    true_obliquity = mean_obliquity / 3600.0 + nutation_obliquity
+    mean_sidereal_time = (280.46061837 + (360.98564736629 * (jd - 2451545.0)) + 0.000387933 * jc * jc * (1 - jc / 38710000)) % 360
+    # pysolar takes the cosine of the obliquity in degrees as radians
+    apparent_sidereal_time = mean_sidereal_time + nutation_longitude * np.cos(true_obliquity)
+
+    apparent_sun_longitude = np.radians(geocentric_longitude + nutation_longitude + aberration_correction)
+    true_obliquity = np.radians(true_obliquity)
+    geocentric_latitude = np.radians(geocentric_latitude)
+    right_ascension = np.degrees(np.arctan2(np.sin(apparent_sun_longitude) * np.cos(true_obliquity) - np.tan(geocentric_latitude) * np.sin(true_obliquity),
+                                            np.cos(apparent_sun_longitude))) % 360
+    declination = np.arcsin(np.sin(geocentric_latitude) * np.cos(true_obliquity)
+                            + np.cos(geocentric_latitude) * np.sin(true_obliquity) * np.sin(apparent_sun_longitude))
+    local_hour_angle = np.radians((apparent_sidereal_time + longitude - right_ascension) % 360)
+
+    latitude_rad = np.radians(latitude)
+    flattened_latitude = np.arctan(0.99664719 * np.tan(latitude_rad))
+    projected_radial_distance = np.cos(flattened_latitude)
+    projected_axial_distance = 0.99664719 * np.sin(flattened_latitude)
+    parallax = np.radians(equatorial_horizontal_parallax)
+    parallax_right_ascension = np.arctan2(-projected_radial_distance * np.sin(parallax) * np.sin(local_hour_angle),
+                                          np.cos(declination) - projected_radial_distance * np.sin(parallax) * np.cos(local_hour_angle))
+    topocentric_declination = np.arctan2((np.sin(declination) - projected_axial_distance * np.sin(parallax)) * np.cos(parallax_right_ascension),
+                                         np.cos(declination) - projected_axial_distance * np.sin(parallax) * np.cos(local_hour_angle))
+    topocentric_local_hour_angle = local_hour_angle - parallax_right_ascension
+    elevation = np.degrees(np.arcsin(np.sin(latitude_rad) * np.sin(topocentric_declination)
+                                     + np.cos(latitude_rad) * np.cos(topocentric_declination) * np.cos(topocentric_local_hour_angle)))
+
+    # Refraction as in the NREL SPA C code, only above the horizon
+    refraction = (constants.standard_pressure * 2.830 * 1.02) / (1010.0 * constants.standard_temperature * 60.0 * np.tan(np.radians(elevation + (10.3 / (elevation + 5.11)))))
+    return elevation + np.where(elevation >= -(0.26667 + 0.5667), refraction, 0.)
+
+
+class SolarPositionCache():
+    """
+    In-process cache of solar altitudes per location, timezone and timestamps, since the same plants are scored
+    again and again over the same ranges. The least recently used entries are evicted after max_entries.
+    """
+
+    def __init__(self, max_entries: int = SOLAR_POSITION_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_solar_altitude(self, latitude: float, longitude: float, index: pd.DatetimeIndex, timezone_name: str) -> np.ndarray:
+        key = (latitude, longitude, timezone_name, index[0] if len(index) else None, index[-1] if len(index) else None,
+               len(index), hash(index.asi8.tobytes()))
+        with self._lock:
+            altitude = self._entries.get(key)
+            if altitude is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return altitude
+            self.misses += 1
+
+        altitude = get_solar_altitude(latitude, longitude, index, timezone_name)
+        altitude.flags.writeable = False
+        with self._lock:
+            self._entries[key] = altitude
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return altitude
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'hits': self.hits,
+                    'misses': self.misses}
+
+
+solar_position_cache = SolarPositionCache()
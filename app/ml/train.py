@@ -0,0 +1,242 @@
+import argparse
+import logging
+import os
+import resource
+import tempfile
+import time
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from db.db import SessionLocal
+from db.utils import get_location, get_location_timezone
+from ml.model import TARGET_COLUMN, Model, add_calculated_features, model_index
+from sqlalchemy.orm import Session
+
+TRAINING_DATA_PATH = os.path.join('ml', 'data', '1_pre_processed_data.parquet')
+TRAINING_COLUMNS = ['Temperature', 'Precipitation Total', 'Cloud Cover Total', 'Shortwave Radiation', TARGET_COLUMN]
+TRAINING_BATCH_SIZE = 65536
+# Plant of the training data, as in the Training production model notebook
+TRAINING_LATITUDE = -34.68
+TRAINING_LONGITUDE = -55.82
+TRAINING_TIMEZONE = 'America/Montevideo'
+TRAINING_CAPACITY = 50
+RADIATION_THRESHOLD = 100
+OUTLIER_IQR_MULTIPLIER = 1.5
+# Found in the Hyperparameter tuning for production notebook
+CAT_BOOST_PARAMS = {'bagging_temperature': 0.153,
+                    'border_count': 218,
+                    'depth': 7,
+                    'iterations': 400,
+                    'l2_leaf_reg': 4.030,
+                    'learning_rate': 0.182,
+                    'random_strength': 0.761,
+                    'rsm': 0.838,
+                    'subsample': 0.793}
+
+
+def get_feature_order(columns: List[str]) -> List[str]:
+    """
+    Features in the order of the production model: the weather columns, the day, the season, month and hour
+    indicators and the engineered features, whatever the order add_calculated_features added them in.
+    """
+    temporal = ['day'] + [f'season_{i}' for i in range(4)] + [f'month_{i}' for i in range(1, 13)] + [f'hour_{i}' for i in range(24)]
+    engineered = [f'{TARGET_COLUMN} {1} Hour Lag', 'Hours Since Last Rain', 'Solar Zenith Angle']
+    weather = [column for column in columns if column not in temporal and column not in engineered]
+    return weather + temporal + engineered
+
+
+def read_batches(path: str, columns: List[str], batch_size: int) -> Iterator[pd.DataFrame]:
+    """
+    The columns of a parquet file a batch at a time, row group by row group, with the index it was saved with.
+    """
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(path)
+    index_columns = [column for column in (parquet_file.schema_arrow.pandas_metadata or {}).get('index_columns', []) if isinstance(column, str)]
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=index_columns + columns):
+        yield batch.to_pandas()
+
+
+def get_outlier_bounds(path: str) -> Tuple[float, float]:
+    """
+    Bounds of the generated power outside of which rows are outliers, from the quartiles of the whole file.
+    """
+    import pyarrow.parquet as pq
+
+    power = pq.read_table(path, columns=[TARGET_COLUMN]).column(TARGET_COLUMN).to_pandas()
+    q1 = power.quantile(0.25)
+    q3 = power.quantile(0.75)
+    return q1 - OUTLIER_IQR_MULTIPLIER * (q3 - q1), q3 + OUTLIER_IQR_MULTIPLIER * (q3 - q1)
+
+
+def iter_features(path: str, latitude: float, longitude: float, timezone: str, batch_size: int = TRAINING_BATCH_SIZE,
+                  outlier_bounds: Optional[Tuple[float, float]] = None) -> Iterator[Tuple[pd.DataFrame, pd.Series]]:
+    """
+    Features and target of each batch of the training data, built with add_calculated_features. The last row of
+    the previous batches and the last one with rain go before each batch, so the lag and the hours since the last
+    rain are the same as for the whole file at once. Outliers and rows with radiation but no power are dropped.
+    """
+    context = None
+    for df in read_batches(path, TRAINING_COLUMNS, batch_size):
+        df = df[TRAINING_COLUMNS]
+        if context is not None:
+            df = pd.concat([context, df])
+        rain = df[df['Precipitation Total'] > 0]
+        context_rows = len(context) if context is not None else 0
+        context = df.iloc[[-1]] if rain.empty or rain.index[-1] == df.index[-1] else pd.concat([rain.iloc[[-1]], df.iloc[[-1]]])
+
+        target = df[TARGET_COLUMN].copy()
+        features = add_calculated_features(df, latitude, longitude, timezone).iloc[context_rows:]
+        target = target.iloc[context_rows:]
+
+        keep = ~((target == 0) & (features['Shortwave Radiation'] > RADIATION_THRESHOLD))
+        if outlier_bounds is not None:
+            keep &= (target >= outlier_bounds[0]) & (target <= outlier_bounds[1])
+        yield features[keep], target[keep]
+
+
+def get_training_data(path: str, latitude: float, longitude: float, timezone: str,
+                      batch_size: int = TRAINING_BATCH_SIZE) -> Tuple[pd.DataFrame, pd.Series]:
+    """
+    Features of the whole training data as a single float32 matrix, filled batch by batch.
+    """
+    features = None
+    matrices = []
+    targets = []
+    for x, y in iter_features(path, latitude, longitude, timezone, batch_size, get_outlier_bounds(path)):
+        features = features or get_feature_order(list(x.columns))
+        matrices.append(x[features].to_numpy(dtype=np.float32))
+        targets.append(y)
+    target = pd.concat(targets)
+    return pd.DataFrame(np.concatenate(matrices), index=target.index, columns=features), target
+
+
+def train_model(x: pd.DataFrame, y: pd.Series, trained_capacity: float, thread_count: int = -1,
+                iterations: int = CAT_BOOST_PARAMS['iterations'], verbose: bool = False) -> Tuple[Model, float]:
+    """
+    Train the CatBoost model on the first 60% of the rows, with the next 20% as evaluation set, as the Training
+    production model notebook does. Returns the model and its mean absolute error on the last 20%.
+    """
+    from catboost import CatBoostRegressor
+    from sklearn.preprocessing import StandardScaler
+
+    train_end, validation_end = int(.6 * len(x)), int(.8 * len(x))
+    x_scaler = StandardScaler().fit(x.iloc[:train_end])
+    y_scaler = StandardScaler().fit(y.iloc[:train_end].values.reshape(-1, 1))
+
+    def scale(start, end):
+        return (np.ascontiguousarray(x_scaler.transform(x.iloc[start:end]), dtype=np.float32),
+                y_scaler.transform(y.iloc[start:end].values.reshape(-1, 1)).ravel())
+
+    cat_boost_model = CatBoostRegressor(**{**CAT_BOOST_PARAMS, 'iterations': iterations},
+                                        thread_count=thread_count, verbose=verbose, allow_writing_files=False)
+    cat_boost_model.fit(*scale(0, train_end), eval_set=scale(train_end, validation_end))
+
+    x_test, _ = scale(validation_end, len(x))
+    prediction = y_scaler.inverse_transform(cat_boost_model.predict(x_test).reshape(-1, 1)).ravel()
+    mae = float(np.mean(np.abs(prediction - y.iloc[validation_end:].values)))
+    return Model(cat_boost_model, x.columns, x_scaler, y_scaler, trained_capacity), mae
+
+
+def get_location_settings(db: Session, cli_id: int, loc_id: int) -> Tuple[float, float, Optional[str], float]:
+    """
+    Latitude, longitude, timezone and capacity of a location, as the anomaly detection reads them when it scores it.
+    """
+    location = get_location(db, loc_id, cli_id)
+    if location is None:
+        raise ValueError(f'Location {loc_id} of client {cli_id} not found')
+    return location.loc_coord_lat, location.loc_coord_lng, get_location_timezone(db, loc_id), location.loc_output_total_capacity
+
+
+def save_model(model: Model, path: str):
+    """
+    Dump the model to a temporary file in the directory of path and move it over path, so the anomaly
+    detection never loads a partially written model.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    os.close(fd)
+    try:
+        # mkstemp creates the file readable by its owner only
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp_path, 0o666 & ~umask)
+        model.save(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def get_peak_memory_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the anomaly detection model from a pre-processed parquet file. Run it from the /app directory.")
+    parser.add_argument('--data', help=f"Parquet file with the hourly weather and generated power of the plant, {TRAINING_DATA_PATH} for the global model. "
+                                       "Required with --client and --location")
+    parser.add_argument('--output', help="Path of the trained model, ml/models/cat_boost_model.pkl is the global model")
+    parser.add_argument('--client', type=int, help="Client of the location the model is trained for")
+    parser.add_argument('--location', type=int, help="Location the model is trained for, saved where the anomaly detection looks for it by default")
+    parser.add_argument('--threads', type=int, default=-1, help="CatBoost training threads, -1 for every core")
+    parser.add_argument('--batch-size', type=int, default=TRAINING_BATCH_SIZE, help="Rows read from the parquet file at a time")
+    parser.add_argument('--iterations', type=int, default=CAT_BOOST_PARAMS['iterations'])
+    parser.add_argument('--latitude', type=float, help="Read from the location with --client and --location")
+    parser.add_argument('--longitude', type=float, help="Read from the location with --client and --location")
+    parser.add_argument('--timezone', help="Read from the location with --client and --location")
+    parser.add_argument('--capacity', type=float, help="Capacity of the plant of the training data, read from the location with --client and --location")
+    parser.add_argument('--verbose', action='store_true', help="Log every CatBoost iteration")
+    args = parser.parse_args()
+    if (args.client is None) != (args.location is None):
+        parser.error('--client and --location go together')
+    if args.client is not None:
+        if args.data is None:
+            parser.error('--data is required with --client and --location')
+        if any(value is not None for value in [args.latitude, args.longitude, args.timezone, args.capacity]):
+            parser.error('--latitude, --longitude, --timezone and --capacity are read from the location with --client and --location')
+    else:
+        args.data = args.data or TRAINING_DATA_PATH
+        args.latitude = TRAINING_LATITUDE if args.latitude is None else args.latitude
+        args.longitude = TRAINING_LONGITUDE if args.longitude is None else args.longitude
+        args.timezone = args.timezone or TRAINING_TIMEZONE
+        args.capacity = TRAINING_CAPACITY if args.capacity is None else args.capacity
+    if args.output is None:
+        if args.client is None:
+            parser.error('--output or --client and --location must be provided')
+        args.output = model_index.get_location_path(args.client, args.location)
+    return args
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    if args.client is not None:
+        if SessionLocal is None:
+            raise RuntimeError("Database is not initialized")
+        db = SessionLocal()
+        try:
+            args.latitude, args.longitude, args.timezone, args.capacity = get_location_settings(db, args.client, args.location)
+        finally:
+            db.close()
+        logging.info("Location %s: latitude %s, longitude %s, timezone %s, capacity %s",
+                     args.location, args.latitude, args.longitude, args.timezone, args.capacity)
+
+    t0 = time.perf_counter()
+    x, y = get_training_data(args.data, args.latitude, args.longitude, args.timezone, args.batch_size)
+    t1 = time.perf_counter()
+    logging.info("Built %s features for %s rows in %.2f s", x.shape[1], x.shape[0], t1 - t0)
+
+    model, mae = train_model(x, y, args.capacity, args.threads, args.iterations, args.verbose)
+    t2 = time.perf_counter()
+    logging.info("Trained with %s threads in %.2f s, test MAE %.2f", model.cat_boost_model.get_param('thread_count'), t2 - t1, mae)
+
+    save_model(model, args.output)
+    logging.info("Saved %s, total wall time %.2f s, peak memory %.0f MB", args.output, time.perf_counter() - t0, get_peak_memory_mb())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import argparse
+import datetime
+import logging
+
+from core.solar_alerts import ALERT_SWEEP_MAX_WORKERS, calculate_fleet_alerts
+from db.db import SessionLocal
+
+logging.basicConfig(level=logging.INFO)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compute the alerts of all the locations of the given clients, or of every client, for a date range.")
+    parser.add_argument("--from", dest="start_date", type=datetime.date.fromisoformat, required=True)
+    parser.add_argument("--to", dest="end_date", type=datetime.date.fromisoformat, required=True)
+    parser.add_argument("--clients", nargs="+", default=["all"], help='Client ids, or "all"')
+    parser.add_argument("--workers", type=int, default=ALERT_SWEEP_MAX_WORKERS, help="Clients processed concurrently")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if SessionLocal is None:
+        raise RuntimeError("Database is not initialized")
+    cli_ids = None if args.clients == ["all"] else [int(cli_id) for cli_id in args.clients]
+    datetime_start = datetime.datetime.combine(args.start_date, datetime.time())
+    datetime_end = datetime.datetime.combine(args.end_date, datetime.time()) + datetime.timedelta(days=1, seconds=-1)
+
+    results = calculate_fleet_alerts(SessionLocal, datetime_start, datetime_end, cli_ids=cli_ids, max_workers=args.workers)
+    for result in results:
+        if result['error']:
+            logging.error("Client %s failed: %s", result['client'], result['error'])
+        else:
+            logging.info("Client %s: %s alerts for %s generators in %s locations.",
+                         result['client'], result['count'], result['generators'], result['locations'])
+    logging.info("%s alerts for %s clients.", sum(result['count'] for result in results), len(results))
+
+
+if __name__ == "__main__":
+    main()
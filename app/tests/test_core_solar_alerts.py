@@ -0,0 +1,219 @@
+import json
+import threading
+import time
+from datetime import datetime
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi import HTTPException
+
+from app.core.solar_alerts import (calculate_alerts_incrementally, calculate_client_alerts,
+                                   calculate_fleet_alerts, get_alert_rows,
+                                   get_days_to_evaluate, get_location_alert_rows)
+
+
+def test_get_alert_rows():
+    data = pd.DataFrame({
+        "missing_percentage": [95.0, 0.0, np.nan],
+        "performance_ratio": [80.0, 40.0, 70.0],
+        "prev_performance_ratio": [np.nan, 80.0, 40.0],
+        "performance_ratio_diff_percentage": [np.nan, 50.0, -75.0],
+        "time_based_availability": [1.0, 1.0, 0.05],
+        "prev_time_based_availability": [np.nan, 1.0, 1.0],
+        "time_based_availability_diff_percentage": [np.nan, 0.0, 95.0],
+        "ac_production": [1.0, 1.0, 0.5],
+        "ac_production_prediction": [1.0, 1.0, 1.0],
+        "production_diff_percentage": [100.0, 100.0, 50.0],
+    }, index=pd.MultiIndex.from_tuples([(1, pd.Timestamp(2021, 1, 1)), (1, pd.Timestamp(2021, 1, 2)), (2, pd.Timestamp(2021, 1, 1))],
+                                       names=["gen_id", "data_date"]))
+    gen_codes = pd.Series(["G1", "G2"], index=[1, 2])
+    now = datetime(2021, 1, 3)
+
+    rows = get_alert_rows(data, gen_codes, 7, now, 90, 40, 90, 90)
+
+    assert [(row["gen_id"], row["cli_gen_alert_trigger"]) for row in rows] == [(1, pd.Timestamp(2021, 1, 1)), (1, pd.Timestamp(2021, 1, 2)),
+                                                                                (2, pd.Timestamp(2021, 1, 1)), (2, pd.Timestamp(2021, 1, 1))]
+    assert all(row["cli_id"] == 7 and row["cli_gen_alert_added"] == now and row["cli_gen_alert_type"] == 1 for row in rows)
+    assert rows[0]["cli_gen_alert_data"] == json.dumps({"type": "alertDataAvailabilityLow", "gen_code": "G1",
+                                                        "description": "Data availability on 2021-01-01 for generator G1 was 5%.",
+                                                        "value": 5.0, "previous_value": None, "threshold": 90, "date": "2021-01-01"})
+    assert json.loads(rows[1]["cli_gen_alert_data"])["description:"] == \
+        "Performance ratio on 2021-01-02 for generator G1 was 40%, which is 50% lower than the previous day (80%)"
+    assert json.loads(rows[2]["cli_gen_alert_data"])["description"] == \
+        "Time based availability on 2021-01-01 for generator G2 was 5%, which is 95% lower than the previous day (100%)"
+    assert rows[3]["cli_gen_alert_data"] == json.dumps({"type": "alertProductionLowerThanPredicted", "gen_code": "G2",
+                                                        "description:": "Production on 2021-01-01 for generator G2 was 0.5000 MW/h, which is 50% lower than the predicted (1.0000 MW/h)",
+                                                        "value": 0.5, "predicted_value": 1.0, "threshold": 90, "date": "2021-01-01", "diff_percentage": 50.0})
+
+
+def test_get_alert_rows_without_alerts():
+    data = pd.DataFrame({
+        "missing_percentage": [0.0], "performance_ratio": [80.0], "prev_performance_ratio": [80.0], "performance_ratio_diff_percentage": [0.0],
+        "time_based_availability": [1.0], "prev_time_based_availability": [1.0], "time_based_availability_diff_percentage": [0.0],
+        "ac_production": [1.0], "ac_production_prediction": [1.0], "production_diff_percentage": [100.0],
+    }, index=pd.MultiIndex.from_tuples([(1, pd.Timestamp(2021, 1, 1))], names=["gen_id", "data_date"]))
+
+    assert get_alert_rows(data, pd.Series(["G1"], index=[1]), 7, datetime(2021, 1, 3), 90, 6, 10, 90) == []
+
+
+def _get_client_datas_by_period():
+    days = [pd.Timestamp(2021, 1, 1), pd.Timestamp(2021, 1, 2)]
+    gen_data = pd.DataFrame({
+        "gen_id": [1, 1, 2, 2, 3, 3, 4],
+        "data_date": days * 3 + days[:1],
+        "power": [4000.0, 1000.0, 8000.0, 8000.0, 2000.0, 2000.0, 1000.0],
+        "ac_production": [4000.0, 1000.0, 8000.0, 8000.0, 2000.0, 2000.0, 1000.0],
+        "ac_production_prediction": [4000.0, 4000.0, 8000.0, 8000.0, 2000.0, np.nan, 1000.0],
+        "data_count": [96, 40, 96, 96, 96, 96, 96],
+        "unavailable_count": [0, 30, 0, 0, 0, 0, 0],
+        "last_ac_production": [np.nan, 10.0, np.nan, 20.0, np.nan, 30.0, np.nan],
+    })
+    sta_data = pd.DataFrame({
+        "sta_id": [20, 20, 21, 21],
+        "data_date": days * 2,
+        "avg_ambient_temp": [10.0, 12.0, 11.0, 13.0],
+        "avg_module_temp": [20.0, 22.0, 21.0, 23.0],
+        "irradiation": [5.0, 4.0, 6.0, 6.0],
+    })
+    return gen_data, sta_data
+
+
+@mock.patch("app.core.solar_alerts.insert_cli_gen_alerts")
+@mock.patch("app.core.solar_alerts.get_client_sta_datas_by_period")
+@mock.patch("app.core.solar_alerts.get_client_gen_datas_by_period")
+@mock.patch("app.core.solar_alerts.get_client_settings")
+def test_calculate_client_alerts(mock_get_client_settings, mock_get_client_gen_datas_by_period, mock_get_client_sta_datas_by_period, mock_insert_cli_gen_alerts):
+    mock_get_client_settings.return_value = pd.DataFrame({"cli_set_value": ["20"]}, index=["alertDataAvailabilityLowerThan"])
+    gen_data, sta_data = _get_client_datas_by_period()
+    mock_get_client_gen_datas_by_period.return_value = gen_data
+    mock_get_client_sta_datas_by_period.return_value = sta_data
+    mock_insert_cli_gen_alerts.side_effect = lambda db, cli_id, gen_ids, datetime_start, datetime_end, rows: len(rows)
+    generators = pd.DataFrame({"loc_id": [10, 10, 11, 12], "gen_id": [1, 2, 3, 4], "gen_code": ["G1", "G2", "G3", "G4"], "gen_name": ["N1", "N2", "N3", "N4"],
+                               "gen_rate_power": [1000, 2000, 1000, 1000], "sta_id": [20, 20, 21, np.nan], "loc_output_capacity": [3000, 3000, np.nan, 1000]})
+    datetime_start = datetime(2021, 1, 1)
+    datetime_end = datetime(2021, 1, 2, 23, 59, 59)
+
+    result = calculate_client_alerts(None, 5, generators, datetime_start, datetime_end)
+
+    mock_get_client_settings.assert_called_once_with(None, 5)
+    mock_get_client_gen_datas_by_period.assert_called_once_with(None, 5, datetime_start, datetime_end, "1D", "15T")
+    mock_get_client_sta_datas_by_period.assert_called_once_with(None, 5, datetime_start, datetime_end, "1D", "15T")
+    rows = mock_insert_cli_gen_alerts.call_args.args[5]
+    assert mock_insert_cli_gen_alerts.call_args.args[:5] == (None, 5, [1, 2, 3], datetime_start, datetime_end)
+    assert result == {"client": 5, "locations": 3, "generators": 3, "count": len(rows), "error": None}
+
+    # The same alerts as computing each location on its own from the per location queries
+    expected_rows = []
+    for loc_id, gen_ids, sta_id, capacity in [(10, [1, 2], 20, 3000), (11, [3], 21, None)]:
+        with mock.patch("core.solar.get_gen_datas_by_period", return_value=gen_data[gen_data["gen_id"].isin(gen_ids)]), \
+                mock.patch("core.solar.get_sta_datas_by_period", return_value=sta_data[sta_data["sta_id"] == sta_id].drop(columns="sta_id")), \
+                mock.patch("core.solar.get_sta_id_by_loc_id", return_value=pd.DataFrame({"sta_id_auto": [sta_id]})), \
+                mock.patch("core.solar.get_loc_output_capacity", return_value=capacity), \
+                mock.patch("core.solar.get_gen_codes_and_names", return_value=generators.set_index("gen_id").loc[gen_ids, ["gen_code", "gen_name", "gen_rate_power"]]), \
+                mock.patch("core.solar.has_daily_rollups", return_value=False):
+            expected_rows.extend(get_location_alert_rows(None, 5, loc_id, gen_ids, datetime_start, datetime_end, (80, 6, 10, 90),
+                                                         rows[0]["cli_gen_alert_added"])[1])
+    assert rows == expected_rows
+    assert len(rows) > 0
+
+
+@mock.patch("app.core.solar_alerts.calculate_client_alerts")
+@mock.patch("app.core.solar_alerts.get_generators_by_client")
+def test_calculate_fleet_alerts(mock_get_generators_by_client, mock_calculate_client_alerts):
+    mock_get_generators_by_client.return_value = pd.DataFrame({"cli_id": [1, 2, 3, 4, 4], "loc_id": [1, 2, 3, 4, 5], "gen_id": [1, 2, 3, 4, 5]})
+    lock = threading.Lock()
+    running = []
+    max_running = []
+
+    def calculate_client(db, cli_id, generators, datetime_start, datetime_end):
+        with lock:
+            running.append(cli_id)
+            max_running.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(cli_id)
+        if cli_id == 3:
+            raise ValueError("failed")
+        return {"client": cli_id, "locations": len(generators), "generators": len(generators), "count": 1, "error": None}
+    mock_calculate_client_alerts.side_effect = calculate_client
+    session_factory = mock.Mock()
+
+    results = calculate_fleet_alerts(session_factory, datetime(2021, 1, 1), datetime(2021, 1, 31), cli_ids=[1, 2, 3, 4], max_workers=2)
+
+    mock_get_generators_by_client.assert_called_once_with(session_factory.return_value, [1, 2, 3, 4])
+    assert max(max_running) == 2
+    assert [result["client"] for result in results] == [1, 2, 3, 4]
+    assert results[2] == {"client": 3, "locations": 1, "generators": 0, "count": 0, "error": "ValueError('failed')"}
+    assert results[3]["locations"] == 2
+    assert session_factory.call_count == 5
+    assert session_factory.return_value.close.call_count == 5
+
+
+@pytest.mark.parametrize("evaluated_dates, new_data, expected", [
+    ({}, False, (datetime(2021, 1, 1), datetime(2021, 1, 10))),
+    ({1: datetime(2021, 1, 5), 2: datetime(2021, 1, 7)}, False, (datetime(2021, 1, 6), datetime(2021, 1, 10))),
+    ({1: datetime(2021, 1, 5)}, False, (datetime(2021, 1, 1), datetime(2021, 1, 10))),
+    ({1: datetime(2021, 1, 10), 2: datetime(2021, 1, 10)}, False, (datetime(2021, 1, 11), datetime(2021, 1, 10))),
+    ({1: datetime(2021, 1, 20)}, True, (datetime(2021, 1, 1), datetime(2021, 1, 11))),
+    ({1: datetime(2021, 1, 10)}, True, (datetime(2021, 1, 1), datetime(2021, 1, 10))),
+])
+def test_get_days_to_evaluate(evaluated_dates, new_data, expected):
+    assert get_days_to_evaluate(evaluated_dates, [1, 2], datetime(2021, 1, 1, 0, 0, 0), datetime(2021, 1, 10, 23, 45, 0), new_data) == expected
+
+
+@mock.patch("app.core.solar_alerts.update_alert_evaluated_dates")
+@mock.patch("app.core.solar_alerts.insert_cli_gen_alerts")
+@mock.patch("app.core.solar_alerts.get_location_alert_rows")
+@mock.patch("app.core.solar_alerts.get_client_settings")
+@mock.patch("app.core.solar_alerts.get_alert_evaluated_dates")
+def test_calculate_alerts_incrementally(mock_get_alert_evaluated_dates, mock_get_client_settings, mock_get_location_alert_rows,
+                                        mock_insert_cli_gen_alerts, mock_update_alert_evaluated_dates):
+    mock_get_alert_evaluated_dates.return_value = {1: datetime(2021, 1, 8), 2: datetime(2021, 1, 9)}
+    mock_get_client_settings.return_value = pd.DataFrame({"cli_set_value": []})
+    rows = [{"gen_id": 1, "cli_gen_alert_trigger": pd.Timestamp(2021, 1, 8)}, {"gen_id": 2, "cli_gen_alert_trigger": pd.Timestamp(2021, 1, 9)},
+            {"gen_id": 1, "cli_gen_alert_trigger": pd.Timestamp(2021, 1, 10)}]
+    mock_get_location_alert_rows.return_value = (mock.Mock(gen_ids=[1, 2]), rows)
+
+    result = calculate_alerts_incrementally(None, 5, 3, [1, 2], datetime(2021, 1, 1), datetime(2021, 1, 10, 23, 59, 59), new_data=False)
+
+    assert result == (5, 3, [1, 2], datetime(2021, 1, 9), datetime(2021, 1, 10, 23, 59, 59), 2)
+    assert mock_get_location_alert_rows.call_args.args[4:6] == (datetime(2021, 1, 8), datetime(2021, 1, 10, 23, 59, 59))
+    mock_insert_cli_gen_alerts.assert_called_once_with(None, 5, [1, 2], datetime(2021, 1, 9), datetime(2021, 1, 11), rows[1:])
+    mock_update_alert_evaluated_dates.assert_called_once_with(None, 5, [1, 2], datetime(2021, 1, 10))
+
+
+@mock.patch("app.core.solar_alerts.get_location_alert_rows")
+@mock.patch("app.core.solar_alerts.get_alert_evaluated_dates")
+def test_calculate_alerts_incrementally_already_evaluated(mock_get_alert_evaluated_dates, mock_get_location_alert_rows):
+    mock_get_alert_evaluated_dates.return_value = {1: datetime(2021, 1, 10)}
+
+    result = calculate_alerts_incrementally(None, 5, 3, [1], datetime(2021, 1, 1), datetime(2021, 1, 10, 23, 59, 59), new_data=False)
+
+    assert result[5] == 0
+    mock_get_location_alert_rows.assert_not_called()
+
+
+@pytest.mark.parametrize("new_data, expected_last_day", [(False, pd.Timestamp.now().normalize() - pd.Timedelta(days=1)),
+                                                         (True, pd.Timestamp.now().normalize())])
+def test_get_days_to_evaluate_until_yesterday(new_data, expected_last_day):
+    today = pd.Timestamp.now().normalize()
+
+    first_day, last_day = get_days_to_evaluate({}, [1], today - pd.Timedelta(days=3), today + pd.Timedelta(hours=12), new_data)
+
+    assert first_day == today - pd.Timedelta(days=3)
+    assert last_day == expected_last_day
+
+
+@mock.patch("app.core.solar_alerts.get_location_alert_rows")
+@mock.patch("app.core.solar_alerts.get_client_settings")
+@mock.patch("app.core.solar_alerts.get_alert_evaluated_dates")
+def test_calculate_alerts_incrementally_without_data(mock_get_alert_evaluated_dates, mock_get_client_settings, mock_get_location_alert_rows):
+    mock_get_alert_evaluated_dates.return_value = {}
+    mock_get_client_settings.return_value = pd.DataFrame({"cli_set_value": []})
+    mock_get_location_alert_rows.return_value = (mock.Mock(gen_ids=[1]), None)
+
+    with pytest.raises(HTTPException) as exception:
+        calculate_alerts_incrementally(None, 5, 3, [1], datetime(2021, 1, 1), datetime(2021, 1, 10, 23, 59, 59), new_data=False)
+    assert exception.value.status_code == 404
@@ -0,0 +1,99 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pandas as pd
+import pytest
+
+from app.core.solar_cache import SingleFlight, SolarDataCache
+
+
+def test_solar_data_cache_ttl():
+    cache = SolarDataCache(historical_ttl_seconds=100, recent_ttl_seconds=10)
+    data = pd.DataFrame({"ac_production": [1.0, 2.0]})
+    with mock.patch("time.monotonic", return_value=0):
+        cache.put("historical", data, datetime(2021, 1, 1, 23, 59, 59))
+        cache.put("recent", data, datetime.now() + timedelta(hours=1))
+    with mock.patch("time.monotonic", return_value=50):
+        pd.testing.assert_frame_equal(cache.get("historical"), data)
+        assert cache.get("recent") is None
+
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["evictions"] == {"expired": 1}
+
+
+def test_solar_data_cache_returns_copies():
+    cache = SolarDataCache()
+    data = pd.DataFrame({"ac_production": [1.0, 2.0]})
+    cache.put("key", data, datetime(2021, 1, 1))
+    data.loc[0, "ac_production"] = 10
+    cache.get("key").loc[1, "ac_production"] = 20
+
+    assert cache.get("key")["ac_production"].tolist() == [1.0, 2.0]
+
+
+def test_solar_data_cache_evicts_least_recently_used():
+    data = pd.DataFrame({"ac_production": [1.0] * 100})
+    size = int(data.memory_usage(deep=True).sum())
+    cache = SolarDataCache(max_entries=10, max_bytes=2 * size)
+    cache.put("first", data, datetime(2021, 1, 1))
+    cache.put("second", data, datetime(2021, 1, 1))
+    cache.get("first")
+    cache.put("third", data, datetime(2021, 1, 1))
+
+    assert cache.get("second") is None
+    assert cache.get("first") is not None
+    assert cache.get("third") is not None
+    assert cache.stats()["bytes"] == 2 * size
+
+    cache.put("too_big", pd.concat([data] * 3), datetime(2021, 1, 1))
+    assert cache.get("too_big") is None
+    assert cache.stats()["entries"] == 2
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    single_flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    function = mock.Mock(side_effect=lambda: started.set() or release.wait() and "result")
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        leader = executor.submit(single_flight.do, "key", function)
+        started.wait()
+        followers = [executor.submit(single_flight.do, "key", function) for _ in range(3)]
+        while single_flight.stats()["coalesced"] < 3:
+            pass
+        release.set()
+        results = [leader.result()] + [follower.result() for follower in followers]
+
+    assert results == ["result"] * 4
+    function.assert_called_once()
+    assert single_flight.stats() == {"in_flight": 0, "calls": 4, "coalesced": 3}
+    assert single_flight.do("key", lambda: "next") == "next"
+
+
+def test_single_flight_shares_exceptions():
+    single_flight = SingleFlight()
+
+    with pytest.raises(ValueError):
+        single_flight.do("key", mock.Mock(side_effect=ValueError("failed")))
+    assert single_flight.stats()["in_flight"] == 0
+
+
+def test_single_flight_do_async():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    function = mock.Mock(side_effect=lambda: release.wait() and "result")
+
+    async def run():
+        calls = asyncio.gather(*[single_flight.do_async("key", function) for _ in range(3)])
+        await asyncio.sleep(0)
+        release.set()
+        return await calls
+
+    assert asyncio.run(run()) == ["result"] * 3
+    function.assert_called_once()
+    assert single_flight.stats()["coalesced"] == 2
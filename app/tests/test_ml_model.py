@@ -0,0 +1,362 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from unittest import mock
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+import pytz
+from pysolar.solar import get_altitude
+
+from app.ml.model import (HOURLY_FEATURES, TARGET_COLUMN, CapacityModel, FeatureLayout, Model, ModelIndex, ModelRegistry,
+                          add_hourly_features, add_hours_since_last_rain, add_solar_zenith_angle,
+                          add_temporal_feature_engineering, expand_predictions,
+                          get_gens_hourly_features, predict_generators, resample_data)
+from app.ml.solar_position import SolarPositionCache, get_solar_altitude
+
+
+class IdentityScaler:
+    def transform(self, data):
+        return np.asarray(data, dtype=float)
+
+    def inverse_transform(self, data):
+        return data
+
+
+class SumModel:
+    def predict(self, data):
+        return data.sum(axis=1)
+
+
+def test_model_registry_loads_once_and_reloads_on_change(tmp_path):
+    path = str(tmp_path / "model.pkl")
+    Model(None, ["a"], None, None, 50).save(path)
+    registry = ModelRegistry()
+
+    model = registry.get(path)
+    assert registry.get(path) is model
+    assert registry.stats() == {"models": [path], "bytes": os.stat(path).st_size, "hits": 1, "loads": 1, "evictions": 0}
+
+    Model(None, ["a", "b"], None, None, 100).save(path)
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 1000000000))
+    reloaded = registry.get(path)
+
+    assert reloaded is not model
+    assert reloaded.trained_capacity == 100
+    assert registry.stats()["loads"] == 2
+
+
+def test_model_registry_evicts_least_recently_used(tmp_path):
+    paths = [str(tmp_path / f"model_{i}.pkl") for i in range(3)]
+    for path in paths:
+        Model(None, ["a"], None, None, 50).save(path)
+    registry = ModelRegistry(max_models=2, max_bytes=None)
+
+    first = registry.get(paths[0])
+    registry.get(paths[1])
+    registry.get(paths[0])
+    registry.get(paths[2])
+
+    assert registry.stats()["models"] == [paths[0], paths[2]]
+    assert registry.stats()["evictions"] == 1
+    assert registry.get(paths[0]) is first
+
+    registry = ModelRegistry(max_models=None, max_bytes=os.stat(paths[0]).st_size * 2 - 1)
+    registry.get(paths[0])
+    registry.get(paths[1])
+    assert registry.stats()["models"] == [paths[1]]
+
+
+def test_model_registry_loads_outside_the_lock(tmp_path):
+    paths = [str(tmp_path / f"model_{i}.pkl") for i in range(2)]
+    for path in paths:
+        Model(None, ["a"], None, None, 50).save(path)
+    registry = ModelRegistry()
+    loaded = registry.get(paths[0])
+    started = threading.Event()
+    release = threading.Event()
+    load = joblib.load
+
+    def slow_load(*args, **kwargs):
+        started.set()
+        release.wait(5)
+        return load(*args, **kwargs)
+
+    with mock.patch("app.ml.model.joblib.load", side_effect=slow_load) as mock_load:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(registry.get, paths[1]) for _ in range(2)]
+            assert started.wait(5)
+            # The model already loaded is returned while the other file is being read
+            assert registry.get(paths[0]) is loaded
+            release.set()
+            models = [future.result() for future in futures]
+
+    assert models[0] is models[1]
+    assert mock_load.call_count == 1
+    assert registry.get(paths[1]) is models[0]
+    assert registry.stats()["loads"] == 2
+
+
+def test_model_index_falls_back_to_global_model(tmp_path):
+    default_path = str(tmp_path / "global.pkl")
+    Model(None, ["a"], None, None, 50).save(default_path)
+    directory = tmp_path / "locations"
+    directory.mkdir()
+    Model(None, ["a"], None, None, 10).save(str(directory / "1_2.pkl"))
+    index = ModelIndex(str(directory), default_path, ModelRegistry())
+
+    assert index.get(1, 2, 20).trained_capacity == 10
+    assert index.get(1, 3, 20).trained_capacity == 50
+    assert index.get(1, 3, 20).prediction_capacity == 20
+    assert index.locations() == [(1, 2)]
+
+
+def test_capacity_model_does_not_change_shared_model():
+    model = Model(SumModel(), ["a", "b"], IdentityScaler(), IdentityScaler(), 4000)
+    data = pd.DataFrame({"a": [1000.0, np.nan], "b": [1000.0, 1.0]}, index=[datetime(2021, 1, 1, 10), datetime(2021, 1, 1, 11)])
+
+    small = CapacityModel(model, 2000)
+    large = CapacityModel(model, 8000)
+
+    assert small.predict(data)["Prediction"].tolist() == [0.25]
+    assert large.predict(data)["Prediction"].tolist() == [1.0]
+    assert small.features == ["a", "b"]
+    assert model.prediction_capacity is None
+
+
+def test_add_hours_since_last_rain():
+    df = pd.DataFrame({"Precipitation Total": [0.0, 1.0, 0.0, np.nan, 2.0, 0.0]}, index=pd.date_range("2021-01-01", periods=6, freq="1H"))
+
+    result = add_hours_since_last_rain(df)["Hours Since Last Rain"]
+
+    assert result.tolist() == [0, 0, 1, 2, 0, 1]
+    assert result.dtype == "int64"
+
+
+def test_add_hours_since_last_rain_fractional_hours():
+    df = pd.DataFrame({"Precipitation Total": [0.0, 1.0, 0.0, 0.0]}, index=pd.date_range("2021-01-01", periods=4, freq="15T"))
+
+    result = add_hours_since_last_rain(df)["Hours Since Last Rain"]
+
+    assert result.tolist() == [0.0, 0.0, 0.25, 0.5]
+    assert result.dtype == "float64"
+
+
+@pytest.mark.parametrize("latitude, longitude, timezone", [
+    (-34.9, -56.2, "America/Montevideo"),
+    (40.7, -74.0, "America/New_York"),
+    (69.6, 18.9, "Europe/Oslo"),
+    (1.35, 103.8, "Asia/Singapore"),
+])
+def test_get_solar_altitude_matches_pysolar(latitude, longitude, timezone):
+    index = pd.date_range("2023-01-01", "2023-12-31 23:00", freq="7H")
+    tz = pytz.timezone(timezone)
+    expected = [get_altitude(latitude, longitude, tz.localize(time.to_pydatetime())) for time in index]
+
+    np.testing.assert_allclose(get_solar_altitude(latitude, longitude, index, timezone), expected, rtol=0, atol=1e-4)
+
+
+def test_get_solar_altitude_ambiguous_and_missing_local_times():
+    tz = pytz.timezone("America/New_York")
+    times = [datetime(2023, 3, 12, 2, 30), datetime(2023, 11, 5, 1, 30)]
+    expected = [get_altitude(40.7, -74.0, tz.localize(time)) for time in times]
+
+    np.testing.assert_allclose(get_solar_altitude(40.7, -74.0, pd.DatetimeIndex(times), "America/New_York"), expected, rtol=0, atol=1e-4)
+
+
+def test_solar_position_cache():
+    cache = SolarPositionCache(max_entries=1)
+    index = pd.date_range("2023-01-01", periods=24, freq="1H")
+
+    altitude = cache.get_solar_altitude(-34.9, -56.2, index, "America/Montevideo")
+    assert cache.get_solar_altitude(-34.9, -56.2, index.copy(), "America/Montevideo") is altitude
+    assert not altitude.flags.writeable
+    cache.get_solar_altitude(-34.9, -56.2, index, "America/Sao_Paulo")
+    cache.get_solar_altitude(-34.9, -56.2, index, "America/Montevideo")
+
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 3}
+
+
+def test_add_solar_zenith_angle_uses_location_timezone():
+    df = pd.DataFrame({"a": np.zeros(24)}, index=pd.date_range("2023-06-01", periods=24, freq="1H"))
+
+    default = add_solar_zenith_angle(df.copy(), 40.7, -74.0)["Solar Zenith Angle"]
+    new_york = add_solar_zenith_angle(df.copy(), 40.7, -74.0, "America/New_York")["Solar Zenith Angle"]
+
+    assert default.idxmax() == pd.Timestamp("2023-06-01 14:00")
+    assert new_york.idxmax() == pd.Timestamp("2023-06-01 13:00")
+
+
+def test_predict_generators_calls_the_model_once():
+    model = Model(mock.Mock(), ["a"], IdentityScaler(), IdentityScaler(), 4000)
+    model.cat_boost_model.predict.side_effect = lambda data: data.sum(axis=1)
+    capacity_model = CapacityModel(model, 4000)
+    model_dfs = {1: pd.DataFrame({"a": [1000.0, 2000.0]}, index=[datetime(2021, 1, 1, 10), datetime(2021, 1, 1, 11)]),
+                 2: pd.DataFrame({"a": [3000.0]}, index=[datetime(2021, 1, 1, 10)])}
+
+    with mock.patch.object(CapacityModel, "generate_input", side_effect=lambda lat, lng, data, timezone: data):
+        prediction = predict_generators(capacity_model, -34.9, -56.2, model_dfs)
+
+    model.cat_boost_model.predict.assert_called_once()
+    assert prediction.index.tolist() == [(1, datetime(2021, 1, 1, 10)), (1, datetime(2021, 1, 1, 11)), (2, datetime(2021, 1, 1, 10))]
+    assert prediction["Prediction"].tolist() == [0.25, 0.5, 0.75]
+
+
+def test_expand_predictions_of_several_generators():
+    prediction = pd.DataFrame({"Prediction": [0.5, 0.7]},
+                              index=pd.MultiIndex.from_tuples([(1, datetime(2021, 1, 1, 11)), (2, datetime(2021, 1, 1, 11))], names=["gen_id", "data_date"]))
+    dates = pd.date_range("2021-01-01 10:15", "2021-01-01 11:00", freq="15T")
+    gens_df = pd.DataFrame({"Generated Power": [0.1234, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7], "data_pro_id": 9},
+                           index=pd.MultiIndex.from_tuples([(1, date) for date in dates] + [(2, date) for date in dates[1:]], names=["gen_id", "data_date"]))
+
+    df = expand_predictions(prediction, gens_df)
+
+    assert df.columns.tolist() == ["gen_id", "data_date", "data_value", "data_pro_id", "actual"]
+    assert list(zip(df["gen_id"], df["data_date"])) == [(1, date) for date in dates] + [(2, date) for date in dates[1:]]
+    assert df["data_value"].tolist() == [0.5] * 4 + [0.7] * 3
+    assert df["actual"].tolist()[0] == 0.123
+
+
+def test_expand_predictions():
+    prediction = pd.DataFrame({"Prediction": [0.5, 0.7]}, index=[datetime(2021, 1, 1, 11), datetime(2021, 1, 1, 12)])
+    index = pd.date_range("2021-01-01 10:15", "2021-01-01 12:00", freq="15T").drop(pd.Timestamp("2021-01-01 11:30"))
+    df = pd.DataFrame({"Generated Power": np.arange(7) / 10, "data_pro_id": 9.0}, index=index)
+
+    predictions = expand_predictions(prediction, df)
+
+    assert predictions.columns.tolist() == ["data_date", "data_value", "data_pro_id", "actual"]
+    assert predictions["data_date"].tolist() == df.index.tolist()
+    assert predictions["data_value"].tolist() == [0.5] * 4 + [0.7] * 3
+    assert predictions["actual"].tolist() == df["Generated Power"].tolist()
+
+
+def test_feature_layout_matches_temporal_feature_engineering():
+    features = (["Temperature", "day"] + [f"season_{i}" for i in range(4)] + [f"month_{i}" for i in range(1, 13)]
+                + [f"hour_{i}" for i in range(24)] + ["Solar Zenith Angle"])
+    df = pd.DataFrame({"Temperature": [20.5, np.nan, 10.0], "Solar Zenith Angle": [1.0, 2.0, 3.0]},
+                      index=[datetime(2021, 12, 31, 23), datetime(2021, 3, 15, 0), datetime(2021, 7, 4, 12)])
+
+    result = FeatureLayout(tuple(features)).build(df.copy())
+    expected = add_temporal_feature_engineering(df.copy())[features]
+
+    assert result.columns.tolist() == features
+    assert (result.dtypes == np.float32).all()
+    assert result.index.equals(df.index)
+    np.testing.assert_array_equal(result.to_numpy(), expected.to_numpy(dtype=np.float32))
+
+
+def test_predict_array_folds_standard_scalers():
+    from sklearn.preprocessing import StandardScaler
+    rng = np.random.default_rng(0)
+    x = rng.random((50, 3)).astype(np.float32)
+    x_scaler = StandardScaler().fit(x * 10)
+    y_scaler = StandardScaler().fit(rng.random((50, 1)) * 1000)
+    model = Model(mock.Mock(), ["a", "b", "c"], x_scaler, y_scaler, 4000)
+    model.cat_boost_model.predict.side_effect = lambda data: data.sum(axis=1)
+
+    prediction = CapacityModel(model, 2000).predict_array(x)
+
+    scaled = model.cat_boost_model.predict.call_args.args[0]
+    assert scaled.dtype == np.float32 and scaled.flags.c_contiguous
+    np.testing.assert_allclose(scaled, x_scaler.transform(x), atol=1e-6)
+    expected = y_scaler.inverse_transform(x_scaler.transform(x).sum(axis=1).reshape(-1, 1))[:, 0] * 2000 / 4000
+    np.testing.assert_allclose(prediction, np.round(np.maximum(expected, 0) / 4000, 3), atol=1e-3)
+    assert CapacityModel(model, 2000).predict_array(np.empty((0, 3))).shape == (0,)
+
+
+def get_quarter_hourly_data(start, periods, data_pro_id):
+    index = pd.date_range(start, periods=periods, freq="15T")
+    rng = np.random.default_rng(periods)
+    return pd.DataFrame({"Generated Power": rng.random(periods) / 100, "data_pro_id": data_pro_id, "Temperature": rng.random(periods) * 30,
+                         "Precipitation Total": np.where(np.arange(periods) % 17 == 0, 1.0, 0.0), "Cloud Cover Total": rng.random(periods) * 100,
+                         "Shortwave Radiation": rng.random(periods)}, index=index)
+
+
+def test_add_hourly_features_follows_the_stored_hour():
+    df = get_quarter_hourly_data("2023-01-01 00:15", 24, 1)
+    df["Precipitation Total"] = np.where(np.arange(24) == 13, 1.0, 0.0)
+    df = resample_data(df)
+    context = pd.Series({"Generated Power": 0.5, "Precipitation Total": 0.0, "Hours Since Last Rain": 3.0}, name=pd.Timestamp("2022-12-31 23:00"))
+
+    result = add_hourly_features(df.copy(), -34.9, -56.2, "America/Montevideo", context)
+
+    assert result["Generated Power 1 Hour Lag"].tolist()[:2] == [0.5, df["Generated Power"].iloc[0]]
+    assert result["Hours Since Last Rain"].tolist() == [5.0, 6.0, 7.0, 0.0, 1.0, 2.0]
+
+
+def test_get_gens_hourly_features_computes_only_new_hours():
+    day = get_quarter_hourly_data("2023-01-01 00:15", 96, 1)
+    batch = get_quarter_hourly_data("2023-01-02 00:15", 96, 2)
+    expected = add_hourly_features(resample_data(pd.concat([day, batch])), -34.9, -56.2, "America/Montevideo")[HOURLY_FEATURES]
+    stored = expected.loc[:"2023-01-02 00:00"].assign(data_pro_id=1)
+
+    with mock.patch("app.ml.model.get_gens_features", return_value=pd.concat({5: stored.loc["2023-01-01 22:00":]}, names=["gen_id", "data_date"])), \
+            mock.patch("app.ml.model.get_last_gens_features", return_value=pd.concat({5: stored.iloc[[-1]]}, names=["gen_id", "data_date"])) as mock_get_last, \
+            mock.patch("app.ml.model.insert_or_update_gens_features") as mock_insert:
+        features = get_gens_hourly_features(None, 1, 2, {5: pd.concat([day.iloc[-8:], batch])}, -34.9, -56.2, "America/Montevideo", 2)
+
+    assert mock_get_last.call_args.args[2:] == ([5], pd.Timestamp("2023-01-02 01:00"))
+    written = mock_insert.call_args.args[3]
+    assert written.index.get_level_values("data_date").tolist() == expected.loc["2023-01-02 01:00":].index.tolist()
+    assert (written["data_pro_id"] == 2).all()
+    pd.testing.assert_frame_equal(features[5], expected.loc["2023-01-01 23:00":], check_freq=False, check_dtype=False)
+
+
+def test_get_gens_hourly_features_computes_hours_written_again():
+    day = get_quarter_hourly_data("2023-01-01 00:15", 96, 1)
+    stored = add_hourly_features(resample_data(day.copy()), -34.9, -56.2, "America/Montevideo")[HOURLY_FEATURES].assign(data_pro_id=1)
+    # The rows of the 10:00 hour are written again by batch 3
+    reingested = day.copy()
+    reingested.loc["2023-01-01 09:15":"2023-01-01 10:00", "Generated Power"] *= 2
+    reingested.loc["2023-01-01 09:15":"2023-01-01 10:00", "data_pro_id"] = 3
+    expected = add_hourly_features(resample_data(reingested.copy()), -34.9, -56.2, "America/Montevideo")[HOURLY_FEATURES]
+
+    with mock.patch("app.ml.model.get_gens_features", return_value=pd.concat({5: stored}, names=["gen_id", "data_date"])), \
+            mock.patch("app.ml.model.get_last_gens_features", return_value=pd.concat({5: stored.loc[["2023-01-01 09:00"]]}, names=["gen_id", "data_date"])) as mock_get_last, \
+            mock.patch("app.ml.model.insert_or_update_gens_features") as mock_insert:
+        features = get_gens_hourly_features(None, 1, 2, {5: reingested}, -34.9, -56.2, "America/Montevideo")
+
+    assert mock_get_last.call_args.args[2:] == ([5], pd.Timestamp("2023-01-01 10:00"))
+    written = mock_insert.call_args.args[3]
+    assert written.index.get_level_values("data_date")[0] == pd.Timestamp("2023-01-01 10:00")
+    assert written["data_pro_id"].tolist()[:2] == [3, 1]
+    pd.testing.assert_frame_equal(features[5], expected, check_freq=False, check_dtype=False)
+
+
+def test_get_gens_hourly_features_ignores_a_stored_hour_before_a_gap():
+    january = get_quarter_hourly_data("2023-01-01 00:15", 96, 1)
+    stored = add_hourly_features(resample_data(january.copy()), -34.9, -56.2, "America/Montevideo")[HOURLY_FEATURES].assign(data_pro_id=1)
+    june = get_quarter_hourly_data("2023-06-01 00:15", 96, 2)
+    june["Precipitation Total"] = 0.0
+    expected = add_hourly_features(resample_data(june.copy()), -34.9, -56.2, "America/Montevideo")[HOURLY_FEATURES]
+
+    with mock.patch("app.ml.model.get_gens_features", return_value=pd.concat({5: stored.iloc[:0]}, names=["gen_id", "data_date"])), \
+            mock.patch("app.ml.model.get_last_gens_features", return_value=pd.concat({5: stored.iloc[[-1]]}, names=["gen_id", "data_date"])), \
+            mock.patch("app.ml.model.insert_or_update_gens_features") as mock_insert:
+        features = get_gens_hourly_features(None, 1, 2, {5: june}, -34.9, -56.2, "America/Montevideo")
+
+    pd.testing.assert_frame_equal(features[5], expected, check_freq=False, check_dtype=False)
+    assert features[5]["Hours Since Last Rain"].max() < 24
+    assert np.isnan(features[5][f"{TARGET_COLUMN} 1 Hour Lag"].iloc[0])
+    written = mock_insert.call_args.args[3]
+    assert written.index.get_level_values("data_date").tolist() == expected.index.tolist()
+
+
+def test_get_gens_hourly_features_computes_the_window_after_a_gap_in_it():
+    day = get_quarter_hourly_data("2023-01-01 00:15", 96, 1)
+    # The 04:00 hour has no data, so the store has no row for it
+    day = day.drop(day.loc["2023-01-01 03:15":"2023-01-01 04:00"].index)
+    expected = add_hourly_features(resample_data(day.copy()), -34.9, -56.2, "America/Montevideo")[HOURLY_FEATURES]
+    stored = expected.loc[:"2023-01-01 03:00"].assign(data_pro_id=1)
+
+    with mock.patch("app.ml.model.get_gens_features", return_value=pd.concat({5: stored}, names=["gen_id", "data_date"])), \
+            mock.patch("app.ml.model.get_last_gens_features", return_value=pd.concat({5: stored.iloc[[-1]]}, names=["gen_id", "data_date"])) as mock_get_last, \
+            mock.patch("app.ml.model.insert_or_update_gens_features") as mock_insert:
+        features = get_gens_hourly_features(None, 1, 2, {5: day}, -34.9, -56.2, "America/Montevideo")
+
+    assert mock_get_last.call_args.args[2:] == ([5], pd.Timestamp("2023-01-01 05:00"))
+    pd.testing.assert_frame_equal(features[5], expected, check_freq=False, check_dtype=False)
+    assert mock_insert.call_args.args[3].index.get_level_values("data_date")[0] == pd.Timestamp("2023-01-01 01:00")
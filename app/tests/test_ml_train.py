@@ -0,0 +1,95 @@
+import os
+import sys
+from unittest import mock
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.ml.model import Model
+from app.ml.train import (TRAINING_DATA_PATH, TRAINING_LATITUDE, get_feature_order, get_location_settings, get_training_data, iter_features,
+                          parse_args, save_model)
+
+pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def training_data_path(tmp_path):
+    index = pd.date_range("2021-01-01", periods=24 * 40, freq="1H", name="index")
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"Temperature": rng.random(len(index)) * 30,
+                       "Precipitation Total": np.where(rng.random(len(index)) > 0.97, 1.0, 0.0),
+                       "Relative Humidity": rng.random(len(index)),
+                       "Cloud Cover Total": rng.random(len(index)) * 100,
+                       "Shortwave Radiation": rng.random(len(index)) * 200,
+                       "Generated Power": rng.random(len(index)) * 1000}, index=index)
+    df.loc[df.index[5], "Generated Power"] = 0.0
+    df.loc[df.index[5], "Shortwave Radiation"] = 150.0
+    path = str(tmp_path / "training.parquet")
+    df.to_parquet(path, row_group_size=24 * 7)
+    return path
+
+
+def test_iter_features_batches_match_the_whole_file(training_data_path):
+    batches = list(iter_features(training_data_path, -34.68, -55.82, "America/Montevideo", batch_size=50))
+    whole = list(iter_features(training_data_path, -34.68, -55.82, "America/Montevideo", batch_size=10000))
+
+    assert len(batches) > len(whole)
+    features = get_feature_order(list(whole[0][0].columns))
+    pd.testing.assert_frame_equal(pd.concat([x[features] for x, _ in batches]), whole[0][0][features], check_dtype=False)
+    pd.testing.assert_series_equal(pd.concat([y for _, y in batches]), whole[0][1])
+    assert pd.Timestamp("2021-01-01 05:00") not in whole[0][1].index
+
+
+def test_get_training_data(training_data_path):
+    x, y = get_training_data(training_data_path, -34.68, -55.82, "America/Montevideo", batch_size=100)
+
+    assert x.dtypes.eq(np.float32).all()
+    assert x.columns[:5].tolist() == ["Temperature", "Precipitation Total", "Cloud Cover Total", "Shortwave Radiation", "day"]
+    assert x.columns[-3:].tolist() == ["Generated Power 1 Hour Lag", "Hours Since Last Rain", "Solar Zenith Angle"]
+    assert x.index.equals(y.index)
+    assert "Relative Humidity" not in x.columns
+
+
+def test_parse_args_defaults_to_the_training_plant():
+    with mock.patch.object(sys, "argv", ["train", "--output", "model.pkl"]):
+        args = parse_args()
+
+    assert args.data == TRAINING_DATA_PATH
+    assert args.latitude == TRAINING_LATITUDE
+
+
+@pytest.mark.parametrize("argv", [["--client", "1", "--location", "2"],
+                                  ["--client", "1", "--location", "2", "--data", "data.parquet", "--latitude", "-30"]])
+def test_parse_args_for_a_location_should_fail(argv):
+    with mock.patch.object(sys, "argv", ["train"] + argv), pytest.raises(SystemExit):
+        parse_args()
+
+
+@mock.patch("app.ml.train.get_location_timezone", return_value="America/Argentina/Buenos_Aires")
+@mock.patch("app.ml.train.get_location")
+def test_get_location_settings(mock_get_location, mock_get_location_timezone):
+    mock_get_location.return_value = mock.Mock(loc_coord_lat=-31.5, loc_coord_lng=-60.2, loc_output_total_capacity=12.5)
+
+    assert get_location_settings(None, 1, 2) == (-31.5, -60.2, "America/Argentina/Buenos_Aires", 12.5)
+    mock_get_location.assert_called_once_with(None, 2, 1)
+    mock_get_location_timezone.assert_called_once_with(None, 2)
+
+    mock_get_location.return_value = None
+    with pytest.raises(ValueError):
+        get_location_settings(None, 1, 3)
+
+
+def test_save_model_replaces_the_file(tmp_path):
+    path = str(tmp_path / "models" / "1_2.pkl")
+    save_model(Model(None, ["a"], None, None, 50), path)
+    save_model(Model(None, ["a"], None, None, 100), path)
+
+    assert os.listdir(tmp_path / "models") == ["1_2.pkl"]
+    assert os.stat(path).st_mode & 0o044
+
+    with mock.patch.object(Model, "save", side_effect=OSError("disk full")), pytest.raises(OSError):
+        save_model(Model(None, ["a"], None, None, 10), path)
+    assert os.listdir(tmp_path / "models") == ["1_2.pkl"]
+    assert joblib.load(path).trained_capacity == 100
@@ -3,8 +3,11 @@ from unittest import mock
 
 import numpy as np
 import pandas as pd
+import pytest
 
 from app.core.solar import Solar
+from core.solar_cache import solar_data_cache
+from db.utils import get_period_end
 
 
 @mock.patch("app.core.solar.get_gen_ids_by_loc_id")
@@ -363,3 +366,380 @@ def test_solar_fetch_aggregated_by_loc_and_period(mock_get_sta_datas_grouped, mo
     assert solar.data_aggregated_by_loc_and_period["specific_yield"].loc[pd.Timestamp('2021-01-01 01:00:00')] == 0
     assert solar.data_aggregated_by_loc_and_period["from"].loc[pd.Timestamp('2021-01-01 01:00:00')] == pd.Timestamp('2021-01-01 01:00:00')
     assert solar.data_aggregated_by_loc_and_period["to"].loc[pd.Timestamp('2021-01-01 01:00:00')] == pd.Timestamp('2021-01-01 01:59:59')
+
+
+def _get_gen_slots():
+    gen_slots = pd.DataFrame({
+        "gen_id": [1, 1, 1, 1, 2, 2, 2, 2],
+        "data_date": [datetime(2021, 1, 1, 0, 0, 0),
+                      datetime(2021, 1, 1, 0, 15, 0),
+                      datetime(2021, 1, 1, 1, 30, 0),
+                      datetime(2021, 1, 2, 12, 0, 0),
+                      datetime(2021, 1, 1, 0, 15, 0),
+                      datetime(2021, 1, 1, 0, 30, 0),
+                      datetime(2021, 1, 1, 2, 0, 0),
+                      datetime(2021, 1, 2, 23, 45, 0)],
+        "power": [10, 0, np.nan, 40, 30, np.nan, 50, 60],
+        "ac_production": [15, 25, 35, np.nan, 35, 45, np.nan, 65],
+        "ac_production_prediction": [11, 22, 33, np.nan, 33, 44, 55, np.nan]
+    })
+    sta_slots = pd.DataFrame({
+        "data_date": [datetime(2021, 1, 1, 0, 0, 0),
+                      datetime(2021, 1, 1, 0, 15, 0),
+                      datetime(2021, 1, 1, 0, 30, 0),
+                      datetime(2021, 1, 1, 2, 0, 0),
+                      datetime(2021, 1, 2, 12, 0, 0)],
+        "avg_ambient_temp": [1, 2, 3, 4, 5],
+        "avg_module_temp": [10, 20, 30, 40, 50],
+        "irradiation": [50, 60, 0, 70, 80]
+    })
+    return gen_slots, sta_slots
+
+
+def _aggregate_slots_by_period(gen_slots, sta_slots, freq, last_data_date):
+    # Same aggregation get_gen_datas_by_period and get_sta_datas_by_period ask the database for
+    gen = gen_slots.copy()
+    gen["power"] = gen_slots["power"].fillna(gen_slots["ac_production"])
+    gen["ac_production"] = gen_slots["ac_production"].fillna(gen_slots["power"])
+    gen = gen.merge(sta_slots[["data_date", "irradiation"]], on="data_date", how="left")
+    gen["unavailable"] = (gen["power"] == 0) & (gen["irradiation"] > 0)
+    gen["last_ac_production"] = gen["ac_production"].where(gen["data_date"] == last_data_date)
+    gen_keys = ["gen_id", pd.Grouper(key="data_date", freq=freq)] if freq else ["gen_id"]
+    gen = gen.groupby(gen_keys).agg(power=("power", "sum"), ac_production=("ac_production", "sum"),
+                                    ac_production_prediction=("ac_production_prediction", "sum"), data_count=("power", "count"),
+                                    unavailable_count=("unavailable", "sum"), last_ac_production=("last_ac_production", "sum")).reset_index()
+    if freq:
+        sta = sta_slots.groupby(pd.Grouper(key="data_date", freq=freq)).agg(
+            {"avg_ambient_temp": "mean", "avg_module_temp": "mean", "irradiation": "sum"}).reset_index()
+    else:
+        sta = sta_slots.agg({"avg_ambient_temp": "mean", "avg_module_temp": "mean", "irradiation": "sum"}).to_frame().T
+    return gen, sta
+
+
+@pytest.mark.parametrize("freq,datetime_end", [("1H", datetime(2021, 1, 1, 2, 0, 0)),
+                                               ("1D", datetime(2021, 1, 2, 23, 59, 59)),
+                                               (None, datetime(2021, 1, 2, 23, 59, 59))])
+@mock.patch("app.core.solar.get_gen_ids_by_loc_id")
+@mock.patch("app.core.solar.get_sta_id_by_loc_id")
+@mock.patch("app.core.solar.get_loc_output_capacity")
+@mock.patch("app.core.solar.get_gen_codes_and_names")
+@mock.patch("app.core.solar.get_gen_datas_grouped")
+@mock.patch("app.core.solar.get_sta_datas_grouped")
+@mock.patch("app.core.solar.get_gen_datas_by_period")
+@mock.patch("app.core.solar.get_sta_datas_by_period")
+@mock.patch("app.core.solar.get_gen_rollups_by_period")
+@mock.patch("app.core.solar.get_sta_rollups_by_period")
+def test_solar_fetch_aggregated_by_period_in_db(mock_get_sta_rollups_by_period, mock_get_gen_rollups_by_period, mock_get_sta_datas_by_period, mock_get_gen_datas_by_period,
+                                                mock_get_sta_datas_grouped, mock_get_gen_datas_grouped, mock_get_gen_codes_and_names, mock_get_loc_output_capacity,
+                                                mock_get_sta_id_by_loc_id, mock_get_gen_ids_by_loc_id, freq, datetime_end):
+    mock_get_gen_ids_by_loc_id.return_value = pd.DataFrame({"gen_id_auto": [1, 2]})
+    mock_get_sta_id_by_loc_id.return_value = pd.DataFrame({"sta_id_auto": [1]})
+    mock_get_loc_output_capacity.return_value = 1000
+    mock_get_gen_codes_and_names.return_value = pd.DataFrame({
+        "gen_code": ["code_1", "code_2"],
+        "gen_name": ["name_1", "name_2"],
+        "gen_rate_power": [1000, 2000]
+    }, index=[1, 2])
+
+    datetime_start = datetime(2021, 1, 1, 0, 0, 0)
+    gen_slots, sta_slots = _get_gen_slots()
+    gen_slots = gen_slots[gen_slots["data_date"] <= datetime_end]
+    sta_slots = sta_slots[sta_slots["data_date"] <= datetime_end]
+    mock_get_gen_datas_grouped.return_value = gen_slots.set_index(["gen_id", "data_date"])
+    mock_get_sta_datas_grouped.return_value = sta_slots.assign(sta_id=1).set_index(["data_date", "sta_id"])
+    last_data_date = pd.date_range(datetime_start, datetime_end, freq="15T")[-1]
+    gen_by_period, sta_by_period = _aggregate_slots_by_period(gen_slots, sta_slots, freq, last_data_date)
+    mock_get_gen_datas_by_period.return_value = gen_by_period
+    mock_get_sta_datas_by_period.return_value = sta_by_period
+    # Rollups not refreshed yet
+    mock_get_gen_rollups_by_period.return_value = pd.DataFrame({"gen_id": [], "day_count": []})
+    mock_get_sta_rollups_by_period.return_value = pd.DataFrame({"day_count": []})
+
+    expected = Solar(None, 1, 1, None, None, datetime_start, datetime_end, freq)
+    expected.fetch_aggregated_by_period(None)
+    solar = Solar(None, 1, 1, None, None, datetime_start, datetime_end, freq, aggregate_in_db=True)
+    solar.fetch_aggregated_by_period(None)
+
+    mock_get_gen_datas_by_period.assert_called_once()
+    assert solar.data is None
+    pd.testing.assert_frame_equal(solar.data_aggregated_by_period, expected.data_aggregated_by_period, check_dtype=False, check_freq=False)
+
+
+@pytest.mark.parametrize("dashboard", [False, True])
+@pytest.mark.parametrize("freq", ["1D", "1MS", None])
+@mock.patch("app.core.solar.has_daily_rollups", return_value=True)
+@mock.patch("app.core.solar.get_gen_ids_by_loc_id")
+@mock.patch("app.core.solar.get_sta_id_by_loc_id")
+@mock.patch("app.core.solar.get_loc_output_capacity")
+@mock.patch("app.core.solar.get_gen_codes_and_names")
+@mock.patch("app.core.solar.get_gen_datas_grouped")
+@mock.patch("app.core.solar.get_sta_datas_grouped")
+@mock.patch("app.core.solar.get_gen_datas_by_period")
+@mock.patch("app.core.solar.get_sta_datas_by_period")
+@mock.patch("app.core.solar.get_gen_rollups_by_period")
+@mock.patch("app.core.solar.get_sta_rollups_by_period")
+def test_solar_fetch_aggregated_by_period_from_rollups(mock_get_sta_rollups_by_period, mock_get_gen_rollups_by_period, mock_get_sta_datas_by_period, mock_get_gen_datas_by_period,
+                                                       mock_get_sta_datas_grouped, mock_get_gen_datas_grouped, mock_get_gen_codes_and_names, mock_get_loc_output_capacity,
+                                                       mock_get_sta_id_by_loc_id, mock_get_gen_ids_by_loc_id, mock_has_daily_rollups, freq, dashboard):
+    mock_get_gen_ids_by_loc_id.return_value = pd.DataFrame({"gen_id_auto": [1, 2]})
+    mock_get_sta_id_by_loc_id.return_value = pd.DataFrame({"sta_id_auto": [1]})
+    mock_get_loc_output_capacity.return_value = 1000
+    mock_get_gen_codes_and_names.return_value = pd.DataFrame({
+        "gen_code": ["code_1", "code_2"],
+        "gen_name": ["name_1", "name_2"],
+        "gen_rate_power": [1000, 2000]
+    }, index=[1, 2])
+
+    datetime_start = datetime(2021, 1, 1, 0, 0, 0)
+    datetime_end = datetime(2021, 1, 2, 23, 59, 59)
+    gen_slots, sta_slots = _get_gen_slots()
+    mock_get_gen_datas_grouped.return_value = gen_slots.set_index(["gen_id", "data_date"])
+    mock_get_sta_datas_grouped.return_value = sta_slots.assign(sta_id=1).set_index(["data_date", "sta_id"])
+    gen_by_period, sta_by_period = _aggregate_slots_by_period(gen_slots, sta_slots, freq, datetime(2021, 1, 2, 23, 45, 0))
+    # Every generator has data on both days, so each row of a period covers all of its days
+    days = 1 if freq == "1D" else 2
+    mock_get_gen_rollups_by_period.return_value = gen_by_period.assign(day_count=days)
+    mock_get_sta_rollups_by_period.return_value = sta_by_period.assign(day_count=days)
+
+    expected = Solar(None, 1, 1, None, None, datetime_start, datetime_end, freq)
+    expected.fetch_aggregated_by_period(None)
+    mock_get_gen_datas_grouped.reset_mock()
+    if dashboard:
+        solar = Solar(None, 1, 1, None, None, datetime_start, datetime_end, freq, use_cache=True, chunksize=3, use_rollups=True)
+    else:
+        solar = Solar(None, 1, 1, None, None, datetime_start, datetime_end, freq, aggregate_in_db=True, use_rollups=True)
+    solar.fetch_aggregated_by_period(None)
+
+    mock_get_gen_rollups_by_period.assert_called_once()
+    mock_get_gen_datas_by_period.assert_not_called()
+    mock_get_gen_datas_grouped.assert_not_called()
+    pd.testing.assert_frame_equal(solar.data_aggregated_by_period, expected.data_aggregated_by_period, check_dtype=False, check_freq=False)
+
+
+@mock.patch("app.core.solar.has_daily_rollups")
+@mock.patch("app.core.solar.get_gen_ids_by_loc_id")
+@mock.patch("app.core.solar.get_sta_id_by_loc_id")
+@mock.patch("app.core.solar.get_loc_output_capacity")
+@mock.patch("app.core.solar.get_gen_codes_and_names")
+def test_solar_can_use_rollups(mock_get_gen_codes_and_names, mock_get_loc_output_capacity, mock_get_sta_id_by_loc_id, mock_get_gen_ids_by_loc_id, mock_has_daily_rollups):
+    mock_get_gen_codes_and_names.return_value = pd.DataFrame({"gen_code": ["code_1"], "gen_name": ["name_1"], "gen_rate_power": [1000]}, index=[1])
+    datetime_start = datetime(2021, 1, 1)
+    datetime_end = datetime(2021, 1, 2, 23, 59, 59)
+    mock_has_daily_rollups.return_value = True
+
+    assert Solar(None, 1, 1, [1], 1, datetime_start, datetime_end, "1D", use_rollups=True)._can_use_rollups(None)
+    assert not Solar(None, 1, 1, [1], 1, datetime_start, datetime_end, "1D")._can_use_rollups(None)
+    assert not Solar(None, 1, 1, [1], 1, datetime_start, datetime_end, "1H", use_rollups=True)._can_use_rollups(None)
+    assert not Solar(None, 1, 1, [1], 1, datetime_start, datetime(2021, 1, 2, 12), "1D", use_rollups=True)._can_use_rollups(None)
+    mock_has_daily_rollups.return_value = False
+    assert not Solar(None, 1, 1, [1], 1, datetime_start, datetime_end, "1D", use_rollups=True)._can_use_rollups(None)
+
+
+def _adjust_row_gen_units(row):
+    row_value = row[0]
+    if row_value is not None:
+        return row_value / 1000
+
+
+def _get_row_capacity_factor(row, data_freq, datetime_end, loc_total_capacity):
+    row_start_date = row.name[1]
+    row_end_date = get_period_end(row_start_date, data_freq, datetime_end)
+    hours_in_period = (row_end_date - row_start_date).total_seconds() / 3600
+    production = row['ac_production']
+    if production is None or hours_in_period == 0 or loc_total_capacity == 0:
+        return 0
+    return production / (loc_total_capacity * hours_in_period / 1000)
+
+
+@pytest.mark.parametrize("data_freq,datetime_end", [("15T", datetime(2021, 1, 3, 23, 59, 59)),
+                                                    ("15T", datetime(2021, 1, 3, 10, 5, 0)),
+                                                    ("1H", datetime(2021, 1, 3, 10, 30, 0)),
+                                                    ("1D", datetime(2021, 1, 3, 23, 59, 59))])
+@mock.patch("app.core.solar.get_gen_ids_by_loc_id")
+@mock.patch("app.core.solar.get_sta_id_by_loc_id")
+@mock.patch("app.core.solar.get_loc_output_capacity")
+@mock.patch("app.core.solar.get_gen_codes_and_names")
+def test_solar_calculated_columns_match_row_wise_computation(mock_get_gen_codes_and_names, mock_get_loc_output_capacity, mock_get_sta_id_by_loc_id, mock_get_gen_ids_by_loc_id,
+                                                             data_freq, datetime_end):
+    mock_get_loc_output_capacity.return_value = 1500
+    mock_get_gen_codes_and_names.return_value = pd.DataFrame({"gen_code": ["code_1", "code_2"], "gen_name": ["name_1", "name_2"]}, index=[1, 2])
+    solar = Solar(None, 1, 1, [1, 2], 1, datetime(2021, 1, 1), datetime_end, "1D", data_freq)
+
+    rng = np.random.default_rng(0)
+    dates = pd.date_range(datetime(2021, 1, 1), datetime_end, freq=data_freq)
+    index = pd.MultiIndex.from_product([[1, 2], dates], names=["gen_id", "data_date"])
+    values = rng.uniform(0, 500, size=(len(index), 3))
+    values[rng.random(values.shape) < 0.2] = np.nan
+    gen_data = pd.DataFrame(values, index=index, columns=["power", "ac_production", "ac_production_prediction"])
+    gen_data.iloc[::7, 0] = 0
+
+    solar.gen_data = gen_data.copy()
+    solar._adjust_gen_units()
+    for column in gen_data.columns:
+        expected = gen_data[[column]].apply(_adjust_row_gen_units, axis=1)
+        np.testing.assert_allclose(solar.gen_data[column].values.astype(float), expected.values.astype(float))
+
+    solar.data = solar.gen_data.assign(irradiation=rng.uniform(0, 1, size=len(index)))
+    solar._compute_calculated_columns()
+    expected = solar.data.apply(lambda row: _get_row_capacity_factor(row, data_freq, datetime_end, 1500), axis=1)
+    np.testing.assert_allclose(solar.data["capacity_factor"].values, expected.values.astype(float))
+
+
+@mock.patch("app.core.solar.get_gen_ids_by_loc_id")
+@mock.patch("app.core.solar.get_sta_id_by_loc_id")
+@mock.patch("app.core.solar.get_loc_output_capacity")
+@mock.patch("app.core.solar.get_gen_codes_and_names")
+def test_solar_merge_gen_and_sta_data(mock_get_gen_codes_and_names, mock_get_loc_output_capacity, mock_get_sta_id_by_loc_id, mock_get_gen_ids_by_loc_id):
+    mock_get_loc_output_capacity.return_value = 1000
+    mock_get_gen_codes_and_names.return_value = pd.DataFrame({"gen_code": ["code_1", "code_2", "code_3"], "gen_name": ["name_1", "name_2", "name_3"]}, index=[3, 1, 2])
+    solar = Solar(None, 1, 1, [3, 1, 2], 7, datetime(2021, 1, 1), datetime(2021, 1, 1, 2, 0, 0), "1H")
+
+    gen_datas = pd.DataFrame({
+        "gen_id": [3, 1, 1, 2],
+        "data_date": [datetime(2021, 1, 1, 0, 0, 0), datetime(2021, 1, 1, 0, 15, 0), datetime(2021, 1, 1, 1, 0, 0), datetime(2021, 1, 1, 1, 45, 0)],
+        "power": [10, 20, 30, 40],
+        "ac_production": [15, 25, 35, 45],
+        "ac_production_prediction": [11, 22, 33, 44]
+    })
+    sta_datas = pd.DataFrame({
+        "data_date": [datetime(2021, 1, 1, 0, 0, 0), datetime(2021, 1, 1, 1, 0, 0)],
+        "sta_id": [7, 7],
+        "avg_ambient_temp": [1, 2],
+        "avg_module_temp": [10, 20],
+        "irradiation": [50, 60]
+    })
+    solar.gen_data = gen_datas
+    solar.sta_data = sta_datas
+    solar._fill_missing_gen_data()
+    solar._fill_missing_sta_data()
+
+    all_data = pd.DataFrame()
+    for gen_id in solar.gen_data.index.unique(level='gen_id'):
+        aux_df = solar.sta_data.copy()
+        aux_df['gen_id'] = gen_id
+        all_data = pd.concat([all_data, aux_df])
+    expected = solar.gen_data.merge(all_data, left_on=['gen_id', 'data_date'], right_on=['gen_id', 'data_date'],
+                                    how='outer').reset_index().set_index(['gen_id', 'data_date'])
+
+    solar._merge_gen_and_sta_data()
+
+    pd.testing.assert_frame_equal(solar.data, expected)
+
+
+@mock.patch("app.core.solar.get_gen_ids_by_loc_id")
+@mock.patch("app.core.solar.get_sta_id_by_loc_id")
+@mock.patch("app.core.solar.get_loc_output_capacity")
+@mock.patch("app.core.solar.get_gen_codes_and_names")
+@mock.patch("app.core.solar.get_gen_datas_grouped")
+@mock.patch("app.core.solar.get_sta_datas_grouped")
+def test_solar_fetch_data_shares_cached_data(mock_get_sta_datas_grouped, mock_get_gen_datas_grouped, mock_get_gen_codes_and_names, mock_get_loc_output_capacity, mock_get_sta_id_by_loc_id, mock_get_gen_ids_by_loc_id):
+    gen_ids = [1, 2]
+    datetime_start = datetime(2021, 1, 1)
+    datetime_end = datetime(2021, 1, 2, 23, 59, 59)
+    mock_get_loc_output_capacity.return_value = 1000
+    mock_get_gen_codes_and_names.return_value = pd.DataFrame({
+        "gen_code": ["code_1", "code_2"],
+        "gen_name": ["name_1", "name_2"],
+        "gen_rate_power": [1000, 2000]
+    }, index=gen_ids)
+    gen_slots, sta_slots = _get_gen_slots()
+    mock_get_gen_datas_grouped.side_effect = lambda *args, **kwargs: gen_slots.set_index(["gen_id", "data_date"])
+    mock_get_sta_datas_grouped.side_effect = lambda *args, **kwargs: sta_slots.assign(sta_id=1).set_index(["data_date", "sta_id"])
+    solar_data_cache.clear()
+
+    overview = Solar(None, 1, 1, gen_ids, 1, datetime_start, datetime_end, None, use_cache=True)
+    overview.fetch_aggregated_by_loc_and_period(None)
+    climate = Solar(None, 1, 1, gen_ids, 1, datetime_start, datetime_end, '1H', use_cache=True)
+    climate.fetch_aggregated_by_loc_and_period(None)
+    uncached = Solar(None, 1, 1, gen_ids, 1, datetime_start, datetime_end, '1H')
+    uncached.fetch_aggregated_by_loc_and_period(None)
+
+    performance = Solar(None, 1, 1, [2, 1], 1, datetime_start, datetime_end, '1D', use_cache=True)
+    performance.fetch_aggregated_by_loc_and_period(None)
+
+    assert mock_get_gen_datas_grouped.call_count == 2
+    assert solar_data_cache.stats()['hits'] == 2
+    pd.testing.assert_frame_equal(climate.data, uncached.data)
+    pd.testing.assert_frame_equal(climate.data_aggregated_by_loc_and_period, uncached.data_aggregated_by_loc_and_period)
+
+
+@pytest.mark.parametrize("freq,datetime_end", [("1H", datetime(2021, 1, 1, 2, 0, 0)),
+                                               ("1D", datetime(2021, 1, 2, 23, 59, 59)),
+                                               ("1W", datetime(2021, 1, 2, 23, 59, 59)),
+                                               (None, datetime(2021, 1, 2, 23, 59, 59))])
+@pytest.mark.parametrize("gen_data_empty", [False, True])
+@mock.patch("app.core.solar.get_gen_ids_by_loc_id")
+@mock.patch("app.core.solar.get_sta_id_by_loc_id")
+@mock.patch("app.core.solar.get_loc_output_capacity")
+@mock.patch("app.core.solar.get_gen_codes_and_names")
+@mock.patch("app.core.solar.get_gen_datas_grouped")
+@mock.patch("app.core.solar.get_sta_datas_grouped")
+def test_solar_fetch_aggregated_by_period_in_chunks(mock_get_sta_datas_grouped, mock_get_gen_datas_grouped, mock_get_gen_codes_and_names, mock_get_loc_output_capacity,
+                                                    mock_get_sta_id_by_loc_id, mock_get_gen_ids_by_loc_id, gen_data_empty, freq, datetime_end):
+    mock_get_gen_ids_by_loc_id.return_value = pd.DataFrame({"gen_id_auto": [1, 2]})
+    mock_get_sta_id_by_loc_id.return_value = pd.DataFrame({"sta_id_auto": [1]})
+    mock_get_loc_output_capacity.return_value = 1000
+    mock_get_gen_codes_and_names.return_value = pd.DataFrame({
+        "gen_code": ["code_1", "code_2"],
+        "gen_name": ["name_1", "name_2"],
+        "gen_rate_power": [1000, 2000]
+    }, index=[1, 2])
+
+    datetime_start = datetime(2021, 1, 1, 0, 0, 0)
+    gen_slots, sta_slots = _get_gen_slots()
+    gen_data = gen_slots[gen_slots["data_date"] <= datetime_end].set_index(["gen_id", "data_date"])
+    if gen_data_empty:
+        gen_data = gen_data.iloc[:0]
+    chunksize = 3
+
+    def get_gen_datas_grouped(*args, chunksize=None, use_copy=False):
+        if chunksize:
+            return (gen_data.iloc[i:i + chunksize] for i in range(0, len(gen_data), chunksize))
+        return gen_data.copy()
+    mock_get_gen_datas_grouped.side_effect = get_gen_datas_grouped
+    mock_get_sta_datas_grouped.side_effect = lambda *args, **kwargs: sta_slots[sta_slots["data_date"] <= datetime_end].assign(sta_id=1).set_index(["data_date", "sta_id"])
+
+    expected = Solar(None, 1, 1, None, None, datetime_start, datetime_end, freq)
+    expected.fetch_aggregated_by_period(None)
+    solar = Solar(None, 1, 1, None, None, datetime_start, datetime_end, freq, chunksize=chunksize)
+    solar.fetch_aggregated_by_period(None)
+
+    assert mock_get_gen_datas_grouped.call_args.kwargs == {"chunksize": chunksize}
+    assert solar.data is None
+    pd.testing.assert_frame_equal(solar.data_aggregated_by_period, expected.data_aggregated_by_period, check_dtype=False, check_freq=False)
+
+
+@mock.patch("app.core.solar.get_gen_ids_by_loc_id")
+@mock.patch("app.core.solar.get_sta_id_by_loc_id")
+@mock.patch("app.core.solar.get_loc_output_capacity")
+@mock.patch("app.core.solar.get_gen_codes_and_names")
+@mock.patch("app.core.solar.get_gen_datas_grouped")
+@mock.patch("app.core.solar.get_sta_datas_grouped")
+def test_solar_fetch_aggregated_by_period_in_chunks_is_cached(mock_get_sta_datas_grouped, mock_get_gen_datas_grouped, mock_get_gen_codes_and_names,
+                                                              mock_get_loc_output_capacity, mock_get_sta_id_by_loc_id, mock_get_gen_ids_by_loc_id):
+    gen_ids = [1, 2]
+    datetime_start = datetime(2021, 1, 1)
+    datetime_end = datetime(2021, 1, 2, 23, 59, 59)
+    mock_get_loc_output_capacity.return_value = 1000
+    mock_get_gen_codes_and_names.return_value = pd.DataFrame({
+        "gen_code": ["code_1", "code_2"],
+        "gen_name": ["name_1", "name_2"],
+        "gen_rate_power": [1000, 2000]
+    }, index=gen_ids)
+    gen_slots, sta_slots = _get_gen_slots()
+    gen_data = gen_slots.set_index(["gen_id", "data_date"])
+    mock_get_gen_datas_grouped.side_effect = lambda *args, chunksize=None, **kwargs: (gen_data.iloc[i:i + chunksize] for i in range(0, len(gen_data), chunksize))
+    mock_get_sta_datas_grouped.side_effect = lambda *args, **kwargs: sta_slots.assign(sta_id=1).set_index(["data_date", "sta_id"])
+    solar_data_cache.clear()
+
+    daily = Solar(None, 1, 1, gen_ids, 1, datetime_start, datetime_end, '1D', use_cache=True, chunksize=3)
+    daily.fetch_aggregated_by_period(None)
+    daily_again = Solar(None, 1, 1, [2, 1], 1, datetime_start, datetime_end, '1D', use_cache=True, chunksize=3)
+    daily_again.fetch_aggregated_by_period(None)
+    weekly = Solar(None, 1, 1, gen_ids, 1, datetime_start, datetime_end, '1W', use_cache=True, chunksize=3)
+    weekly.fetch_aggregated_by_period(None)
+
+    assert mock_get_gen_datas_grouped.call_count == 2
+    assert solar_data_cache.stats()['hits'] == 1
+    pd.testing.assert_frame_equal(daily_again.data_aggregated_by_period, daily.data_aggregated_by_period)
+    assert daily_again.data_aggregated_by_period is not daily.data_aggregated_by_period
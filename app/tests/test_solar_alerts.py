@@ -4,7 +4,8 @@ from unittest import mock
 import pandas as pd
 import pytest
 
-from app.endpoints.solar.solar_alerts import parse_request, process_alerts
+from app.endpoints.solar.solar_alerts import (parse_batch_request, parse_request,
+                                              process_alerts, process_batch_alerts)
 
 
 def test_parse_request():
@@ -27,6 +28,14 @@ def test_parse_request_with_data_pro_id():
     assert request.client is None
     assert request.location is None
     assert request.data_pro_id == 1
+    assert not request.incremental
+
+
+def test_parse_request_incremental():
+    request = parse_request('{"data_pro_id": 1, "incremental": true}')
+
+    assert request.data_pro_id == 1
+    assert request.incremental
 
 
 def test_parse_request_should_fail():
@@ -54,3 +63,46 @@ def test_process_alerts(mock_calculate_alerts):
     assert response.data.client == 1
     assert response.data.location == 1
     assert response.data.generators == [1]
+
+
+def test_parse_batch_request():
+    request = parse_batch_request('{"from": "2021-01-01", "to": "2021-01-31", "clients": [1, 2], "workers": 8}')
+
+    assert request.start_date == datetime(2021, 1, 1, 0, 0, 0)
+    assert request.end_date == datetime(2021, 1, 31, 23, 59, 59)
+    assert request.clients == [1, 2]
+    assert request.workers == 4
+
+
+@pytest.mark.parametrize("workers, expected", [(2, 2), (0, 1), (-3, 1), (1000, 4)])
+def test_parse_batch_request_clamps_workers(workers, expected):
+    assert parse_batch_request(f'{{"from": "2021-01-01", "to": "2021-01-31", "workers": {workers}}}').workers == expected
+
+
+def test_parse_batch_request_all_clients():
+    request = parse_batch_request('{"from": "2021-01-01", "to": "2021-01-31"}')
+
+    assert request.clients is None
+    assert request.workers == 4
+
+
+def test_parse_batch_request_should_fail():
+    with pytest.raises(ValueError) as exception:
+        parse_batch_request('{"from": "2021-01-01", "to": "2021-01-31", "clients": "some"}')
+    assert exception.value.args[0] == 'Invalid parameters: clients must be a list of clients or "all"'
+
+
+@mock.patch("app.endpoints.solar.solar_alerts.calculate_fleet_alerts")
+@mock.patch("app.endpoints.solar.solar_alerts.database")
+def test_process_batch_alerts(mock_database, mock_calculate_fleet_alerts):
+    mock_calculate_fleet_alerts.return_value = [{"client": 1, "locations": 2, "generators": 5, "count": 3, "error": None},
+                                                {"client": 2, "locations": 1, "generators": 0, "count": 0, "error": "ValueError('failed')"}]
+
+    response = process_batch_alerts('{"from": "2021-01-01", "to": "2021-01-31", "clients": "all", "workers": 2}')
+
+    mock_calculate_fleet_alerts.assert_called_once_with(mock_database.SessionLocal, datetime(2021, 1, 1), datetime(2021, 1, 31, 23, 59, 59),
+                                                        cli_ids=None, max_workers=2)
+    assert response.data.from_ == "2021-01-01 00:00"
+    assert response.data.count == 3
+    assert [client.client for client in response.data.clients] == [1, 2]
+    assert response.data.clients[1].error == "ValueError('failed')"
@@ -5,7 +5,8 @@ from unittest import mock
 import pandas as pd
 import pytest
 
-from app.endpoints.solar.solar_anomaly_detection import parse_request, process_anomaly_detection
+from app.endpoints.solar.solar_anomaly_detection import (parse_batch_request, parse_request, process_anomaly_detection,
+                                                          process_batch_anomaly_detection)
 
 
 def test_parse_request():
@@ -39,11 +40,12 @@ def test_parse_request_should_fail():
     assert exception.value.args[0] == "Invalid parameters: either data_pro_id or client, location, generator, start and end dates must be provided"
 
 
+@mock.patch("app.endpoints.solar.solar_anomaly_detection.get_location_timezone")
 @mock.patch("app.endpoints.solar.solar_anomaly_detection.get_data")
-@mock.patch("app.endpoints.solar.solar_anomaly_detection.resample_data")
-@mock.patch("app.endpoints.solar.solar_anomaly_detection.load_model")
+@mock.patch("app.endpoints.solar.solar_anomaly_detection.get_gens_hourly_features")
+@mock.patch("app.endpoints.solar.solar_anomaly_detection.load_location_model")
 @mock.patch("app.endpoints.solar.solar_anomaly_detection.save_predictions")
-def test_process_anomaly_detection(mock_save_predictions, mock_load_model, mock_resample_data, mock_get_data):
+def test_process_anomaly_detection(mock_save_predictions, mock_load_model, mock_get_gens_hourly_features, mock_get_data, mock_get_location_timezone):
     param_json = '{"from": "2021/01/01T00:00:00", "to": "2021/01/02T00:00:00", "client": 1, "location": 1, "generator": 1}'
     df = pd.DataFrame({
         "data_pro_id": [1, 1, 1, 1, 1],
@@ -58,17 +60,24 @@ def test_process_anomaly_detection(mock_save_predictions, mock_load_model, mock_
                                   1.0,
                                   1.0)
 
-    mock_resample_data.return_value = df
+    mock_get_gens_hourly_features.return_value = {1: df}
 
     mock_model = mock_load_model.return_value
     df_predict = df = pd.DataFrame({
         "Prediction": [30],
     }, index=[datetime(2021, 1, 1, 1, 0, 0)])
     mock_model.predict.return_value = df_predict
-    mock_model.generate_input.return_value = df
+    mock_model.generate_input_from_features.return_value = df
+    mock_get_location_timezone.return_value = "America/Montevideo"
 
     response = process_anomaly_detection(param_json)
 
+    mock_load_model.assert_called_once_with(1, 1, 100)
+    assert mock_get_gens_hourly_features.call_args.args[1:3] == (1, 1)
+    assert mock_get_gens_hourly_features.call_args.args[3][1] is mock_get_data.return_value[0]
+    assert mock_get_gens_hourly_features.call_args.args[6:] == ("America/Montevideo", None)
+    assert mock_model.generate_input_from_features.call_args.args[0] is mock_get_gens_hourly_features.return_value[1]
+
     assert response.chart.from_ == "2021/01/01 00:00:00"
     assert response.chart.to == "2021/01/02 23:59:59"
     assert response.chart.resultCode == 200
@@ -86,3 +95,43 @@ def test_process_anomaly_detection(mock_save_predictions, mock_load_model, mock_
     assert response.data[3].actual == 50
     assert response.data[3].prediction == 30
     assert response.data[3].dataDate == '2021/01/01 01:00:00'
+
+
+def test_parse_batch_request():
+    request = parse_batch_request('{"from": "2021-01-01", "to": "2021-01-02", "client": 1, "location": 2, "generators": [3, 4]}')
+
+    assert request.end_date == datetime(2021, 1, 2, 23, 59, 59)
+    assert (request.cli_id, request.loc_id, request.gen_ids, request.data_pro_id) == (1, 2, [3, 4], None)
+    with pytest.raises(ValueError):
+        parse_batch_request('{"from": "2021-01-01", "to": "2021-01-02", "client": 1}')
+
+
+@mock.patch("app.endpoints.solar.solar_anomaly_detection.get_location_timezone")
+@mock.patch("app.endpoints.solar.solar_anomaly_detection.save_gens_predictions")
+@mock.patch("app.endpoints.solar.solar_anomaly_detection.predict_generators_features")
+@mock.patch("app.endpoints.solar.solar_anomaly_detection.load_location_model")
+@mock.patch("app.endpoints.solar.solar_anomaly_detection.get_gens_hourly_features")
+@mock.patch("app.endpoints.solar.solar_anomaly_detection.get_batch_data")
+def test_process_batch_anomaly_detection(mock_get_batch_data, mock_get_gens_hourly_features, mock_load_model, mock_predict_generators, mock_save_gens_predictions,
+                                         mock_get_location_timezone):
+    dates = pd.date_range("2021-01-01 00:15", "2021-01-01 01:00", freq="15T")
+    gens_df = pd.DataFrame({"Generated Power": [10.0, 20.0, 30.0, 40.0] * 2, "data_pro_id": 1},
+                           index=pd.MultiIndex.from_product([[1, 2], dates], names=["gen_id", "data_date"]))
+    sta_df = pd.DataFrame({"Temperature": [20.0] * 4}, index=dates)
+    mock_get_batch_data.return_value = (gens_df, sta_df, 1, 1, [1, 2], datetime(2021, 1, 1), datetime(2021, 1, 1, 23, 59, 59), 100, 1.0, 1.0)
+    mock_get_gens_hourly_features.return_value = {1: pd.DataFrame(), 2: pd.DataFrame()}
+    mock_predict_generators.return_value = pd.DataFrame({"Prediction": [30.0, 35.0]},
+                                                        index=pd.MultiIndex.from_product([[1, 2], [datetime(2021, 1, 1, 1)]], names=["gen_id", "data_date"]))
+
+    response = process_batch_anomaly_detection('{"data_pro_id": 1}', db=None)
+
+    assert list(mock_get_gens_hourly_features.call_args.args[3]) == [1, 2]
+    assert mock_get_gens_hourly_features.call_args.args[7] == 1
+    assert mock_predict_generators.call_count == 1
+    assert list(mock_predict_generators.call_args.args[1]) == [1, 2]
+    assert response.generators == [1, 2]
+    assert len(response.data) == 8
+    assert (response.data[0].generator, response.data[0].dataDate, response.data[0].prediction, response.data[0].actual) == (1, "2021/01/01 00:15:00", 30.0, 10.0)
+    assert (response.data[7].generator, response.data[7].dataDate, response.data[7].prediction, response.data[7].actual) == (2, "2021/01/01 01:00:00", 35.0, 40.0)
+    mock_save_gens_predictions.assert_called_once()
+    assert len(mock_save_gens_predictions.call_args.args[2]) == 8
@@ -0,0 +1,47 @@
+from datetime import datetime
+from unittest import mock
+
+import pytest
+
+from app.endpoints.solar.solar_rollups import parse_request, refresh_rollups
+
+
+def test_parse_request():
+    param_json = '{"from": "2021-01-01T00:00:00", "to": "2021-01-02T00:00:00", "client": 1, "location": 1}'
+    request = parse_request(param_json)
+
+    assert request.start_date == datetime(2021, 1, 1, 0, 0, 0)
+    assert request.end_date == datetime(2021, 1, 2, 23, 59, 59)
+    assert request.client == 1
+    assert request.location == 1
+    assert request.data_pro_id is None
+
+
+def test_parse_request_should_fail():
+    param_json = '{"from": "2021-01-01T00:00:00", "client": 1, "location": 1}'
+    with pytest.raises(ValueError) as exception:
+        parse_request(param_json)
+    assert exception.value.args[0] == "Invalid parameters: either data_pro_id or client, location, from and to must be provided"
+
+
+@mock.patch("app.endpoints.solar.solar_rollups.refresh_daily_rollups_by_data_pro_id")
+def test_refresh_rollups_by_data_pro_id(mock_refresh_daily_rollups_by_data_pro_id):
+    mock_refresh_daily_rollups_by_data_pro_id.return_value = (1, 2, datetime(2021, 1, 1, 0, 0, 0), datetime(2021, 1, 2, 23, 45, 0), 6)
+
+    response = refresh_rollups('{"data_pro_id": 10}', None)
+
+    assert response.data.from_ == "2021-01-01 00:00"
+    assert response.data.to == "2021-01-02 23:45"
+    assert response.data.count == 6
+    assert response.data.client == 1
+    assert response.data.location == 2
+
+
+@mock.patch("app.endpoints.solar.solar_rollups.refresh_daily_rollups")
+def test_refresh_rollups_by_location(mock_refresh_daily_rollups):
+    mock_refresh_daily_rollups.return_value = 9
+
+    response = refresh_rollups('{"from": "2021-01-01", "to": "2021-01-02", "client": 1, "location": 2}', None)
+
+    mock_refresh_daily_rollups.assert_called_once_with(None, 1, 2, datetime(2021, 1, 1, 0, 0, 0), datetime(2021, 1, 2, 23, 59, 59))
+    assert response.data.count == 9
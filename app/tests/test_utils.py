@@ -1,17 +1,26 @@
 from datetime import datetime
 from unittest import mock
 
+import numpy as np
 import pandas as pd
 import pytest
-from db.models import CliGenAlert, GenData, Generator, Location
-from db.utils import (get_client_settings, get_co2_emissions_tons_per_Mwh,
+from db.models import CliGenAlert, DataProcessing, GenData, Generator, Location
+from db.utils import (MetadataCache, bulk_write, check_daily_rollups, compute_daily_rollups, get_client_gen_datas_by_period, get_client_sta_datas_by_period,
+                      data_date_slot, get_client_settings, get_gen_rollups_by_period,
+                      read_sql_chunks, read_sql_copy, refresh_daily_rollups, refresh_daily_rollups_by_data_pro_id, refresh_prediction_rollups,
+                      get_expected_data_count_per_period,
+                      get_expected_data_counts_per_period, get_co2_emissions_tons_per_Mwh,
                       get_gen_codes_and_names, get_gen_datas,
-                      get_gen_datas_grouped, get_gen_ids_by_data_pro_id,
-                      get_gen_ids_by_loc_id, get_loc_output_capacity, get_location,
-                      get_period_end, get_sta_datas, get_sta_datas_grouped,
+                      get_gen_datas_grouped, get_gen_ids_by_data_pro_id, get_generators_by_client, get_gens_data, get_gens_features,
+                      get_gen_ids_by_loc_id, get_loc_output_capacity, get_location, get_location_timezone,
+                      get_period_end, get_period_ends, get_sta_datas, get_sta_datas_by_period, get_sta_datas_grouped,
                       get_sta_id_by_loc_id, group_by_to_pd_frequency,
-                      insert_cli_gen_alerts, remove_microseconds, update_location)
+                      insert_cli_gen_alerts, insert_or_update_gens_features, insert_or_update_gens_predictions, insert_or_update_predictions, metadata_cache,
+                      update_alert_evaluated_dates, remove_microseconds,
+                      update_location)
 from mock_alchemy.mocking import UnifiedAlchemyMagicMock
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
 
 
 def test_get_loc_output_capacity():
@@ -147,6 +156,38 @@ def test_get_period_end_freq_none():
     assert result == end_date
 
 
+@pytest.mark.parametrize("freq", [None, "15T", "1H", "1D", "1W", "1M", "1MS", "1Y", "1YS", "5T"])
+@pytest.mark.parametrize("end_date", [datetime(2021, 6, 6, 0, 0, 0), datetime(2022, 12, 31, 23, 59, 59), datetime(2030, 1, 1)])
+def test_get_period_ends_matches_get_period_end(freq, end_date):
+    rng = np.random.default_rng(42)
+    seconds = rng.integers(0, 3 * 365 * 24 * 3600, size=500)
+    starts = pd.DatetimeIndex(datetime(2020, 1, 1) + pd.to_timedelta(seconds, unit='s'))
+    starts = starts.append(pd.date_range(datetime(2021, 1, 1), periods=100, freq="15T"))
+    starts = starts.append(pd.DatetimeIndex([datetime(2021, 1, 31, 0, 0, 0), datetime(2021, 1, 3, 12, 0, 0), datetime(2021, 1, 4, 0, 0, 0, 600000)]))
+
+    expected = [get_period_end(start, freq, end_date) for start in starts]
+    result = get_period_ends(starts, freq, end_date)
+
+    assert isinstance(result, pd.DatetimeIndex)
+    assert list(result) == expected
+
+    series = pd.Series(starts, index=range(10, 10 + len(starts)))
+    result = get_period_ends(series, freq, end_date)
+    assert result.index.equals(series.index)
+    assert list(result) == expected
+
+
+@pytest.mark.parametrize("pd_freq", ["1H", "1D", "1W", "1MS", "1YS"])
+def test_get_expected_data_counts_per_period(pd_freq):
+    datetime_end = datetime(2022, 3, 15, 23, 59, 59)
+    period_starts = pd.Series(pd.date_range(datetime(2021, 1, 1), datetime_end, freq=pd_freq))
+
+    expected = [get_expected_data_count_per_period(start, datetime_end, pd_freq, '15T') for start in period_starts]
+    result = get_expected_data_counts_per_period(period_starts, datetime_end, pd_freq, '15T')
+
+    assert result.tolist() == expected
+
+
 def test_group_by_to_pd_frequency():
 
     assert group_by_to_pd_frequency("hour") == "1H"
@@ -180,15 +221,13 @@ def test_get_gen_datas_grouped():
     session = UnifiedAlchemyMagicMock()
     with mock.patch("pandas.read_sql") as mock_read_sql:
         mock_read_sql.return_value = pd.DataFrame({
-            "gen_id": [1, 1, 2, 2, 3, 3],
+            "gen_id": [1, 2, 3],
             "data_date": [datetime(2021, 1, 1, 0, 0, 0),
-                          datetime(2021, 1, 1, 0, 0, 0),
-                          datetime(2021, 1, 1, 0, 0, 0),
-                          datetime(2021, 1, 1, 0, 0, 0),
                           datetime(2021, 1, 1, 0, 0, 0),
                           datetime(2021, 1, 1, 0, 0, 0)],
-            "data_value": [10, 20, 30, 40, 50, 60],
-            "data_type_id": [1, 2, 1, 2, 1, 2]
+            "data_type_1": [10, 30, 50],
+            "data_type_2": [20, 40, 60],
+            "extra_column": [None, None, None]
         })
 
         df = get_gen_datas_grouped(session, cli_id, gen_ids, datetime_start, datetime_end, '15T', data_type_names)
@@ -200,6 +239,14 @@ def test_get_gen_datas_grouped():
         assert df["extra_column"].tolist() == [None, None, None]
 
 
+def test_data_date_slot():
+    statement = str(data_date_slot(GenData.data_date, '15T').compile(dialect=postgresql.dialect()))
+    assert statement == "date_trunc('minute', gen_data.data_date + interval '499999 microseconds')"
+
+    statement = str(data_date_slot(GenData.data_date, '1MS').compile(dialect=postgresql.dialect()))
+    assert statement == "date_trunc('day', date_trunc('minute', gen_data.data_date + interval '499999 microseconds'))"
+
+
 def test_get_gen_codes_and_names():
     gen_ids = [1, 2, 3]
     session = UnifiedAlchemyMagicMock()
@@ -394,21 +441,138 @@ def test_insert_cli_gen_alerts():
         {"cli_id": 1, "gen_id": 2, "cli_gen_alert_trigger": datetime(2021, 1, 1, 0, 0, 0)},
         {"cli_id": 1, "gen_id": 3, "cli_gen_alert_trigger": datetime(2021, 1, 1, 0, 0, 0)}
     ]
-    mock_statement = mock.Mock()
-    mock_insert = mock.Mock(return_value=mock_statement)
-    mock_statement.values = mock.Mock(return_value="statement")
     session = UnifiedAlchemyMagicMock()
-    with mock.patch('sqlalchemy.dialects.postgresql.insert', mock_insert):
-        with mock.patch("sqlalchemy.orm.Session.execute") as mock_execute:
+    with mock.patch("db.utils.bulk_write") as mock_bulk_write:
 
-            mock_execute.return_value = None
+        result = insert_cli_gen_alerts(session, cli_id, gen_ids, datetime_start, datetime_end, rows_to_insert)
 
-            result = insert_cli_gen_alerts(session, cli_id, gen_ids, datetime_start, datetime_end, rows_to_insert)
+        assert result == 3
+        assert mock_bulk_write.call_args[0][1] == CliGenAlert
+        assert mock_bulk_write.call_args[0][2].to_dict("records") == rows_to_insert
 
-            assert result == 3
-            mock_insert.assert_called_once_with(CliGenAlert)
-            session.execute.assert_called_once_with("statement")
-            session.commit.assert_called_once()
+
+def _mock_bulk_write_session():
+    session = mock.MagicMock()
+    cursor = session.connection.return_value.connection.cursor.return_value.__enter__.return_value
+    copied = []
+    cursor.copy_expert.side_effect = lambda sql, buffer: copied.append(buffer.getvalue())
+    return session, cursor, copied
+
+
+def test_bulk_write_upserts_chunks_through_staging_table():
+    session, cursor, copied = _mock_bulk_write_session()
+    df = pd.DataFrame({"cli_id": [1, 1, 1, 1], "gen_id": [2, 2, 2, 2],
+                       "data_date": [datetime(2021, 1, 1, 0, 0, 0), datetime(2021, 1, 1, 0, 15, 0), datetime(2021, 1, 1, 0, 30, 0), datetime(2021, 1, 1, 0, 30, 0)],
+                       "data_type_id": [508, 508, 508, 508], "data_pro_id": [7.0, np.nan, 7.0, 8.0], "data_value": [1.5, None, 3.0, 4.0]})
+
+    result = bulk_write(session, GenData, df, index_elements=["cli_id", "gen_id", "data_date", "data_type_id"], chunksize=2)
+
+    assert result == 3
+    create_sql = cursor.execute.call_args_list[0][0][0]
+    assert create_sql.startswith("CREATE TEMP TABLE gen_data_staging_") and "ON COMMIT DROP" in create_sql
+    assert create_sql.endswith("SELECT cli_id, gen_id, data_date, data_type_id, data_pro_id, data_value FROM gen_data WITH NO DATA")
+    assert copied == ["1,2,2021-01-01 00:00:00,508,7,1.5\n1,2,2021-01-01 00:15:00,508,\\N,\\N\n", "1,2,2021-01-01 00:30:00,508,8,4.0\n"]
+    assert session.execute.call_count == 2
+    statement = str(session.execute.call_args[0][0].compile(dialect=postgresql.dialect()))
+    assert "INSERT INTO gen_data (cli_id, gen_id, data_date, data_type_id, data_pro_id, data_value) SELECT" in statement
+    assert "ON CONFLICT (cli_id, gen_id, data_date, data_type_id) DO UPDATE SET data_pro_id = excluded.data_pro_id, data_value = excluded.data_value" in statement
+    session.commit.assert_called_once()
+
+
+def test_bulk_write_rolls_back_on_error():
+    session, cursor, copied = _mock_bulk_write_session()
+    session.execute.side_effect = ValueError("conflict")
+
+    with pytest.raises(ValueError):
+        bulk_write(session, CliGenAlert, pd.DataFrame([{"cli_id": 1, "gen_id": 2, "cli_gen_alert_type": 1}]))
+
+    statement = str(session.execute.call_args[0][0].compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT" not in statement
+    session.rollback.assert_called_once()
+    session.commit.assert_not_called()
+
+
+@mock.patch("db.utils.has_daily_rollups", return_value=False)
+def test_insert_or_update_predictions(mock_has_daily_rollups):
+    with mock.patch("db.utils.bulk_write", return_value=2) as mock_bulk_write:
+        result = insert_or_update_predictions(None, 1, 2, [(datetime(2021, 1, 1, 0, 0, 0), 1.5, 7), (datetime(2021, 1, 1, 0, 15, 0), 2.5, 7)])
+
+    assert result == 2
+    df = mock_bulk_write.call_args[0][2]
+    assert df[["cli_id", "gen_id", "data_type_id", "data_pro_id", "data_value"]].values.tolist() == [[1, 2, 508, 7, 1.5], [1, 2, 508, 7, 2.5]]
+    assert mock_bulk_write.call_args.kwargs == {"index_elements": ["cli_id", "gen_id", "data_date", "data_type_id"]}
+
+
+@mock.patch("db.utils.has_daily_rollups", return_value=False)
+def test_insert_or_update_gens_predictions(mock_has_daily_rollups):
+    predictions = pd.DataFrame({"gen_id": [2, 3], "data_date": [datetime(2021, 1, 1, 0, 0, 0), datetime(2021, 1, 1, 0, 0, 0)],
+                                "data_value": [1.5, 2.5], "data_pro_id": [7, 7]})
+    with mock.patch("db.utils.bulk_write", return_value=2) as mock_bulk_write:
+        result = insert_or_update_gens_predictions(None, 1, predictions)
+
+    assert result == 2
+    mock_bulk_write.assert_called_once()
+    df = mock_bulk_write.call_args[0][2]
+    assert df[["cli_id", "gen_id", "data_type_id", "data_pro_id", "data_value"]].values.tolist() == [[1, 2, 508, 7, 1.5], [1, 3, 508, 7, 2.5]]
+
+
+@mock.patch("db.utils.refresh_daily_rollups", return_value=3)
+@mock.patch("db.utils.has_daily_rollups", return_value=True)
+def test_refresh_prediction_rollups(mock_has_daily_rollups, mock_refresh_daily_rollups):
+    predictions = pd.DataFrame({"gen_id": [2, 3, 2], "data_date": [datetime(2021, 1, 1, 10), datetime(2021, 1, 2, 10), datetime(2021, 1, 1, 11)],
+                                "data_value": [1.5, 2.5, 3.5], "data_pro_id": [7, 7, 8]})
+    with mock.patch("pandas.read_sql", return_value=pd.DataFrame({"loc_id": [4, 5]})):
+        result = refresh_prediction_rollups(UnifiedAlchemyMagicMock(), 1, predictions)
+
+    assert result == 6
+    assert [call.args[1:] for call in mock_refresh_daily_rollups.call_args_list] == [(1, 4, datetime(2021, 1, 1, 10), datetime(2021, 1, 2, 10), 8),
+                                                                                     (1, 5, datetime(2021, 1, 1, 10), datetime(2021, 1, 2, 10), 8)]
+    mock_has_daily_rollups.return_value = False
+    assert refresh_prediction_rollups(None, 1, predictions) == 0
+
+
+def test_get_gens_data():
+    session = UnifiedAlchemyMagicMock()
+    with mock.patch("pandas.read_sql") as mock_read_sql:
+        mock_read_sql.return_value = pd.DataFrame({
+            "gen_id": [1, 2],
+            "data_date": [datetime(2021, 1, 1, 0, 0, 0, 600000), datetime(2021, 1, 1, 0, 0, 0)],
+            "data_value": [10.0, 20.0],
+            "data_pro_id": [7, 7]
+        })
+
+        df = get_gens_data(session, 1, [1, 2], datetime(2021, 1, 1), datetime(2021, 1, 2))
+
+        assert df.index.names == ["gen_id", "data_date"]
+        assert df.index.tolist() == [(1, datetime(2021, 1, 1, 0, 0, 1)), (2, datetime(2021, 1, 1, 0, 0, 0))]
+        assert df.columns.tolist() == ["Generated Power", "data_pro_id"]
+        assert mock_read_sql.call_count == 1
+
+
+def test_get_gens_features():
+    session = UnifiedAlchemyMagicMock()
+    with mock.patch("pandas.read_sql") as mock_read_sql:
+        mock_read_sql.return_value = pd.DataFrame({"gen_id": [1], "data_date": ["2021-01-01 01:00:00"], "data_pro_id": [7],
+                                                   "generated_power": [0.5], "hours_since_last_rain": [3.0]})
+
+        df = get_gens_features(session, 1, [1], datetime(2021, 1, 1), datetime(2021, 1, 2))
+
+    assert df.index.tolist() == [(1, datetime(2021, 1, 1, 1))]
+    assert df.columns.tolist() == ["data_pro_id", "Generated Power", "Hours Since Last Rain"]
+
+
+def test_insert_or_update_gens_features():
+    features = pd.DataFrame({"data_pro_id": [7], "Temperature": [20.0], "Precipitation Total": [0.0], "Cloud Cover Total": [10.0],
+                             "Shortwave Radiation": [0.5], "Generated Power": [0.01], "Generated Power 1 Hour Lag": [0.02],
+                             "Hours Since Last Rain": [3.0], "Solar Zenith Angle": [45.0]},
+                            index=pd.MultiIndex.from_tuples([(2, datetime(2021, 1, 1, 1))], names=["gen_id", "data_date"]))
+    with mock.patch("db.utils.bulk_write", return_value=1) as mock_bulk_write:
+        result = insert_or_update_gens_features(None, 1, 3, features)
+
+    assert result == 1
+    df = mock_bulk_write.call_args[0][2]
+    assert df[["cli_id", "gen_id", "loc_id", "data_pro_id", "generated_power_lag", "hours_since_last_rain"]].values.tolist() == [[1, 2, 3, 7, 0.02, 3.0]]
+    assert mock_bulk_write.call_args.kwargs == {"index_elements": ["cli_id", "gen_id", "data_date"]}
 
 
 def test_get_gen_ids_by_data_pro_id():
@@ -476,3 +640,245 @@ def test_update_location():
             capacity = 50
             update_location(session, location, "address", capacity)
             session.commit.assert_called_once()
+
+
+def test_metadata_cache_hits_and_invalidation():
+    loc_id = 1
+    session = UnifiedAlchemyMagicMock()
+    metadata_cache.clear()
+    with mock.patch("pandas.read_sql") as mock_read_sql:
+        mock_read_sql.return_value = pd.DataFrame({"gen_id_auto": [1, 2, 3]})
+
+        df = get_gen_ids_by_loc_id(session, loc_id)
+        df.loc[0, "gen_id_auto"] = 10
+        assert get_gen_ids_by_loc_id(session, loc_id)["gen_id_auto"].tolist() == [1, 2, 3]
+        assert mock_read_sql.call_count == 1
+        assert metadata_cache.stats()["hits"] == {"get_gen_ids_by_loc_id": 1}
+        assert metadata_cache.stats()["misses"] == {"get_gen_ids_by_loc_id": 1}
+
+        update_location(session, Location(loc_id_auto=loc_id, cli_id=1), "address", None)
+        get_gen_ids_by_loc_id(session, loc_id)
+        assert mock_read_sql.call_count == 2
+
+        get_gen_ids_by_loc_id(UnifiedAlchemyMagicMock(), loc_id)
+        assert mock_read_sql.call_count == 3
+
+
+def test_metadata_cache_ttl_and_max_entries():
+    cache = MetadataCache(ttl_seconds=10, max_entries=2)
+    load = mock.Mock(side_effect=lambda: load.call_count)
+    with mock.patch("time.monotonic", return_value=0):
+        assert cache.get_or_load(("name", None, 1), {"cli_id": 1, "loc_id": None}, load) == 1
+        assert cache.get_or_load(("name", None, 1), {"cli_id": 1, "loc_id": None}, load) == 1
+        cache.get_or_load(("name", None, 2), {"cli_id": 1, "loc_id": None}, load)
+        cache.get_or_load(("name", None, 3), {"cli_id": 2, "loc_id": None}, load)
+        assert cache.stats()["entries"] == 2
+        assert cache.get_or_load(("name", None, 1), {"cli_id": 1, "loc_id": None}, load) == 4
+
+        cache.invalidate(cli_id=1)
+        assert cache.stats()["entries"] == 1
+    with mock.patch("time.monotonic", return_value=11):
+        assert cache.get_or_load(("name", None, 3), {"cli_id": 2, "loc_id": None}, load) == 5
+
+
+def test_compute_daily_rollups():
+    with mock.patch("pandas.read_sql") as mock_read_sql:
+        mock_read_sql.side_effect = [
+            pd.DataFrame({"gen_id": [1], "data_date": [datetime(2021, 1, 1)], "power": [1.0], "ac_production": [2.0], "ac_production_prediction": [3.0],
+                          "data_count": [2], "unavailable_count": [1], "last_ac_production": [0.5]}),
+            pd.DataFrame({"data_date": [datetime(2021, 1, 2)], "ambient_temp_sum": [1.0], "module_temp_sum": [2.0], "irradiation": [3.0], "slot_count": [4]})
+        ]
+        gen, sta = compute_daily_rollups(Session(), 1, [2, 1], 1, datetime(2021, 1, 1, 10, 0, 0), datetime(2021, 1, 2, 12, 0, 0), "15T")
+        gen_statement = str(mock_read_sql.call_args_list[0][0][0].compile(dialect=postgresql.dialect()))
+
+    assert "interval '85500 seconds'" in gen_statement
+    assert gen[["gen_id", "data_date"]].values.tolist() == [[1, pd.Timestamp(2021, 1, 1)], [1, pd.Timestamp(2021, 1, 2)],
+                                                             [2, pd.Timestamp(2021, 1, 1)], [2, pd.Timestamp(2021, 1, 2)]]
+    assert gen["data_count"].tolist() == [2, 0, 0, 0]
+    assert gen["unavailable_count"].tolist() == [1, 0, 0, 0]
+    assert gen["power"].isna().tolist() == [False, True, True, True]
+    assert sta["data_date"].tolist() == [pd.Timestamp(2021, 1, 1), pd.Timestamp(2021, 1, 2)]
+    assert sta["slot_count"].tolist() == [0, 4]
+    assert np.isnan(sta["irradiation"][0])
+
+
+def test_refresh_daily_rollups():
+    session = mock.Mock()
+    gen = pd.DataFrame({"gen_id": [1, 1, 2, 2], "data_date": [datetime(2021, 1, 1), datetime(2021, 1, 2)] * 2, "power": [1.0, np.nan, 2.0, 3.0]})
+    sta = pd.DataFrame({"data_date": [datetime(2021, 1, 1), datetime(2021, 1, 2)], "slot_count": [96, 0]})
+    with mock.patch("db.utils.get_gen_ids_by_loc_id", return_value=pd.DataFrame({"gen_id_auto": [1, 2]})), \
+            mock.patch("db.utils.get_sta_id_by_loc_id", return_value=pd.DataFrame({"sta_id_auto": [5]})), \
+            mock.patch("db.utils.compute_daily_rollups", return_value=(gen, sta)) as mock_compute_daily_rollups, \
+            mock.patch("db.utils.ROLLUP_INSERT_CHUNK_SIZE", 3):
+        row_count = refresh_daily_rollups(session, 1, 2, datetime(2021, 1, 1), datetime(2021, 1, 2), data_pro_id=10)
+
+    assert row_count == 6
+    assert mock_compute_daily_rollups.call_args[0][2:] == ([1, 2], 5, datetime(2021, 1, 1), datetime(2021, 1, 2), "15T")
+    assert session.execute.call_count == 3
+    statement = str(session.execute.call_args_list[0][0][0].compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (cli_id, gen_id, sta_id, data_date, data_freq) DO UPDATE" in statement
+    session.commit.assert_called_once()
+
+
+def test_refresh_daily_rollups_by_data_pro_id():
+    session = mock.Mock()
+    session.query.return_value.filter.return_value.first.return_value = DataProcessing(data_pro_id_auto=10, cli_id=1, loc_id=2)
+    session.query.return_value.filter.return_value.one.side_effect = [(datetime(2021, 1, 2), datetime(2021, 1, 3)),
+                                                                      (datetime(2021, 1, 1, 12), datetime(2021, 1, 2))]
+    with mock.patch("db.utils.refresh_daily_rollups", return_value=12) as mock_refresh_daily_rollups:
+        result = refresh_daily_rollups_by_data_pro_id(session, 10)
+
+    assert result == (1, 2, datetime(2021, 1, 1, 12), datetime(2021, 1, 3), 12)
+    mock_refresh_daily_rollups.assert_called_once_with(session, 1, 2, datetime(2021, 1, 1, 12), datetime(2021, 1, 3), 10)
+
+
+def test_get_gen_rollups_by_period():
+    with mock.patch("pandas.read_sql") as mock_read_sql:
+        get_gen_rollups_by_period(Session(), 1, [1, 2], 5, datetime(2021, 1, 1), datetime(2021, 2, 28, 23, 59, 59), "1MS", "15T")
+        statement = mock_read_sql.call_args[0][0].compile(dialect=postgresql.dialect())
+
+    assert "GROUP BY gen_data_daily.gen_id, date_trunc('month', gen_data_daily.data_date)" in str(statement)
+    assert datetime(2021, 2, 28) in statement.params.values()
+
+
+def test_get_client_datas_by_period():
+    with mock.patch("pandas.read_sql") as mock_read_sql:
+        get_client_gen_datas_by_period(Session(), 3, datetime(2021, 1, 1), datetime(2021, 1, 31, 23, 59, 59), "1D", "15T")
+        gen_statement = str(mock_read_sql.call_args[0][0].compile(dialect=postgresql.dialect()))
+        get_client_sta_datas_by_period(Session(), 3, datetime(2021, 1, 1), datetime(2021, 1, 31, 23, 59, 59), "1D", "15T")
+        sta_statement = str(mock_read_sql.call_args[0][0].compile(dialect=postgresql.dialect()))
+        get_sta_datas_by_period(Session(), 3, 5, datetime(2021, 1, 1), datetime(2021, 1, 31, 23, 59, 59), None, "15T")
+        single_statement = str(mock_read_sql.call_args[0][0].compile(dialect=postgresql.dialect()))
+
+    assert "gen_data.cli_id = %(cli_id_1)s" in gen_statement and "gen_data.gen_id IN" not in gen_statement
+    assert "JOIN generator ON generator.gen_id_auto = anon_1.gen_id" in gen_statement
+    assert "min(station.sta_id_auto) AS sta_id" in gen_statement
+    assert "ON anon_3.loc_id = generator.loc_id" in gen_statement
+    assert "ON anon_2.sta_id = anon_3.sta_id AND anon_2.data_date = anon_1.data_date" in gen_statement
+    assert "sta_data.sta_id =" not in sta_statement
+    assert sta_statement.startswith("SELECT anon_1.sta_id, date_trunc('day', anon_1.data_date) AS data_date")
+    assert "GROUP BY anon_1.sta_id, date_trunc('day', anon_1.data_date)" in sta_statement
+    assert "sta_data.sta_id = %(sta_id_1)s" in single_statement and "GROUP BY anon_1.data_date" not in single_statement
+
+
+def test_check_daily_rollups():
+    expected_gen = pd.DataFrame({"gen_id": [1, 1], "data_date": [datetime(2021, 1, 1), datetime(2021, 1, 2)], "power": [1.0, 2.0],
+                                 "ac_production": [1.0, 2.0], "ac_production_prediction": [np.nan, np.nan], "data_count": [96, 96],
+                                 "unavailable_count": [0, 0], "last_ac_production": [0.0, 0.0]})
+    expected_sta = pd.DataFrame({"data_date": [datetime(2021, 1, 1), datetime(2021, 1, 2)], "ambient_temp_sum": [1.0, 2.0],
+                                 "module_temp_sum": [1.0, 2.0], "irradiation": [3.0, 4.0], "slot_count": [96, 96]})
+    stored_gen = expected_gen.iloc[:1].copy()
+    stored_sta = expected_sta.copy()
+    stored_sta.loc[1, "irradiation"] = 5.0
+    with mock.patch("db.utils.get_gen_ids_by_loc_id", return_value=pd.DataFrame({"gen_id_auto": [1]})), \
+            mock.patch("db.utils.get_sta_id_by_loc_id", return_value=pd.DataFrame({"sta_id_auto": [5]})), \
+            mock.patch("db.utils.compute_daily_rollups", return_value=(expected_gen, expected_sta)), \
+            mock.patch("pandas.read_sql", side_effect=[stored_gen, stored_sta]):
+        mismatches = check_daily_rollups(Session(), 1, 2, datetime(2021, 1, 1), datetime(2021, 1, 2))
+
+    assert mismatches[mismatches["table"] == "gen_data_daily"]["data_date"].unique().tolist() == [pd.Timestamp(2021, 1, 2)]
+    assert sorted(mismatches[mismatches["table"] == "gen_data_daily"]["column"]) == ["ac_production", "data_count", "last_ac_production",
+                                                                                    "power", "unavailable_count"]
+    assert mismatches[mismatches["table"] == "sta_data_daily"][["column", "expected", "stored"]].values.tolist() == [["irradiation", 4.0, 5.0]]
+
+
+def test_check_daily_rollups_without_station():
+    with mock.patch("db.utils.get_gen_ids_by_loc_id", return_value=pd.DataFrame({"gen_id_auto": [1]})), \
+            mock.patch("db.utils.get_sta_id_by_loc_id", return_value=pd.DataFrame({"sta_id_auto": []})), \
+            mock.patch("db.utils.compute_daily_rollups") as mock_compute_daily_rollups:
+        mismatches = check_daily_rollups(Session(), 1, 2, datetime(2021, 1, 1), datetime(2021, 1, 2))
+
+    assert mismatches.empty
+    assert mismatches.columns.tolist() == ["gen_id", "data_date", "table", "column", "expected", "stored"]
+    mock_compute_daily_rollups.assert_not_called()
+
+
+def test_read_sql_chunks_keeps_groups_together():
+    df = pd.DataFrame({"data_date": [datetime(2021, 1, 1, 0, 0, 0)] * 2 + [datetime(2021, 1, 1, 0, 15, 0)] * 3 + [datetime(2021, 1, 1, 0, 30, 0)],
+                       "data_type_id": [503, 505, 503, 504, 505, 503],
+                       "data_value": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]})
+    query = Session().query(GenData.data_date)
+    with mock.patch("pandas.read_sql") as mock_read_sql:
+        mock_read_sql.return_value = iter([df.iloc[0:3], df.iloc[3:6]])
+        chunks = list(read_sql_chunks(Session(), query, 3, group_columns=["data_date"]))
+
+    assert mock_read_sql.call_args.kwargs == {"chunksize": 3}
+    assert mock_read_sql.call_args[0][0].get_execution_options()["stream_results"]
+    assert [chunk["data_value"].tolist() for chunk in chunks] == [[1.0, 2.0], [3.0, 4.0, 5.0], [6.0]]
+
+
+def test_get_gen_datas_grouped_in_chunks():
+    with mock.patch("pandas.read_sql") as mock_read_sql:
+        mock_read_sql.return_value = iter([
+            pd.DataFrame({"gen_id": [1, 1], "data_date": [datetime(2021, 1, 1, 0, 0, 0), datetime(2021, 1, 1, 0, 15, 0)],
+                          "power": [1.0, 2.0], "ac_production": [3.0, None]}),
+            pd.DataFrame({"gen_id": [2], "data_date": [datetime(2021, 1, 1, 0, 0, 0)], "power": [None], "ac_production": [5.0]})
+        ])
+        chunks = list(get_gen_datas_grouped(Session(), 1, [1, 2], datetime(2021, 1, 1), datetime(2021, 1, 2), "15T",
+                                            {501: "power", 502: "ac_production", 508: "ac_production_prediction"}, chunksize=2))
+        statement = str(mock_read_sql.call_args[0][0].compile(dialect=postgresql.dialect()))
+
+    assert "ORDER BY gen_data.gen_id" in statement
+    assert [chunk.index.tolist() for chunk in chunks] == [[(1, pd.Timestamp(2021, 1, 1, 0, 0, 0)), (1, pd.Timestamp(2021, 1, 1, 0, 15, 0))],
+                                                          [(2, pd.Timestamp(2021, 1, 1, 0, 0, 0))]]
+    assert all(chunk.columns.tolist() == ["power", "ac_production", "ac_production_prediction"] for chunk in chunks)
+
+
+def test_read_sql_copy():
+    db = Session(bind=mock.MagicMock())
+    db.bind.dialect = postgresql.psycopg2.dialect()
+    cursor = db.bind.raw_connection.return_value.cursor.return_value.__enter__.return_value
+    cursor.mogrify.side_effect = lambda sql, params: (sql % {k: repr(v) for k, v in params.items()}).encode()
+    cursor.copy_expert.side_effect = lambda sql, buffer: buffer.write(
+        "gen_id,data_date,power\n1,2021-01-01 00:00:00,1.5\n2,2021-01-01 00:14:59.8,\n")
+
+    df = read_sql_copy(db, db.query(GenData.gen_id, GenData.data_date, GenData.data_value.label("power"))
+                       .filter(GenData.gen_id.in_([1, 2])).filter(GenData.cli_id == 3))
+
+    sql = cursor.copy_expert.call_args[0][0]
+    assert sql.startswith("COPY (SELECT gen_data.gen_id") and sql.endswith(") TO STDOUT WITH (FORMAT csv, HEADER true)")
+    assert "gen_data.gen_id IN (1, 2)" in sql and "gen_data.cli_id = 3" in sql
+    db.bind.raw_connection.return_value.close.assert_called_once()
+    assert df["data_date"].tolist() == [pd.Timestamp(2021, 1, 1, 0, 0, 0), pd.Timestamp(2021, 1, 1, 0, 14, 59, 800000)]
+    assert df["gen_id"].tolist() == [1, 2]
+    assert df["power"].iloc[0] == 1.5 and np.isnan(df["power"].iloc[1])
+
+
+def test_get_generators_by_client():
+    with mock.patch("pandas.read_sql") as mock_read_sql:
+        get_generators_by_client(Session(), [1, 2])
+        statement = str(mock_read_sql.call_args[0][0].compile(dialect=postgresql.dialect()))
+        get_generators_by_client(Session())
+        all_statement = str(mock_read_sql.call_args[0][0].compile(dialect=postgresql.dialect()))
+
+    assert "generator.gen_id_auto AS gen_id" in statement
+    assert "WHERE generator.cli_id IN" in statement
+    assert "WHERE" not in all_statement
+    assert "ORDER BY generator.cli_id, generator.loc_id, generator.gen_id_auto" in all_statement
+
+
+def test_update_alert_evaluated_dates():
+    session = mock.Mock()
+
+    update_alert_evaluated_dates(session, 1, [2, 3], datetime(2021, 1, 10))
+
+    statement = session.execute.call_args[0][0].compile(dialect=postgresql.dialect())
+    assert "ON CONFLICT (cli_id, gen_id) DO UPDATE SET cli_gen_alert_evaluated_date = greatest(cli_gen_alert_evaluation.cli_gen_alert_evaluated_date, excluded.cli_gen_alert_evaluated_date)" in str(statement)
+    assert [value for key, value in statement.params.items() if key.startswith("gen_id")] == [2, 3]
+    session.commit.assert_called_once()
+
+
+@pytest.mark.parametrize("ctr_code_2, loc_coord_lng, expected", [
+    ("UY", -56.2, "America/Montevideo"),
+    ("US", -74.0, "America/New_York"),
+    ("US", -118.2, "America/Los_Angeles"),
+    ("AU", 115.8, "Australia/Perth"),
+    ("XX", 0.0, None),
+    (None, 0.0, None),
+])
+def test_get_location_timezone(ctr_code_2, loc_coord_lng, expected):
+    metadata_cache.clear()
+    session = mock.MagicMock()
+    session.query.return_value.join.return_value.filter.return_value.first.return_value = mock.Mock(ctr_code_2=ctr_code_2, loc_coord_lng=loc_coord_lng)
+
+    assert get_location_timezone(session, 1) == expected